@@ -704,9 +704,30 @@ class CI2Runner(object):
         lastJobFinishCheckTime = time.time()
         jc.runTask(cOpenJob.jobId)
         
+        # The job controller records job ends in the database file: stat it (and its journal) often and
+        # only query when it changed, with a query every 4 s as a fallback
+        dbFile = self.pm.db()._fileName
+        dbFiles = [dbFile, dbFile + '-wal', dbFile + '-journal']
+        def dbStamp():
+            stamp = []
+            for path in dbFiles:
+                try:
+                    st = os.stat(path)
+                    stamp.append((st.st_mtime_ns, st.st_size))
+                except OSError:
+                    stamp.append(None)
+            return stamp
+        lastStamp = None
+        lastQueryTime = 0
         doContinue = True
         while doContinue:
             t = time.time()
+            stamp = dbStamp()
+            if stamp == lastStamp and t - lastQueryTime < 4:
+                time.sleep(0.2)
+                continue
+            lastStamp = stamp
+            lastQueryTime = t
             finishedJobs = self.pm.db().getRecentlyFinishedJobs(after=lastJobFinishCheckTime)
             print("Any recently finished jobs ...?")
             print(finishedJobs)
@@ -717,7 +738,6 @@ class CI2Runner(object):
                     if len(j)>5 and not j[5]:
                          print("... attempting to stop ...")
                          doContinue = False
-            time.sleep(4)
         
         print("Attempting to close DB...")
         self.pm.db().close()
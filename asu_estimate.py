@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: asu_estimate.py
+# Description: In-process estimate of the number of copies in the asymmetric unit (Z) from the Matthews
+#              coefficient, replacing a Phaser CCA run per MTZ and model set. Only the cell and the number
+#              of symmetry operators are read from the MTZ header, the molecular weight comes from the
+#              FASTA sequence(s). The most probable Z maximises the Kantardjieff & Rupp (2003) probability
+#              of the Matthews coefficient of protein crystals, among Z with at least 20% solvent.
+#              Results are cached in ${AUTOPD_CACHE:-~/.cache/autopd}/asu, keyed by the SHA-256 of the MTZ
+#              reflection data and of the sequence, so the same MTZ/sequence pair is only estimated once
+#              (the header is left out of the key: its history changes when ipcas_mtz.sh rewrites the file).
+#
+# Usage:
+#   python3 asu_estimate.py <MTZ> <FASTA> [--log asu_estimate.log]
+#       Prints the most probable Z (exit code 1 if the MTZ header or the sequence cannot be read).
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import struct
+import sys
+
+# Average residue masses (Da, peptide bond water removed)
+RESIDUE_MASS = {
+    'A': 71.08, 'R': 156.19, 'N': 114.10, 'D': 115.09, 'C': 103.14, 'E': 129.12, 'Q': 128.13, 'G': 57.05,
+    'H': 137.14, 'I': 113.16, 'L': 113.16, 'K': 128.17, 'M': 131.19, 'F': 147.18, 'P': 97.12, 'S': 87.08,
+    'T': 101.10, 'W': 186.21, 'Y': 163.18, 'V': 99.13, 'U': 150.04, 'O': 237.30,
+}
+AVERAGE_RESIDUE_MASS = 110.0
+WATER_MASS = 18.02
+# Kantardjieff & Rupp (2003), proteins: P(VM) = A exp(-exp(-z) - z k + 1), z = (VM - VM0) / w
+VM0 = 2.186
+WIDTH = 0.575
+SKEW = 0.667
+# Protein partial specific volume factor: solvent fraction = 1 - 1.23 / VM
+SOLVENT_FACTOR = 1.23
+MIN_SOLVENT = 0.2
+MAX_COPIES = 60
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def header_position(f):
+    """Byte offset of the header records and the byte order of the file."""
+    start = f.read(12)
+    if start[:4] != b'MTZ ':
+        raise ValueError(f"{f.name} is not an MTZ file")
+    # Machine stamp: 0x4 in the first nibble means little endian
+    endian = '<' if (start[9] >> 4) == 4 else '>'
+    return (struct.unpack(endian + 'i', start[4:8])[0] - 1) * 4
+
+
+def sha256_mtz_data(path):
+    """SHA-256 of the reflection records between the 80-byte file header and the header records."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        remaining = header_position(f) - 80
+        f.seek(80)
+        while remaining > 0:
+            block = f.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def read_mtz_header(path):
+    """Cell and number of symmetry operators from the MTZ header records (at the end of the file)."""
+    with open(path, 'rb') as f:
+        f.seek(header_position(f))
+        records = f.read()
+    cell = None
+    symmetry_operators = None
+    space_group = ''
+    for offset in range(0, len(records), 80):
+        record = records[offset:offset + 80].decode('ascii', 'replace')
+        if record.startswith('CELL'):
+            cell = [float(v) for v in record.split()[1:7]]
+        elif record.startswith('SYMINF'):
+            fields = record.split()
+            symmetry_operators = int(fields[1])
+            if "'" in record:
+                space_group = record.split("'")[1].replace(' ', '')
+        elif record.startswith('END'):
+            break
+    if cell is None or not symmetry_operators:
+        raise ValueError(f"CELL or SYMINF missing in {path}")
+    return cell, symmetry_operators, space_group
+
+
+def cell_volume(cell):
+    a, b, c = cell[:3]
+    alpha, beta, gamma = (math.radians(angle) for angle in cell[3:])
+    return a * b * c * math.sqrt(1 - math.cos(alpha) ** 2 - math.cos(beta) ** 2 - math.cos(gamma) ** 2
+                                 + 2 * math.cos(alpha) * math.cos(beta) * math.cos(gamma))
+
+
+def read_sequences(path):
+    sequences = []
+    current = []
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                if current:
+                    sequences.append(''.join(current))
+                current = []
+            elif line:
+                current.append(line.upper().replace('*', ''))
+    if current:
+        sequences.append(''.join(current))
+    return sequences
+
+
+def molecular_weight(sequences):
+    """Weight of one copy of the contents of the FASTA file (all chains)."""
+    return sum(sum(RESIDUE_MASS.get(residue, AVERAGE_RESIDUE_MASS) for residue in sequence) + WATER_MASS
+               for sequence in sequences)
+
+
+def matthews_probability(vm):
+    z = (vm - VM0) / WIDTH
+    return math.exp(-math.exp(-z) - z * SKEW + 1)
+
+
+def estimate(cell, symmetry_operators, weight):
+    """Rows (Z, VM, solvent fraction, relative probability) and the most probable Z."""
+    volume = cell_volume(cell)
+    rows = []
+    for copies in range(1, MAX_COPIES + 1):
+        vm = volume / (symmetry_operators * copies * weight)
+        solvent = 1 - SOLVENT_FACTOR / vm
+        if solvent < MIN_SOLVENT:
+            break
+        rows.append([copies, vm, solvent, matthews_probability(vm)])
+    total = sum(row[3] for row in rows) or 1.0
+    for row in rows:
+        row[3] /= total
+    best = max(rows, key=lambda row: row[3])[0] if rows else 1
+    return rows, best
+
+
+def cache_path(mtz_key, sequence_key):
+    directory = os.path.join(os.environ.get('AUTOPD_CACHE') or os.path.expanduser('~/.cache/autopd'), 'asu')
+    return os.path.join(directory, f"{mtz_key[:16]}_{sequence_key[:16]}.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Most probable number of copies in the ASU (Matthews coefficient)')
+    parser.add_argument('mtz', help='MTZ file (only the header is read)')
+    parser.add_argument('fasta', help='Sequence file of one copy of the ASU contents')
+    parser.add_argument('--log', default=None, help='Write the table of Z, VM, solvent and probability')
+    args = parser.parse_args()
+
+    try:
+        cell, symmetry_operators, space_group = read_mtz_header(args.mtz)
+        # Cell and symmetry are part of the key: they are stored in the header
+        mtz_key = hashlib.sha256(f"{sha256_mtz_data(args.mtz)} {cell} {symmetry_operators}".encode()).hexdigest()
+        sequence_key = sha256_file(args.fasta)
+    except (OSError, ValueError, IndexError, struct.error) as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+    path = cache_path(mtz_key, sequence_key)
+    result = None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    if result is None:
+        sequences = read_sequences(args.fasta)
+        if not sequences:
+            print(f"No sequence in {args.fasta}", file=sys.stderr)
+            sys.exit(1)
+        weight = molecular_weight(sequences)
+        rows, best = estimate(cell, symmetry_operators, weight)
+        result = {'z': best, 'space_group': space_group, 'cell': cell, 'symmetry_operators': symmetry_operators,
+                  'molecular_weight': weight, 'table': rows}
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=1)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    if args.log:
+        with open(args.log, 'w', encoding='utf-8') as f:
+            f.write(f"Space group {result['space_group']}, cell {' '.join('%.2f' % v for v in result['cell'])}, "
+                    f"MW {result['molecular_weight']:.0f} Da\n")
+            f.write("   Z      VM  Solvent  Probability\n")
+            for copies, vm, solvent, probability in result['table']:
+                f.write(f"{copies:4d}  {vm:6.2f}  {solvent * 100:6.1f}%  {probability:11.3f}\n")
+            f.write(f"Z={result['z']}\n")
+    print(result['z'])
+
+
+if __name__ == '__main__':
+    main()
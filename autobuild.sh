@@ -12,11 +12,12 @@
 #   6. Copy best results to AUTOBUILD_SUMMARY and SUMMARY folders.
 #
 # Usage:
-#   ./autobuild.sh <MTZ file>
+#   ./autobuild.sh <MTZ file> [model directory]
 #
 # Inputs:
 #   - MTZ : Input MTZ file with structure factor amplitudes
 #   - SUMMARY/BUCCANEER.pdb or SUMMARY/REFINEMENT.pdb or SUMMARY/PHASER.1.pdb
+#     (taken from the model directory instead of SUMMARY if given, e.g. BUILD_SEED for model_build=race)
 #
 # Outputs:
 #   - AUTOBUILD_SUMMARY/AUTOBUILD.pdb : Best Autobuild model
@@ -40,14 +41,15 @@ echo ""
 
 # Input variable
 MTZ=$(readlink -f "${1}")
+MODEL_DIR=$(readlink -f "${2:-SUMMARY}")
 
 # Determine the best available model for Autobuild
-if [ -f "SUMMARY/BUCCANEER.pdb" ] && [ $(echo "$r_free_buccaneer < $r_free_refine" | bc) -eq 1 ] && [ $(echo "$r_free_buccaneer > 0" | bc) -eq 1 ]; then
-    PDB=$(readlink -f "SUMMARY/BUCCANEER.pdb")
-elif [ -f "SUMMARY/REFINEMENT.pdb" ] && [ $(echo "$r_free_refine > 0" | bc) -eq 1 ]; then
-    PDB=$(readlink -f "SUMMARY/REFINEMENT.pdb")
+if [ -f "${MODEL_DIR}/BUCCANEER.pdb" ] && [ $(echo "$r_free_buccaneer < $r_free_refine" | bc) -eq 1 ] && [ $(echo "$r_free_buccaneer > 0" | bc) -eq 1 ]; then
+    PDB=$(readlink -f "${MODEL_DIR}/BUCCANEER.pdb")
+elif [ -f "${MODEL_DIR}/REFINEMENT.pdb" ] && [ $(echo "$r_free_refine > 0" | bc) -eq 1 ]; then
+    PDB=$(readlink -f "${MODEL_DIR}/REFINEMENT.pdb")
 else
-    PDB=$(readlink -f "SUMMARY/PHASER.1.pdb")
+    PDB=$(readlink -f "${MODEL_DIR}/PHASER.1.pdb")
 fi
 
 # Prepare working directory
@@ -55,23 +57,23 @@ rm -rf AUTOBUILD
 mkdir -p AUTOBUILD
 cd AUTOBUILD
 
-# Detect CPU count for parallelization
-nproc=$(nproc)
+# CPU slots granted by scheduler.py, otherwise all CPUs
+nproc=${AUTOPD_NPROC:-$(nproc)}
 
 # Run phenix.autobuild
-phenix.autobuild data=${MTZ} model=${PDB} nproc=$nproc  > AUTOBUILD.log
+${AUTOPD_PROFILE} phenix.autobuild data=${MTZ} model=${PDB} nproc=$nproc  > AUTOBUILD.log
 
 # Fallback strategy if Autobuild fails with current model
-if [ ! -f "AutoBuild_run_1_/overall_best.pdb" ] && [[ "$PDB" == *BUCCANEER.pdb ]] && [ -f "../SUMMARY/REFINEMENT.pdb" ]; then
-    PDB=$(readlink -f "../SUMMARY/REFINEMENT.pdb")
+if [ ! -f "AutoBuild_run_1_/overall_best.pdb" ] && [[ "$PDB" == *BUCCANEER.pdb ]] && [ -f "${MODEL_DIR}/REFINEMENT.pdb" ]; then
+    PDB=$(readlink -f "${MODEL_DIR}/REFINEMENT.pdb")
     rm -rf ./*
-    phenix.autobuild data=${MTZ} model=${PDB} nproc=$nproc  > AUTOBUILD.log
+    ${AUTOPD_PROFILE} phenix.autobuild data=${MTZ} model=${PDB} nproc=$nproc  > AUTOBUILD.log
 fi
 
-if [ ! -f "AutoBuild_run_1_/overall_best.pdb" ] && [[ "$PDB" == *REFINEMENT.pdb ]] && [ -f "../SUMMARY/PHASER.1.pdb" ]; then
-    PDB=$(readlink -f "../SUMMARY/PHASER.1.pdb")
+if [ ! -f "AutoBuild_run_1_/overall_best.pdb" ] && [[ "$PDB" == *REFINEMENT.pdb ]] && [ -f "${MODEL_DIR}/PHASER.1.pdb" ]; then
+    PDB=$(readlink -f "${MODEL_DIR}/PHASER.1.pdb")
     rm -rf ./*
-    phenix.autobuild data=${MTZ} model=${PDB} nproc=$nproc  > AUTOBUILD.log
+    ${AUTOPD_PROFILE} phenix.autobuild data=${MTZ} model=${PDB} nproc=$nproc  > AUTOBUILD.log
 fi
 
 # Extract solution summary from the log
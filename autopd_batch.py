@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: autopd_batch.py
+# Description: Batch driver running autopipeline.sh for many datasets (e.g. a whole beamtime shift) on one
+#              shared CPU and memory budget. The datasets are read from a manifest with per-dataset options
+#              and started by priority (scheduler.py) as soon as their share of the budget is free. All runs
+#              share <batch>/SHARED (shared_dir=), so that datasets with the same sequence and search model
+#              options generate their search models once (checkpoint.py); the AlphaFold DB and PDB caches are
+#              shared anyway. When all runs finished, a summary table of the datasets is written.
+#
+# Usage:
+#   python3 autopd_batch.py run manifest.csv|manifest.json [--out AutoPD_batch] [--jobs 4] [--cpus N]
+#                               [--mem-gb M] [--set key=value ...]
+#   python3 autopd_batch.py summary AutoPD_batch
+#
+# Manifest:
+#   CSV with a header line, or JSON (a list of datasets, or {"defaults": {...}, "datasets": [...]}). Every
+#   column is an option of autopipeline.sh (data_path, seq_file, mtz_file, z, space_group, ...), except:
+#     name       Name of the dataset and of its output directory <batch>/<name> (default: from data_path)
+#     priority   Higher priorities start first (default: 0)
+#     nproc      CPUs of the dataset (default: --cpus / --jobs)
+#     mem_gb     Memory of the dataset in GB (default: --mem-gb / --jobs)
+#   Empty cells are left out; relative paths are relative to the manifest. --set gives defaults for all.
+#
+# Outputs (in the batch directory):
+#   <name>/              Output directory of every dataset, its log in LOGS/<name>.log
+#   SHARED/              Search models shared between the datasets
+#   BATCH.json           Datasets, commands and exit codes
+#   BATCH_SUMMARY.txt    One line per dataset: status, time, best data reduction and best model
+#
+# Exit Codes:
+#   0  All datasets finished successfully
+#   1  At least one dataset failed, or the manifest is invalid
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+import shlex
+import signal
+import sys
+import time
+
+from dr_quality import read_overall_statistics
+from rank_models import write_table
+from scheduler import Job, Scheduler, available_cpus, available_mem_mb
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Manifest columns read by the batch driver itself
+BATCH_KEYS = ['name', 'priority', 'nproc', 'mem_gb']
+# Options holding paths, resolved relative to the manifest
+PATH_KEYS = ['data_path', 'seq_file', 'mtz_file', 'pdb_path', 'resume']
+# Options set by the batch driver
+RESERVED_KEYS = ['out_dir', 'shared_dir']
+SUMMARY_FIELDS = ['name', 'priority', 'status', 'time', 'search_models', 'pipeline', 'space_group', 'resolution',
+                  'rmeas', 'cchalf', 'completeness', 'model', 'r_free', 'out_dir']
+
+
+def parse_settings(settings):
+    """key=value pairs of --set."""
+    values = {}
+    for setting in settings:
+        if '=' not in setting:
+            raise ValueError(f"--set needs key=value, got {setting}")
+        key, value = setting.split('=', 1)
+        values[key.strip()] = value
+    return values
+
+
+def read_manifest(path, defaults=None):
+    """Datasets of a CSV or JSON manifest as dicts of option -> value (strings)."""
+    if path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            base = data.get('defaults', {})
+            rows = [dict(base, **row) for row in data.get('datasets', [])]
+        else:
+            rows = data
+    else:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            lines = [line for line in f if line.strip() and not line.lstrip().startswith('#')]
+        rows = list(csv.DictReader(lines))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    datasets = []
+    for row in rows:
+        dataset = dict(defaults or {})
+        for key, value in row.items():
+            if key is None or value is None or str(value).strip() == '':
+                continue
+            dataset[key.strip()] = str(value).strip()
+        for key in RESERVED_KEYS:
+            if key in dataset:
+                raise ValueError(f"{key} is set by the batch driver, use name for the output directory")
+        for key in PATH_KEYS:
+            if key in dataset:
+                dataset[key] = os.path.join(directory, os.path.expanduser(dataset[key]))
+        if 'data_path' not in dataset and 'mtz_file' not in dataset:
+            raise ValueError(f"Dataset without data_path or mtz_file: {row}")
+        datasets.append(dataset)
+    return datasets
+
+
+def dataset_names(datasets):
+    """Unique directory names: the name column, else the base name of the data."""
+    names = []
+    for number, dataset in enumerate(datasets, 1):
+        source = dataset.get('data_path') or dataset.get('mtz_file')
+        name = dataset.get('name') or os.path.splitext(os.path.basename(source.rstrip('/')))[0]
+        name = re.sub(r'[^\w.-]+', '_', name) or f"dataset_{number}"
+        unique = name
+        suffix = 1
+        while unique in names:
+            unique = f"{name}_{suffix}"
+            suffix += 1
+        names.append(unique)
+    return names
+
+
+def sequence_key(dataset):
+    path = dataset.get('seq_file')
+    if not path or not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def new_directory(path):
+    """path, or path_<n> if it exists (like out_dir of autopipeline.sh)."""
+    candidate = path
+    suffix = 1
+    while os.path.exists(candidate):
+        candidate = f"{path}_{suffix}"
+        suffix += 1
+    os.makedirs(candidate)
+    return os.path.abspath(candidate)
+
+
+class BatchScheduler(Scheduler):
+    """Scheduler reporting every start and end of a dataset."""
+
+    def start(self, job):
+        super().start(job)
+        print(f"{time.strftime('%H:%M:%S')}  {job.name} started ({job.slots} CPUs, priority {job.priority})",
+              flush=True)
+
+    def reap(self):
+        running = list(self.running)
+        super().reap()
+        for job in running:
+            if job.returncode is not None:
+                status = 'finished' if job.returncode == 0 else f"failed (exit code {job.returncode})"
+                print(f"{time.strftime('%H:%M:%S')}  {job.name} {status}", flush=True)
+
+
+def write_batch(batch_dir, entries):
+    tmp_path = os.path.join(batch_dir, 'BATCH.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=2)
+    os.replace(tmp_path, os.path.join(batch_dir, 'BATCH.json'))
+
+
+def run_batch(args):
+    try:
+        datasets = read_manifest(args.manifest, parse_settings(args.set))
+    except (OSError, ValueError, csv.Error) as error:
+        print(f"Error: {error}")
+        return 1
+    if not datasets:
+        print("Error: no datasets in the manifest")
+        return 1
+
+    cpus = args.cpus or available_cpus()
+    mem_mb = args.mem_gb * 1024 if args.mem_gb else available_mem_mb()
+    jobs = max(1, min(args.jobs, len(datasets)))
+    batch_dir = new_directory(args.out)
+    shared_dir = os.path.join(batch_dir, 'SHARED')
+    os.makedirs(os.path.join(batch_dir, 'LOGS'))
+    os.makedirs(shared_dir)
+
+    sequences = {key for key in map(sequence_key, datasets) if key}
+    print(f"Batch: {len(datasets)} datasets, {len(sequences)} distinct sequences, {jobs} at a time on "
+          f"{cpus} CPUs and {mem_mb} MB")
+    print(f"Output: {batch_dir}")
+
+    scheduler = BatchScheduler(cpus, mem_mb, poll_interval=5)
+    entries = []
+    for name, dataset in zip(dataset_names(datasets), datasets):
+        options = {key: value for key, value in dataset.items() if key not in BATCH_KEYS}
+        options['out_dir'] = os.path.join(batch_dir, name)
+        options['shared_dir'] = shared_dir
+        arguments = ' '.join(shlex.quote(f"{key}={value}") for key, value in options.items())
+        log = os.path.join(batch_dir, 'LOGS', f"{name}.log")
+        command = (f"cd {shlex.quote(batch_dir)} && {shlex.quote(os.path.join(SOURCE_DIR, 'autopipeline.sh'))} "
+                   f"{arguments} > {shlex.quote(log)} 2>&1")
+        job_cpus = int(dataset['nproc']) if 'nproc' in dataset else max(1, cpus // jobs)
+        job_mem_mb = int(float(dataset['mem_gb']) * 1024) if 'mem_gb' in dataset else max(1, mem_mb // jobs)
+        priority = int(dataset.get('priority', 0))
+        scheduler.add(Job(name, command, job_cpus, job_mem_mb, priority))
+        entries.append({'name': name, 'priority': priority, 'out_dir': options['out_dir'], 'log': log,
+                        'command': command, 'returncode': None, 'time': None})
+    write_batch(batch_dir, entries)
+
+    signal.signal(signal.SIGTERM, lambda *_: (scheduler.terminate(), sys.exit(143)))
+    signal.signal(signal.SIGINT, lambda *_: (scheduler.terminate(), sys.exit(130)))
+    returncode = scheduler.run()
+
+    finished = {job.name: job for job in scheduler.finished}
+    for entry in entries:
+        job = finished.get(entry['name'])
+        if job is not None:
+            entry['returncode'] = job.returncode
+            entry['time'] = int(job.end_time - job.start_time)
+    write_batch(batch_dir, entries)
+    print_summary(batch_dir)
+    return returncode
+
+
+def format_time(seconds):
+    if seconds is None:
+        return ''
+    return f"{seconds // 3600}h{(seconds % 3600) // 60:02d}m"
+
+
+def best_reduction(out_dir):
+    """Statistics of the reduction pipeline with the best resolution (then Rmeas)."""
+    best = {}
+    for path in glob.glob(os.path.join(out_dir, 'DATA_REDUCTION', 'DATA_REDUCTION_SUMMARY', '*_STATISTICS.json')):
+        try:
+            stats = read_overall_statistics(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                space_group = json.load(f).get('space_group', '')
+        except (OSError, ValueError):
+            continue
+        if 'resolution' not in stats:
+            continue
+        key = (stats['resolution'], stats.get('rmeas', 1.0))
+        if not best or key < best['key']:
+            best = dict(stats, key=key, space_group=space_group,
+                        pipeline=os.path.basename(path)[:-len('_STATISTICS.json')])
+    best.pop('key', None)
+    return best
+
+
+def best_model(out_dir):
+    """Model in SUMMARY with the lowest R-free (REMARK 3 of the refined PDB files)."""
+    best = {}
+    for path in glob.glob(os.path.join(out_dir, 'SUMMARY', '*.pdb')):
+        r_free = None
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                if line.startswith('REMARK   3') and 'FREE R VALUE' in line and ':' in line:
+                    match = re.match(r'\s*([0-9.]+)', line.split(':', 1)[1])
+                    if match:
+                        r_free = float(match.group(1))
+                        break
+                elif line.startswith(('ATOM', 'HETATM')):
+                    break
+        if r_free and (not best or r_free < best['r_free']):
+            best = {'model': os.path.basename(path), 'r_free': r_free}
+    return best
+
+
+def search_model_source(out_dir):
+    """How the search models of a run were obtained (checkpoint.py)."""
+    try:
+        with open(os.path.join(out_dir, 'CHECKPOINTS.json'), 'r', encoding='utf-8') as f:
+            entry = json.load(f).get('search_model', {})
+    except (OSError, ValueError):
+        return ''
+    if entry.get('status') != 'complete':
+        return entry.get('status', '')
+    source = entry.get('restored_from', '')
+    if not source:
+        return 'generated'
+    return 'shared' if os.path.basename(source).startswith('search_model-') else 'resumed'
+
+
+def summary_rows(entries):
+    rows = []
+    for entry in entries:
+        out_dir = entry['out_dir']
+        if entry['returncode'] is None:
+            status = 'not run'
+        else:
+            status = 'ok' if entry['returncode'] == 0 else f"failed ({entry['returncode']})"
+        row = {'name': entry['name'], 'priority': entry['priority'], 'status': status,
+               'time': format_time(entry['time']), 'search_models': search_model_source(out_dir),
+               'out_dir': os.path.basename(out_dir)}
+        reduction = best_reduction(out_dir)
+        for key in ['pipeline', 'space_group']:
+            row[key] = reduction.get(key, '')
+        for key, fmt in [('resolution', '.2f'), ('rmeas', '.3f'), ('cchalf', '.3f'), ('completeness', '.1f')]:
+            row[key] = format(reduction[key], fmt) if key in reduction else ''
+        model = best_model(out_dir)
+        row['model'] = model.get('model', '')
+        row['r_free'] = f"{model['r_free']:.4f}" if model else ''
+        rows.append(row)
+    return rows
+
+
+def print_summary(batch_dir):
+    with open(os.path.join(batch_dir, 'BATCH.json'), 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    path = os.path.join(batch_dir, 'BATCH_SUMMARY.txt')
+    write_table([dict(zip(SUMMARY_FIELDS, SUMMARY_FIELDS))] + summary_rows(entries), SUMMARY_FIELDS, path)
+    print("")
+    with open(path, 'r', encoding='utf-8') as f:
+        print(f.read(), end='')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run AutoPD for the datasets of a manifest on one shared budget')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run all datasets of a manifest')
+    run_parser.add_argument('manifest', help='CSV or JSON manifest of the datasets')
+    run_parser.add_argument('--out', default='AutoPD_batch', help='Batch directory (default: AutoPD_batch)')
+    run_parser.add_argument('--jobs', type=int, default=4, help='Datasets run at the same time by default (default: 4)')
+    run_parser.add_argument('--cpus', type=int, default=None, help='CPU budget (default: AUTOPD_CPUS or all CPUs)')
+    run_parser.add_argument('--mem-gb', type=int, default=None, help='Memory budget in GB (default: available memory)')
+    run_parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                            help='Option of autopipeline.sh for every dataset; may be repeated')
+
+    summary_parser = subparsers.add_parser('summary', help='Rewrite BATCH_SUMMARY.txt of a batch directory')
+    summary_parser.add_argument('batch_dir', help='Batch directory')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        sys.exit(run_batch(args))
+    try:
+        print_summary(args.batch_dir)
+    except (OSError, ValueError) as error:
+        print(f"Error: {error}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
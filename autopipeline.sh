@@ -29,11 +29,38 @@
 #   distance        Crystal-to-detector distance (mm)
 #   image_start,end Image range to process (numbers only)
 #   ipcas_cycle     Number of IPCAS cycles (default: 20)
+#   ipcas_patience  Stop IPCAS once R-free has not improved for this many cycles, 0 runs all cycles (default: 5)
 #   af_predict      true/false: Run AlphaFold prediction
 #   af_split        true/false: Split AlphaFold models with Phenix
-#   pae_split       true/false: Split AlphaFold models using PAE with CCP4
+#   pae_split       true/false: Split AlphaFold models into domains using the PAE matrix
 #   sad             true/false: Enable SAD phasing
-#   model_build     Strategy for model building (if specified)
+#   model_build     Strategy for model building (if specified): autobuild, all, or race (builders run at once)
+#   build_rfree     model_build=race: R-free that stops the other builders (default: 0.35)
+#   nproc           CPU budget shared by parallel jobs (default: all CPUs)
+#   mem_gb          Memory budget in GB shared by parallel jobs (default: available memory)
+#   race            true/false: Stop the other reduction pipelines once one MTZ is good enough
+#   race_rmeas      Race mode threshold: maximum overall Rmeas (default: 0.2)
+#   race_cchalf     Race mode threshold: minimum overall CC(1/2) (default: 0.95)
+#   race_completeness Race mode threshold: minimum overall completeness (default: 90)
+#   race_resolution Race mode threshold: maximum high resolution limit (default: none)
+#   xds_reuse       true/false: Second XDS round reuses spots and integration of the first (default: true)
+#   xds_nodes       XDS INTEGRATE split over N local jobs (number) or over hosts (comma-separated list)
+#   xds_submit      Command template of the distributed INTEGRATE jobs (default: "ssh {host} bash {script}")
+#   stream          true/false: Start while the frames are still being collected in data_path (default: false)
+#   stream_frames   Stream mode: expected number of frames of the sweep
+#   stream_idle     Stream mode: seconds without a new frame that end the sweep (default: 60)
+#   stream_wedge    Stream mode: frames needed for spot finding and indexing (default: 100)
+#   model_cache     true/false: Restore search models of a sequence seen before from the cache (default: true)
+#   mrparse_jobs    Concurrent MrParse jobs, one per chain of the sequence (default: 4)
+#   mr_jobs         Concurrent Phaser MR jobs; the others stop after a decisive solution (default: 4)
+#   triage          Distinct MTZs of data reduction passed to MR and SAD (default: 2, 0: all MTZs)
+#   phaser_cca      true/false: Cross-check the Matthews estimate of Z with Phaser CCA (default: false)
+#   overlap         true/false: Start MR on the first MTZs while data reduction goes on, SAD right after it (default: false)
+#   stage_timeout   Wall-clock limit of each stage, e.g. 12h (default: none)
+#   stage_mem_gb    Limit on the resident memory of each stage in GB (default: none)
+#   resume          Earlier output directory; stages whose inputs are unchanged are copied from it
+#   shared_dir      Directory shared by several runs; search models of the same sequence are generated once
+#   profile         true/false: Record every external tool call in SUMMARY/PROFILE.jsonl
 #
 # Exit Codes:
 #   0  Success (pipeline completed normally)
@@ -72,11 +99,38 @@ DISTANCE=""
 IMAGE_START=""
 IMAGE_END=""
 IPCAS_CYCLE="20"
+IPCAS_PATIENCE="5"
 AF_PREDICT="false"
 AF_SPLIT="true"
 PAE_SPLIT="false"
 SAD="false"
 MODEL_BUILD=""
+NPROC=""
+MEM_GB=""
+RACE="false"
+RACE_RMEAS="0.2"
+RACE_CCHALF="0.95"
+RACE_COMPLETENESS="90"
+RACE_RESOLUTION=""
+XDS_REUSE="true"
+XDS_NODES=""
+XDS_SUBMIT=""
+STREAM=""
+STREAM_FRAMES=""
+STREAM_IDLE=""
+STREAM_WEDGE=""
+MODEL_CACHE="true"
+MRPARSE_JOBS="4"
+MR_JOBS="4"
+TRIAGE="2"
+PHASER_CCA="false"
+OVERLAP="false"
+STAGE_TIMEOUT=""
+STAGE_MEM_GB=""
+BUILD_RFREE="0.35"
+RESUME_DIR=""
+SHARED_DIR=""
+PROFILE="false"
 
 #############################################
 # Parse command-line arguments
@@ -105,11 +159,38 @@ for arg in "$@"; do
       image_start) IMAGE_START="$value" ;;       #Process a specific image range within a scan. image_start and image_end are numbers denoting the image range
       image_end) IMAGE_END="$value" ;;           #Process a specific image range within a scan. image_start and image_end are numbers denoting the image range
       ipcas_cycle) IPCAS_CYCLE="$value" ;;       #IPCAS cycle
+      ipcas_patience) IPCAS_PATIENCE="$value" ;; #IPCAS early stopping
       af_predict) AF_PREDICT="$value" ;;         #AlphaFold Prediction by Phenix
       af_split) AF_SPLIT="$value" ;;             #Splitting by Phenix
       pae_split) PAE_SPLIT="$value" ;;           #PAE Splitting by CCP4
       sad) SAD="$value" ;;                       #SAD will be performed
       model_build) MODEL_BUILD="$value" ;;       #Model building strategy
+      nproc) NPROC="$value" ;;                   #CPU budget of the scheduler
+      mem_gb) MEM_GB="$value" ;;                 #Memory budget of the scheduler (GB)
+      race) RACE="$value" ;;                     #Race mode for data reduction
+      race_rmeas) RACE_RMEAS="$value" ;;         #Race mode: maximum overall Rmeas
+      race_cchalf) RACE_CCHALF="$value" ;;       #Race mode: minimum overall CC(1/2)
+      race_completeness) RACE_COMPLETENESS="$value" ;; #Race mode: minimum overall completeness
+      race_resolution) RACE_RESOLUTION="$value" ;; #Race mode: maximum high resolution limit
+      xds_reuse) XDS_REUSE="$value" ;;           #Second XDS round reuses the first round
+      xds_nodes) XDS_NODES="$value" ;;           #Distributed XDS INTEGRATE: jobs or hosts
+      xds_submit) XDS_SUBMIT="$value" ;;         #Distributed XDS INTEGRATE: submit command
+      stream) STREAM="$value" ;;                 #Process while collecting
+      stream_frames) STREAM_FRAMES="$value" ;;   #Stream mode: expected number of frames
+      stream_idle) STREAM_IDLE="$value" ;;       #Stream mode: seconds without a new frame ending the sweep
+      stream_wedge) STREAM_WEDGE="$value" ;;     #Stream mode: frames of the first wedge
+      model_cache) MODEL_CACHE="$value" ;;       #Search model cache
+      mrparse_jobs) MRPARSE_JOBS="$value" ;;     #Concurrent MrParse jobs
+      mr_jobs) MR_JOBS="$value" ;;               #Concurrent Phaser MR jobs
+      triage) TRIAGE="$value" ;;                 #Distinct MTZs passed to MR and SAD
+      phaser_cca) PHASER_CCA="$value" ;;         #Cross-check Z with Phaser CCA
+      overlap) OVERLAP="$value" ;;               #Stage overlap of data reduction, MR and SAD
+      stage_timeout) STAGE_TIMEOUT="$value" ;;   #Wall-clock limit per stage
+      stage_mem_gb) STAGE_MEM_GB="$value" ;;     #Memory limit per stage
+      build_rfree) BUILD_RFREE="$value" ;;       #Target R-free of the model building race
+      resume) RESUME_DIR="$value" ;;             #Earlier output directory to reuse completed stages from
+      shared_dir) SHARED_DIR="$value" ;;         #Directory of stage outputs shared between runs
+      profile) PROFILE="$value" ;;               #Profile external tool calls
       *) echo "Invalid parameter: $arg" >&2; exit 1;;
     esac
   else
@@ -124,9 +205,75 @@ DATA_PATH=$(readlink -f "${DATA_PATH}")
 SEQUENCE=$(readlink -f "${SEQUENCE}")
 EXPERIMENT=$(readlink -f "${EXPERIMENT}")
 MR_TEMPLATE_PATH=$(readlink -f "${MR_TEMPLATE_PATH}")
+if [ -n "${RESUME_DIR}" ]; then
+    RESUME_DIR=$(readlink -f "${RESUME_DIR}")
+fi
+if [ -n "${SHARED_DIR}" ]; then
+    mkdir -p "${SHARED_DIR}"
+    export AUTOPD_SHARED=$(readlink -f "${SHARED_DIR}")
+fi
 
 # Export key variables for child scripts
 export SOURCE_DIR DATA_PATH SEQUENCE UNIPROT_ID ROTATION_AXIS BEAM_X BEAM_Y DISTANCE IMAGE_START IMAGE_END Z_INPUT ATOM SPACE_GROUP_INPUT CELL_CONSTANTS_INPUT AF_PREDICT PAE_SPLIT IPCAS_CYCLE MODEL_BUILD AF_SPLIT
+export RACE RACE_RMEAS RACE_CCHALF RACE_COMPLETENESS RACE_RESOLUTION XDS_REUSE XDS_NODES XDS_SUBMIT STREAM STREAM_FRAMES STREAM_IDLE STREAM_WEDGE MODEL_CACHE MRPARSE_JOBS MR_JOBS TRIAGE PHASER_CCA OVERLAP STAGE_TIMEOUT STAGE_MEM_GB BUILD_RFREE IPCAS_PATIENCE
+export EXPERIMENT DATE RESUME_DIR
+
+# Resource budget used by scheduler.py for every parallel fan-out
+if [ -n "${NPROC}" ]; then
+    export AUTOPD_CPUS=${NPROC}
+fi
+if [ -n "${MEM_GB}" ]; then
+    export AUTOPD_MEM_MB=$(( MEM_GB * 1024 ))
+fi
+
+#############################################
+# Stage checkpoints
+#############################################
+# Run a stage unless checkpoint.py restores it from RESUME_DIR, then record it in CHECKPOINTS.json
+# Run a stage command, under supervisor.py when stage_timeout or stage_mem_gb is set: the whole process
+# tree of the stage is stopped at its limits (exit code 123: memory, 124: wall clock)
+run_limited() {
+  local stage=$1
+  shift
+  if [ -n "${STAGE_TIMEOUT}" ] || [ -n "${STAGE_MEM_GB}" ]; then
+    local limits=()
+    [ -n "${STAGE_TIMEOUT}" ] && limits+=(--timeout ${STAGE_TIMEOUT})
+    [ -n "${STAGE_MEM_GB}" ] && limits+=(--mem-mb $((STAGE_MEM_GB * 1024)))
+    python3 ${SOURCE_DIR}/supervisor.py run --name ${stage} "${limits[@]}" -- bash -c "$*"
+    local status=$?
+    if [ ${status} -eq 123 ] || [ ${status} -eq 124 ]; then
+      echo "Stage ${stage} stopped at its limits."
+    fi
+    return ${status}
+  fi
+  eval "$@"
+}
+export -f run_limited
+
+# Checkpointed stage; a stage stopped at its limits is not checkpointed
+run_stage() {
+  local stage=$1
+  shift
+  if python3 ${SOURCE_DIR}/checkpoint.py restore ${stage}; then
+    return 0
+  fi
+  run_limited ${stage} "$@"
+  local status=$?
+  if [ ${status} -eq 123 ] || [ ${status} -eq 124 ]; then
+    return ${status}
+  fi
+  python3 ${SOURCE_DIR}/checkpoint.py record ${stage}
+}
+export -f run_stage
+
+# Stage overlap: SAD as soon as data reduction has finished, if the anomalous signal is strong enough
+sad_after_reduction() {
+  if [ -d "DATA_REDUCTION/SAD_INPUT" ] && find "DATA_REDUCTION/SAD_INPUT" -maxdepth 1 -type f -size +0 2>/dev/null | grep -q .; then
+    echo "SAD starts while the search models are generated."
+    run_stage sad "${SOURCE_DIR}/sad.sh 0"
+  fi
+}
+export -f sad_after_reduction
 
 #############################################
 # Prepare output directories
@@ -143,6 +290,15 @@ mkdir -p ${OUT_DIR}
 cd ${OUT_DIR}
 mkdir -p SUMMARY INPUT_FILES SEARCH_MODELS/HOMOLOGS SEARCH_MODELS/AF_MODELS SEARCH_MODELS/INPUT_MODELS
 
+# Read-only MTZ artefacts shared by the MR, SAD and IPCAS jobs (mtz_store.py)
+export MTZ_STORE=$(pwd)/MTZ_STORE
+
+# Profiling: scripts prefix external programs with ${AUTOPD_PROFILE}
+if [ "${PROFILE}" = "true" ]; then
+    export AUTOPD_PROFILE="python3 ${SOURCE_DIR}/tool_profile.py run --"
+    export AUTOPD_PROFILE_LOG=$(pwd)/SUMMARY/PROFILE.jsonl
+fi
+
 #############################################
 # Input checks
 #############################################
@@ -207,13 +363,31 @@ if [ "${DR}" = "false" ] && [ "${MP}" = "false" ]; then
 elif [ "${DR}" = "false" ]; then
   echo ""
   echo "Data reduction will be skipped."
-  ${SOURCE_DIR}/search_model.sh ${DATE} | tee SEARCH_MODEL.log
+  run_stage search_model "${SOURCE_DIR}/search_model.sh ${DATE} | tee SEARCH_MODEL.log"
 elif [ "${MP}" = "false" ]; then
   echo ""
   echo "MrParse will be skipped."
-  ${SOURCE_DIR}/data_reduction.sh | tee DATA_REDUCTION.log
+  run_stage data_reduction "${SOURCE_DIR}/data_reduction.sh | tee DATA_REDUCTION.log"
+elif [ "${OVERLAP}" = "true" ] && [ -z "${RESUME_DIR}" ]; then
+  # Stage overlap: MR (mr.sh overlap) waits for the search models and takes every MTZ as soon as a
+  # reduction pipeline finished it; SAD starts right after data reduction. The .done files mark the end
+  # of a stage whether it succeeded or not. mr.sh mostly waits, so it runs outside the CPU budget and
+  # data reduction gets the same share as without overlap; its Phaser jobs are bounded by mr_jobs.
+  (
+    run_limited mr "${SOURCE_DIR}/mr.sh 0 overlap"
+    status=$?
+    if [ ${status} -eq 123 ] || [ ${status} -eq 124 ]; then
+      touch .MR.stopped
+    fi
+  ) &
+  mr_pid=$!
+  python3 ${SOURCE_DIR}/scheduler.py run --job SEARCH_MODEL:4 "run_stage search_model '${SOURCE_DIR}/search_model.sh ${DATE} | tee SEARCH_MODEL.log'; touch .SEARCH_MODEL.done" --job DATA_REDUCTION "run_stage data_reduction '${SOURCE_DIR}/data_reduction.sh | tee DATA_REDUCTION.log'; touch .DATA_REDUCTION.done; sad_after_reduction"
+  # Both stages have ended, even if their jobs were stopped before touching the .done files
+  touch .SEARCH_MODEL.done .DATA_REDUCTION.done
+  wait ${mr_pid}
 else    
-  parallel -u ::: "${SOURCE_DIR}/search_model.sh ${DATE} | tee SEARCH_MODEL.log" "${SOURCE_DIR}/data_reduction.sh | tee DATA_REDUCTION.log"
+  # MrParse and the model downloads need few CPUs, data reduction gets the rest
+  python3 ${SOURCE_DIR}/scheduler.py run --job SEARCH_MODEL:4 "run_stage search_model '${SOURCE_DIR}/search_model.sh ${DATE} | tee SEARCH_MODEL.log'" --job DATA_REDUCTION "run_stage data_reduction '${SOURCE_DIR}/data_reduction.sh | tee DATA_REDUCTION.log'"
 fi
 
 # Require sequence for further steps
@@ -233,7 +407,12 @@ fi
 #############################################
 if [ -d "DATA_REDUCTION/SAD_INPUT" ] && find "DATA_REDUCTION/SAD_INPUT" -maxdepth 1 -type f -size +0 2>/dev/null | grep -q .; then
     SAD="true"
-    echo "SAD will be performed."
+    if [ -f "SAD/SAD_SUMMARY/crank2.log" ] && [ "${OVERLAP}" = "true" ]; then
+        SAD_DONE="true"
+        echo "SAD was performed during search model generation."
+    else
+        echo "SAD will be performed."
+    fi
 else
     echo "No strong anomalous signal was found."
 fi
@@ -261,13 +440,17 @@ if [ "${MR}" = "false" ] && [ "${SAD}" != "true" ]; then
 elif [ "${MR}" = "false" ]; then
   echo ""
   echo "MR will be skipped."
-  ${SOURCE_DIR}/sad.sh ${MTZ_IN}
-elif [ "${SAD}" != "true" ]; then
+  if [ "${SAD_DONE}" != "true" ]; then
+    run_stage sad "${SOURCE_DIR}/sad.sh ${MTZ_IN}"
+  fi
+elif [ "${SAD}" != "true" ] || [ "${SAD_DONE}" = "true" ]; then
   echo ""
-  echo "SAD will be skipped."
+  if [ "${SAD}" != "true" ]; then
+    echo "SAD will be skipped."
+  fi
   ${SOURCE_DIR}/mr_model_build.sh ${MTZ_IN}
 else    
-  parallel -u ::: "${SOURCE_DIR}/sad.sh ${MTZ_IN}" "${SOURCE_DIR}/mr_model_build.sh ${MTZ_IN}"
+  python3 ${SOURCE_DIR}/scheduler.py run --job SAD "run_stage sad '${SOURCE_DIR}/sad.sh ${MTZ_IN}'" --job MR "${SOURCE_DIR}/mr_model_build.sh ${MTZ_IN}"
 fi 
 
 #############################################
@@ -279,3 +462,8 @@ hours=$((total_time / 3600))
 minutes=$(( (total_time % 3600) / 60 ))
 seconds=$((total_time % 60))
 echo "Total time: ${hours}h ${minutes}m ${seconds}s"
+
+if [ -s "${AUTOPD_PROFILE_LOG}" ]; then
+    echo ""
+    python3 ${SOURCE_DIR}/tool_profile.py summary ${AUTOPD_PROFILE_LOG} | tee SUMMARY/PROFILE_SUMMARY.txt
+fi
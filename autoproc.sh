@@ -11,7 +11,7 @@
 #   ./autoproc.sh round=1 flag=0 sp="P212121" cell_constants="78.3 84.1 96.5 90 90 90"
 #
 # Required Environment Variables:
-#   SOURCE_DIR     Path to helper scripts (e.g., plot.sh, dr_log.sh)
+#   SOURCE_DIR     Path to helper scripts (e.g., dr_parse.py)
 #   DATA_PATH      Directory containing diffraction image files
 #   FILE_TYPE      Format of diffraction images (e.g., h5, cbf, img)
 #
@@ -22,6 +22,7 @@
 #   ROTATION_AXIS            Rotation axis vector (comma-separated, e.g., "1,0,0")
 #   SPACE_GROUP              Space group symbol (e.g., "P212121")
 #   UNIT_CELL                Unit cell parameters "a b c alpha beta gamma"
+#   AUTOPD_NPROC             CPU slots granted by scheduler.py (passed as -nthreads)
 #
 # Exit Codes:
 #   0  Success
@@ -83,6 +84,11 @@ for param in "autoPROC_XdsKeyword_ROTATION_AXIS=${ROTATION_AXIS}" "beam=${BEAM}"
     [ -n "$value" ] && args+=("$key=$value")
 done
 
+# CPU slots granted by scheduler.py
+if [ -n "${AUTOPD_NPROC}" ]; then
+    args+=("-nthreads" "${AUTOPD_NPROC}")
+fi
+
 #############################################
 # Run autoPROC with HDF5 or standard images
 #############################################
@@ -94,9 +100,9 @@ if [ "${FILE_TYPE}" = "h5" ]; then
       base_name="${file_name%.*}"       
       prefix="${base_name%_*}"          
       prefix="${prefix:-data}"
-      process -ANO -Id ${prefix},${file_path},${file_name},${IMAGE_START},${IMAGE_END} -d autoPROC_${ROUND} symm=${SPACE_GROUP} cell="${UNIT_CELL}" ${args[@]} > autoPROC_${ROUND}.log
+      ${AUTOPD_PROFILE} process -ANO -Id ${prefix},${file_path},${file_name},${IMAGE_START},${IMAGE_END} -d autoPROC_${ROUND} symm=${SPACE_GROUP} cell="${UNIT_CELL}" ${args[@]} > autoPROC_${ROUND}.log
     else
-      process -ANO -h5 ${IMAGE_FULL_NAME} -d autoPROC_${ROUND} symm=${SPACE_GROUP} cell="${UNIT_CELL}" ${args[@]} > autoPROC_${ROUND}.log
+      ${AUTOPD_PROFILE} process -ANO -h5 ${IMAGE_FULL_NAME} -d autoPROC_${ROUND} symm=${SPACE_GROUP} cell="${UNIT_CELL}" ${args[@]} > autoPROC_${ROUND}.log
     fi
 else
     if [ -n "${IMAGE_START}" ] && [ -n "${IMAGE_END}" ]; then
@@ -116,9 +122,9 @@ else
         new_base_name="$base_name"         
       fi
       masked_name="${new_base_name}.${extension}"
-      process -ANO -Id ${prefix},${file_path},${masked_name},${IMAGE_START},${IMAGE_END} -d autoPROC_${ROUND} symm=${SPACE_GROUP} cell="${UNIT_CELL}" "${args[@]}" > autoPROC_${ROUND}.log
+      ${AUTOPD_PROFILE} process -ANO -Id ${prefix},${file_path},${masked_name},${IMAGE_START},${IMAGE_END} -d autoPROC_${ROUND} symm=${SPACE_GROUP} cell="${UNIT_CELL}" "${args[@]}" > autoPROC_${ROUND}.log
     else
-      process -ANO -I ${DATA_PATH} -d autoPROC_${ROUND} symm=${SPACE_GROUP} cell="${UNIT_CELL}" "${args[@]}" > autoPROC_${ROUND}.log
+      ${AUTOPD_PROFILE} process -ANO -I ${DATA_PATH} -d autoPROC_${ROUND} symm=${SPACE_GROUP} cell="${UNIT_CELL}" "${args[@]}" > autoPROC_${ROUND}.log
     fi
 fi
 
@@ -136,7 +142,7 @@ fi
 # Post-processing: CTRUNCATE & AIMLESS
 #############################################
 {
-ctruncate -mtzin autoPROC_${ROUND}/aimless.mtz -mtzout autoPROC_${ROUND}/aimless_truncated.mtz -colin '/*/*/[IMEAN,SIGIMEAN]' -colano '/*/*/[I(+),SIGI(+),I(-),SIGI(-)]' > autoPROC_${ROUND}/ctruncate.log
+${AUTOPD_PROFILE} ctruncate -mtzin autoPROC_${ROUND}/aimless.mtz -mtzout autoPROC_${ROUND}/aimless_truncated.mtz -colin '/*/*/[IMEAN,SIGIMEAN]' -colano '/*/*/[I(+),SIGI(+),I(-),SIGI(-)]' > autoPROC_${ROUND}/ctruncate.log
 } 2>/dev/null
 
 #aimless bin 20
@@ -160,18 +166,18 @@ distance_refined=$(grep "CRYSTAL TO DETECTOR DISTANCE (mm)" autoPROC_${ROUND}/CO
 echo "Distance_refined               [mm] = ${distance_refined}" >> autoPROC_SUMMARY/autoPROC_SUMMARY.log
 beam_center_refined=$(grep "DETECTOR COORDINATES (PIXELS) OF DIRECT BEAM" autoPROC_${ROUND}/CORRECT.LP | awk '{print $7 "," $8}')
 echo "Beam_center_refined         [pixel] = ${beam_center_refined}" >> autoPROC_SUMMARY/autoPROC_SUMMARY.log
-${SOURCE_DIR}/dr_log.sh autoPROC_${ROUND}/aimless.log autoPROC_${ROUND}/ctruncate.log autoPROC_${ROUND}/pointless.log >> autoPROC_SUMMARY/autoPROC_SUMMARY.log
+python3 ${SOURCE_DIR}/dr_parse.py parse --aimless autoPROC_${ROUND}/aimless.log --ctruncate autoPROC_${ROUND}/ctruncate.log --pointless autoPROC_${ROUND}/pointless.log --json autoPROC_SUMMARY/autoPROC_STATISTICS.json >> autoPROC_SUMMARY/autoPROC_SUMMARY.log
 
 #############################################
 # Evaluate Rmeas and determine success/failure
 #############################################
-Rmeas_autoPROC=$(grep 'Rmeas (all I+ & I-)' autoPROC_SUMMARY/autoPROC_SUMMARY.log | awk '{print $6}')
+Rmeas_autoPROC=$(python3 ${SOURCE_DIR}/dr_parse.py get autoPROC_SUMMARY/autoPROC_STATISTICS.json overall.rmeas)
 Rmeas_autoPROC=${Rmeas_autoPROC:-0}
 
 if [ $(echo "${Rmeas_autoPROC} <= 0" | bc) -eq 1 ] || [ $(echo "${Rmeas_autoPROC} >= 100" | bc) -eq 1 ];then
     FLAG_autoPROC=0
     echo "Round ${ROUND} autoPROC processing failed!"
-    rm autoPROC_SUMMARY/autoPROC_SUMMARY.log
+    rm autoPROC_SUMMARY/autoPROC_SUMMARY.log autoPROC_SUMMARY/autoPROC_STATISTICS.json
     exit
 else
     echo "FLAG_autoPROC=1" >> ../temp.txt
@@ -187,39 +193,9 @@ if grep -q "strong anomalous signal" "autoPROC_SUMMARY/autoPROC_SUMMARY.log" &&
     cp autoPROC_SUMMARY/autoPROC.mtz ../SAD_INPUT
 fi
 
-#############################################
-# Extract statistics for plotting
-#############################################
-mkdir -p STATISTICS_FIGURES
-cd STATISTICS_FIGURES
-
-#cchalf_vs_resolution
-grep -A15 '$TABLE:  Correlations CC(1/2) within dataset' ../autoPROC_${ROUND}/aimless.log | tail -10 > cchalf_vs_resolution.dat
-
-#completeness_vs_resolution
-grep -A14 '$TABLE:  Completeness & multiplicity v. resolution' ../autoPROC_${ROUND}/aimless.log | tail -10 > completeness_vs_resolution.dat
-
-#i_over_sigma_vs_resolution & rmerge_rmeans_rpim_vs_resolution
-grep -m1 -A18 '$TABLE:  Analysis against resolution' ../autoPROC_${ROUND}/aimless.log | tail -10 > analysis_vs_resolution.dat
-
-#scales_vs_batch
-start=$(($(grep -n '    N  Run    Phi    Batch     Mn(k)        0k      Number   Bfactor    Bdecay' ../autoPROC_${ROUND}/aimless.log | head -1 | cut -d ':' -f 1)+1))
-end=$(($(grep -n '    N  Run    Phi    Batch     Mn(k)        0k      Number   Bfactor    Bdecay' ../autoPROC_${ROUND}/aimless.log | tail -1 | cut -d ':' -f 1)-2))
-sed -n "${start},${end}p" ../autoPROC_${ROUND}/aimless.log > scales_vs_batch.dat
-
-#rmerge_and_i_over_sigma_vs_batch
-start=$(($(grep -n '    N   Batch    Mn(I)   RMSdev  I/rms  Rmerge    Number  Nrej Cm%poss  AnoCmp MaxRes CMlplc   Chi^2  Chi^2c SmRmerge' ../autoPROC_$ROUND/aimless.log | head -1 | cut -d ':' -f 1)+1))
-end=$(($(grep -n '    N   Batch    Mn(I)   RMSdev  I/rms  Rmerge    Number  Nrej Cm%poss  AnoCmp MaxRes CMlplc   Chi^2  Chi^2c SmRmerge' ../autoPROC_$ROUND/aimless.log | tail -1 | cut -d ':' -f 1)-2))
-sed -n "${start},${end}p" ../autoPROC_${ROUND}/aimless.log > rmerge_and_i_over_sigma_vs_batch.dat
-
-#L_test
-grep -A24 '$TABLE: L test for twinning:' ../autoPROC_${ROUND}/ctruncate.log | tail -21 > L_test.dat
-L_statistic=$(grep 'L statistic =' ../autoPROC_${ROUND}/ctruncate.log | awk '{print $4}')
-
-# Generate plots
-${SOURCE_DIR}/plot.sh ${L_statistic}
+# Figures of all pipelines are plotted once by data_reduction.sh (plot_stats.py)
 
 #############################################
 # Return to main directory
 #############################################
-cd ../..
+cd ..
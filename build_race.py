@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: build_race.py
+# Description: Model building race (model_build=race). ModelCraft, Phenix Autobuild and IPCAS 2.0 start at
+#              the same time under the CPU budget of scheduler.py instead of one after the other. Their logs
+#              are followed while they run and R-work/R-free are reported as cycles complete; once a builder
+#              reaches the target R-free the other builders are stopped and the leader runs to completion.
+#
+# Usage:
+#   python3 build_race.py run [--target 0.35] [--progress BUILD_RACE.txt] [--winner FILE] [--cpus N]
+#                             --job NAME "command" ...
+#
+# Example:
+#   python3 build_race.py run --target 0.35 --job MODELCRAFT "modelcraft.sh" --job AUTOBUILD "autobuild.sh x.mtz"
+#
+# Builders (NAME) and the logs followed, relative to the working directory:
+#   MODELCRAFT  MODELCRAFT/MODELCRAFT_MR*/MODELCRAFT.log (R-work: / R-free: of every cycle, per MR solution)
+#   AUTOBUILD   AUTOBUILD/AUTOBUILD.log                  (R/Rfree of every model)
+#   IPCAS       IPCAS/result                             (cycle residues R-work R-free, one line per cycle)
+#
+# Exit Codes:
+#   0  All builders finished, or one reached the target R-free
+#   1  At least one builder failed and none reached the target
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import glob
+import os
+import re
+import signal
+import sys
+import time
+
+from scheduler import Job, Scheduler, available_cpus, available_mem_mb
+
+# R-free above which the sequential strategy starts the next builder
+DEFAULT_TARGET = 0.35
+BUILDERS = {
+    'MODELCRAFT': ('log', ['MODELCRAFT/MODELCRAFT_MR*/MODELCRAFT.log']),
+    'AUTOBUILD': ('log', ['AUTOBUILD/AUTOBUILD.log']),
+    'IPCAS': ('table', ['IPCAS/result']),
+}
+R_WORK = re.compile(r'\bR-?work\s*[:=]\s*([0-9]*\.[0-9]+)', re.IGNORECASE)
+R_FREE = re.compile(r'\bR-?free\s*[:=]\s*([0-9]*\.[0-9]+)', re.IGNORECASE)
+R_PAIR = re.compile(r'\bR\s*/\s*R-?free\s*[:=]?\s*([0-9]*\.[0-9]+)\s*/\s*([0-9]*\.[0-9]+)', re.IGNORECASE)
+TABLE_ROW = re.compile(r'^\s*(\d+)\s+\d+\s+([0-9]*\.[0-9]+)\s+([0-9]*\.[0-9]+)\s*$')
+
+
+class LogStream(object):
+    """New complete lines of a growing log file; starts over if the file is truncated or replaced."""
+
+    def __init__(self, path, kind):
+        self.path = path
+        self.kind = kind
+        self.offset = 0
+        self.partial = ''
+        self.r_work = None  # R-work waiting for the R-free of the same cycle
+        self.cycles = 0
+
+    def read_lines(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size < self.offset:
+            self.offset, self.partial, self.cycles = 0, '', 0
+        if size == self.offset:
+            return []
+        with open(self.path, 'r', encoding='utf-8', errors='ignore') as f:
+            f.seek(self.offset)
+            text = self.partial + f.read()
+            self.offset = f.tell()
+        lines = text.split('\n')
+        self.partial = lines.pop()
+        return lines
+
+    def rfactors(self):
+        """(cycle, R-work, R-free) of the cycles completed since the last call, numbered from 1 per log."""
+        pairs = []
+        for line in self.read_lines():
+            if self.kind == 'table':
+                match = TABLE_ROW.match(line)
+                if match:
+                    pairs.append((float(match.group(2)), float(match.group(3))))
+                continue
+            match = R_PAIR.search(line)
+            if match:
+                pairs.append((float(match.group(1)), float(match.group(2))))
+                continue
+            work = R_WORK.search(line)
+            free = R_FREE.search(line)
+            if work:
+                self.r_work = float(work.group(1))
+            if free:
+                pairs.append((self.r_work, float(free.group(1))))
+                self.r_work = None
+        # Failed refinements are reported as 0 or as percentages by some programs
+        cycles = []
+        for work, free in pairs:
+            if 0 < free < 1:
+                self.cycles += 1
+                cycles.append((self.cycles, work, free))
+        return cycles
+
+
+class RaceScheduler(Scheduler):
+    """Scheduler following the logs of the model builders and stopping the others once one reaches the target."""
+
+    def __init__(self, cpus, mem_mb, target, progress=None):
+        super().__init__(cpus, mem_mb)
+        self.target = target
+        self.progress = progress
+        self.streams = {}   # job name -> {path: LogStream}
+        self.best = {}      # job name -> lowest R-free so far
+        self.stopped = set()
+
+    def fits(self, job):
+        """All builders start at once; the slot counts split the CPU budget between them."""
+        return True
+
+    def follow(self, job):
+        kind, patterns = BUILDERS.get(job.name, ('log', []))
+        streams = self.streams.setdefault(job.name, {})
+        for pattern in patterns:
+            for path in sorted(glob.glob(pattern)):
+                if path not in streams:
+                    streams[path] = LogStream(path, kind)
+        for path, stream in streams.items():
+            for cycle, r_work, r_free in stream.rfactors():
+                self.report(job, path, cycle, r_work, r_free)
+
+    def report(self, job, path, cycle, r_work, r_free):
+        source = os.path.basename(os.path.dirname(path))
+        r_work_text = f"{r_work:.4f}" if r_work is not None else '-'
+        print(f"{time.strftime('%H:%M:%S')}  {job.name} cycle {cycle} ({source}): "
+              f"R-work={r_work_text} R-free={r_free:.4f}", flush=True)
+        if self.progress:
+            with open(self.progress, 'a', encoding='utf-8') as f:
+                f.write(f"{int(time.time() - job.start_time)} {job.name} {source} {cycle} {r_work_text} {r_free:.4f}\n")
+        self.best[job.name] = min(r_free, self.best.get(job.name, r_free))
+        if self.winner is None and r_free <= self.target:
+            self.lead(job, r_free)
+
+    def lead(self, job, r_free):
+        self.winner = job
+        losers = [other for other in self.running if other is not job]
+        self.pending = []
+        names = ', '.join(other.name for other in losers) or 'no other builder'
+        print(f"{job.name} reached R-free {r_free:.4f} (target {self.target}), stopping {names}.", flush=True)
+        self.stopped.update(other.name for other in losers)
+        self.stop(losers)
+
+    def reap(self):
+        for job in self.running:
+            if job.name not in self.stopped:
+                self.follow(job)
+        running = list(self.running)
+        super().reap()
+        # Cycles written between the last look at the logs and the end of the builder
+        for job in running:
+            if job.returncode is not None and job.name not in self.stopped:
+                self.follow(job)
+
+    def summary(self):
+        print("")
+        print(f"{'Builder':<12}{'Cycles':>8}{'Best R-free':>14}  Status")
+        for job in self.finished:
+            cycles = sum(stream.cycles for stream in self.streams.get(job.name, {}).values())
+            best = f"{self.best[job.name]:.4f}" if job.name in self.best else '-'
+            if job.name in self.stopped:
+                status = 'stopped'
+            elif job.returncode == 0:
+                status = 'finished'
+            else:
+                status = f"failed (exit code {job.returncode})"
+            if job is self.winner:
+                status += ', reached the target'
+            print(f"{job.name:<12}{cycles:>8}{best:>14}  {status}")
+
+
+def run_command(args):
+    if len(args.job) == 0:
+        print("Error: no builders given")
+        return 1
+    scheduler = RaceScheduler(args.cpus or available_cpus(), available_mem_mb(), args.target, args.progress)
+    for name, command in args.job:
+        scheduler.add(Job(name, command))
+    signal.signal(signal.SIGTERM, lambda *_: (scheduler.terminate(), sys.exit(143)))
+    signal.signal(signal.SIGINT, lambda *_: (scheduler.terminate(), sys.exit(130)))
+    if args.progress:
+        with open(args.progress, 'w', encoding='utf-8') as f:
+            f.write("seconds builder source cycle r_work r_free\n")
+    returncode = scheduler.run()
+    scheduler.summary()
+    if scheduler.winner is not None and args.winner:
+        with open(args.winner, 'w', encoding='utf-8') as f:
+            f.write(scheduler.winner.name + '\n')
+    return returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent model building race for AutoPD')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Race model builders under a CPU budget')
+    run_parser.add_argument('--target', type=float, default=DEFAULT_TARGET,
+                            help=f'R-free that stops the other builders (default: {DEFAULT_TARGET})')
+    run_parser.add_argument('--job', nargs=2, action='append', default=[], metavar=('NAME', 'COMMAND'),
+                            help='Builder to run (MODELCRAFT, AUTOBUILD or IPCAS); may be repeated')
+    run_parser.add_argument('--cpus', type=int, default=None, help='CPU budget (default: AUTOPD_CPUS or all CPUs)')
+    run_parser.add_argument('--progress', default=None, help='File receiving one line per completed cycle')
+    run_parser.add_argument('--winner', default=None, help='File receiving the name of the builder that reached the target')
+
+    args = parser.parse_args()
+    sys.exit(run_command(args))
+
+
+if __name__ == '__main__':
+    main()
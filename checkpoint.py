@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: checkpoint.py
+# Description: Content-addressed checkpoints of the AutoPD stages (data reduction, search models, MR, SAD).
+#              Before a stage runs, its inputs (image set, sequence, MTZ and model contents, fingerprints of
+#              upstream stages and the relevant environment variables) are hashed into a fingerprint. When the
+#              run resumes an earlier output directory (resume=, RESUME_DIR) and that directory holds a
+#              completed stage with the same fingerprint, its outputs are copied instead of running the stage.
+#              Every stage is recorded in CHECKPOINTS.json of the output directory.
+#              Runs given one shared directory (shared_dir=, AUTOPD_SHARED) also share the outputs of the
+#              SHARED_STAGES: the first run to reach such a stage claims its fingerprint and publishes the
+#              outputs to <shared>/<stage>-<fingerprint>, runs with the same fingerprint wait for it and copy
+#              them (e.g. search models of the datasets with one sequence in a batch, autopd_batch.py).
+#
+# Usage (from the output directory):
+#   python3 checkpoint.py restore <stage>     # exit 0: outputs restored, skip the stage
+#   python3 checkpoint.py record <stage>      # after the stage finished
+#   python3 checkpoint.py fingerprint <stage>
+#
+# Environment:
+#   RESUME_DIR     Earlier output directory to reuse completed stages from
+#   AUTOPD_SHARED  Directory shared by several runs for the outputs of SHARED_STAGES
+#
+# Exit Codes:
+#   0  Success (restore: stage restored)
+#   1  Stage not restored / not recorded
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import datetime
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import socket
+import sys
+import time
+
+MANIFEST = 'CHECKPOINTS.json'
+LOCK = '.CHECKPOINTS.lock'
+# Stages whose outputs are shared between the runs of one AUTOPD_SHARED directory
+SHARED_STAGES = ['search_model']
+# Seconds between checks while another run produces a shared stage
+SHARED_POLL = 10
+
+# inputs:   files hashed by content (glob patterns relative to the output directory, or $VAR for a path in the environment)
+# images:   environment variable holding the image directory (names, sizes and modification times)
+# env:      environment variables the stage depends on
+# upstream: stages whose fingerprints are part of this one (their outputs may be modified in place later)
+# outputs:  paths copied on restore
+# publish:  (source, destination) copies done by the stage itself after it finished
+# required: glob that must match for the stage to count as completed
+STAGES = {
+    'data_reduction': {
+        'images': 'DATA_PATH',
+        'inputs': [],
+        'env': ['SPACE_GROUP_INPUT', 'CELL_CONSTANTS_INPUT', 'ROTATION_AXIS', 'BEAM_X', 'BEAM_Y', 'DISTANCE',
+                'IMAGE_START', 'IMAGE_END', 'RACE', 'RACE_RMEAS', 'RACE_CCHALF', 'RACE_COMPLETENESS', 'RACE_RESOLUTION',
+                'XDS_REUSE', 'TRIAGE'],
+        'upstream': [],
+        'outputs': ['DATA_REDUCTION'],
+        'publish': [('DATA_REDUCTION/DATA_REDUCTION_SUMMARY/DATA_REDUCTION.log', 'SUMMARY')],
+        'required': 'DATA_REDUCTION/DATA_REDUCTION_SUMMARY/*.mtz',
+    },
+    'search_model': {
+        'images': None,
+        'inputs': ['$SEQUENCE'],
+        'env': ['UNIPROT_ID', 'AF_PREDICT', 'AF_SPLIT', 'PAE_SPLIT', 'DATE'],
+        'upstream': [],
+        'outputs': ['SEARCH_MODELS', 'MRPARSE', 'AFDB_MODELS'],
+        'publish': [],
+        'required': 'SEARCH_MODELS/*/*.pdb',
+    },
+    'mr': {
+        'images': None,
+        'inputs': ['$SEQUENCE', '$EXPERIMENT', 'SEARCH_MODELS/*/*.pdb'],
+        'env': ['Z_INPUT', 'MR_JOBS'],
+        'upstream': ['data_reduction'],
+        'outputs': ['PHASER_MR'],
+        'publish': [],
+        'required': 'PHASER_MR/MR_SUMMARY/phaser_mr.log',
+    },
+    'sad': {
+        'images': None,
+        'inputs': ['$SEQUENCE', '$EXPERIMENT'],
+        'env': ['ATOM'],
+        'upstream': ['data_reduction'],
+        'outputs': ['SAD'],
+        'publish': [('SAD/SAD_SUMMARY', 'SUMMARY')],
+        'required': 'SAD/SAD_SUMMARY/crank2.log',
+    },
+}
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def input_files(pattern):
+    """Files named by a glob pattern or by a $VAR path."""
+    if pattern.startswith('$'):
+        path = os.environ.get(pattern[1:], '')
+        return [path] if path and os.path.isfile(path) else []
+    return sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+
+
+def image_listing(directory):
+    """Names, sizes and modification times of the images; hashing the frames themselves would take too long."""
+    entries = []
+    if directory and os.path.isdir(directory):
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                entries.append(f"{entry.name} {stat.st_size} {int(stat.st_mtime)}")
+    return entries
+
+
+def fingerprint(stage, manifest):
+    """sha256 over everything the stage depends on."""
+    spec = STAGES[stage]
+    digest = hashlib.sha256()
+    digest.update(f"stage {stage}\n".encode())
+    if spec['images']:
+        digest.update(f"images {os.environ.get(spec['images'], '')}\n".encode())
+        for line in image_listing(os.environ.get(spec['images'], '')):
+            digest.update(f"{line}\n".encode())
+    for pattern in spec['inputs']:
+        # Contents only: file names of search models change when mr.sh renumbers them
+        hashes = sorted(sha256_file(path) for path in input_files(pattern))
+        digest.update(f"input {pattern} {' '.join(hashes)}\n".encode())
+    for name in spec['env']:
+        digest.update(f"env {name}={os.environ.get(name, '')}\n".encode())
+    for name in spec['upstream']:
+        upstream = manifest.get(name, {}).get('fingerprint', '')
+        digest.update(f"upstream {name} {upstream}\n".encode())
+    return digest.hexdigest()
+
+
+def read_manifest(directory='.'):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def update_manifest(stage, entry):
+    """Read-modify-write of the manifest; stages running in parallel share it."""
+    with open(LOCK, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = read_manifest()
+        manifest[stage] = entry
+        tmp_path = MANIFEST + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, MANIFEST)
+    return manifest
+
+
+def now():
+    return datetime.datetime.now().isoformat(timespec='seconds')
+
+
+def copy_path(source, destination):
+    if os.path.isdir(source):
+        shutil.copytree(source, destination, symlinks=True, dirs_exist_ok=True)
+    else:
+        os.makedirs(os.path.dirname(destination) or '.', exist_ok=True)
+        shutil.copy2(source, destination)
+
+
+def publish(stage):
+    for source, destination in STAGES[stage]['publish']:
+        if os.path.isdir(source):
+            for name in os.listdir(source):
+                copy_path(os.path.join(source, name), os.path.join(destination, name))
+        elif os.path.isfile(source):
+            copy_path(source, os.path.join(destination, os.path.basename(source)))
+
+
+def shared_paths(stage, key):
+    """Output directory, claim and failure marker of a shared stage; None if the stage is not shared."""
+    shared = os.environ.get('AUTOPD_SHARED', '')
+    if not shared or stage not in SHARED_STAGES:
+        return None
+    base = os.path.join(os.path.abspath(shared), f"{stage}-{key[:16]}")
+    return base, f"{base}.claim", f"{base}.failed"
+
+
+def read_claim(claim):
+    try:
+        with open(claim, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def claim_alive(owner):
+    """A claim is stale once its run is gone (only decidable on the same host)."""
+    if owner.get('host') != socket.gethostname():
+        return True
+    try:
+        os.kill(int(owner['pid']), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, KeyError, TypeError, ValueError):
+        return True
+    return True
+
+
+def shared_restore(stage, key):
+    """
+    Directory with the shared outputs of the stage, waiting while another run produces them. None if this
+    run has to run the stage itself: it then holds the claim until record() publishes or gives it up.
+    """
+    paths = shared_paths(stage, key)
+    if paths is None:
+        return None
+    directory, claim, failed = paths
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    waiting = False
+    while True:
+        with open(f"{directory}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.isdir(directory):
+                return directory
+            if os.path.exists(failed):
+                return None
+            owner = read_claim(claim)
+            if owner and not claim_alive(owner):
+                print(f"Checkpoint: {stage} claimed by a run that is gone ({owner.get('directory')}), taking over")
+                owner = {}
+            if not owner:
+                # The shell running the stage (parent of this process) owns the claim until record()
+                tmp_path = f"{claim}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'host': socket.gethostname(), 'pid': os.getppid(), 'directory': os.getcwd(),
+                               'started': now()}, f)
+                os.replace(tmp_path, claim)
+                return None
+        if not waiting:
+            print(f"Checkpoint: waiting for {stage} of {owner.get('directory')}")
+            waiting = True
+        time.sleep(SHARED_POLL)
+
+
+def shared_record(stage, key, complete):
+    """Publish the outputs of a claimed shared stage, or mark it failed so that the waiting runs go ahead."""
+    paths = shared_paths(stage, key)
+    if paths is None:
+        return
+    directory, claim, failed = paths
+    owner = read_claim(claim)
+    if owner.get('host') != socket.gethostname() or owner.get('pid') != os.getppid():
+        return
+    if complete:
+        tmp_path = f"{directory}.{os.getpid()}.tmp"
+        for path in STAGES[stage]['outputs']:
+            if os.path.exists(path):
+                copy_path(path, os.path.join(tmp_path, path))
+        os.makedirs(tmp_path, exist_ok=True)
+        os.rename(tmp_path, directory)
+        print(f"Checkpoint: {stage} shared in {directory}")
+    else:
+        with open(failed, 'w', encoding='utf-8') as f:
+            f.write(f"{os.getcwd()} {now()}\n")
+    os.remove(claim)
+
+
+def restore(stage):
+    """Copy the outputs of a matching completed stage from RESUME_DIR. Returns True if restored."""
+    manifest = read_manifest()
+    key = fingerprint(stage, manifest)
+    resume_dir = os.environ.get('RESUME_DIR', '')
+    previous = read_manifest(resume_dir).get(stage, {}) if resume_dir else {}
+
+    if previous.get('status') == 'complete' and previous.get('fingerprint') == key:
+        for path in previous.get('outputs', []):
+            source = os.path.join(resume_dir, path)
+            if os.path.exists(source):
+                copy_path(source, path)
+        publish(stage)
+        update_manifest(stage, {'fingerprint': key, 'status': 'complete', 'outputs': previous.get('outputs', []),
+                                'restored_from': os.path.abspath(resume_dir), 'recorded': now()})
+        print(f"Checkpoint: {stage} restored from {resume_dir}")
+        return True
+
+    shared = shared_restore(stage, key)
+    if shared is not None:
+        outputs = [path for path in STAGES[stage]['outputs'] if os.path.exists(os.path.join(shared, path))]
+        for path in outputs:
+            copy_path(os.path.join(shared, path), path)
+        publish(stage)
+        update_manifest(stage, {'fingerprint': key, 'status': 'complete', 'outputs': outputs,
+                                'restored_from': shared, 'recorded': now()})
+        print(f"Checkpoint: {stage} restored from {shared}")
+        return True
+
+    # Keep the fingerprint of the inputs as they are now; the stage may modify them in place
+    update_manifest(stage, {'fingerprint': key, 'status': 'running', 'outputs': [], 'started': now()})
+    return False
+
+
+def record(stage):
+    """Mark a stage complete if its required outputs exist. Returns True if recorded."""
+    spec = STAGES[stage]
+    manifest = read_manifest()
+    entry = manifest.get(stage) or {'fingerprint': fingerprint(stage, manifest)}
+    if not glob.glob(spec['required']):
+        print(f"Checkpoint: {stage} did not complete, nothing recorded")
+        shared_record(stage, entry['fingerprint'], False)
+        return False
+    entry['status'] = 'complete'
+    entry['outputs'] = [path for path in spec['outputs'] if os.path.exists(path)]
+    entry['recorded'] = now()
+    update_manifest(stage, entry)
+    shared_record(stage, entry['fingerprint'], True)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Content-addressed checkpoints of AutoPD stages')
+    parser.add_argument('action', choices=['restore', 'record', 'fingerprint'])
+    parser.add_argument('stage', choices=sorted(STAGES))
+    args = parser.parse_args()
+
+    if args.action == 'restore':
+        sys.exit(0 if restore(args.stage) else 1)
+    elif args.action == 'record':
+        sys.exit(0 if record(args.stage) else 1)
+    print(fingerprint(args.stage, read_manifest()))
+
+
+if __name__ == '__main__':
+    main()
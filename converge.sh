@@ -0,0 +1,47 @@
+#!/bin/bash
+#############################################################################################################
+# Script Name: converge.sh
+# Description: Convergence monitor of IPCAS 2.0 (ipcas.sh). Reads the per-cycle results written by outlog.sh
+#              (cycle, residues built, R-work, R-free), prints the progress of the last cycle and tells
+#              ipcas.sh to stop once R-free has plateaued or got worse for a number of cycles.
+#
+# Usage:
+#   ./converge.sh <result file> <patience> [tolerance]
+#
+# Arguments:
+#   result file  One line per cycle: cycle residues Rwork Rfree
+#   patience     Cycles without R-free improvement before stopping (0: never stop)
+#   tolerance    Smallest R-free decrease counted as improvement (default: 0.001)
+#
+# Exit Codes:
+#   0  R-free has plateaued or got worse for <patience> cycles: stop
+#   1  Keep going
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+tolerance=${3:-0.001}
+
+awk -v patience=$2 -v tolerance=$tolerance '
+BEGIN {best = 1.0; best_cycle = "-"; since = 0; residues = 0}
+{
+    # A failed cycle has no R factors and counts as no improvement
+    if (NF >= 4 && $4 + 0 > 0 && $4 + 0 < best - tolerance) {
+        best = $4 + 0
+        best_cycle = $1
+        since = 0
+    } else {
+        since++
+    }
+    if (NF >= 4 && $2 + 0 > residues) residues = $2 + 0
+    cycle = $1
+    cur_res = (NF >= 4) ? $2 : "-"
+    cur_work = (NF >= 4) ? $3 : "-"
+    cur_free = (NF >= 4) ? $4 : "-"
+}
+END {
+    printf "Cycle %s: residues %s Rwork %s Rfree %s; best Rfree %.4f at cycle %s, %d cycles without improvement, at most %d residues\n", cycle, cur_res, cur_work, cur_free, best, best_cycle, since, residues
+    exit (patience > 0 && since >= patience) ? 0 : 1
+}' $1
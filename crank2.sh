@@ -43,7 +43,7 @@ ATOM=${3}       # Heavy atom type for anomalous scattering
 WAVELENGTH=${4} # Data collection wavelength
 
 # Run Crank2 SAD pipeline
-python3 $CCP4/share/ccp4i/crank2/crank2.py \
+${AUTOPD_PROFILE} python3 $CCP4/share/ccp4i/crank2/crank2.py \
     dirout crank2 \               # Output directory name
     hklout crank2.mtz \           # Output MTZ file
     xyzout crank2.pdb << END      # Output PDB file
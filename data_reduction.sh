@@ -17,11 +17,27 @@
 # Optional Environment Variables (from autopipeline.sh):
 #   SPACE_GROUP_INPUT      Initial space group (if known)
 #   CELL_CONSTANTS_INPUT   Initial unit cell parameters (a b c α β γ)
+#   AUTOPD_CPUS            CPU budget shared by the four pipelines (default: all CPUs)
+#   AUTOPD_MEM_MB          Memory budget in MB (default: available memory)
+#   RACE                   true: stop the other pipelines once one MTZ meets the thresholds below
+#   RACE_RMEAS             Maximum overall Rmeas in race mode (default: 0.2)
+#   RACE_CCHALF            Minimum overall CC(1/2) in race mode (default: 0.95)
+#   RACE_COMPLETENESS      Minimum overall completeness in race mode (default: 90)
+#   RACE_RESOLUTION        Maximum high resolution limit in race mode (default: none)
+#   STREAM                 true: start while the frames are still being collected (stream_watch.py)
+#   STREAM_FRAMES          Expected number of frames (default: IMAGE_END - IMAGE_START + 1, else end of sweep
+#                          after STREAM_IDLE seconds without a new frame)
+#   STREAM_IDLE            Seconds without a new frame that end the sweep (default: 60)
+#   STREAM_WEDGE           Frames of the first wedge used for spot finding and indexing (default: 100)
+#   TRIAGE                 Distinct MTZs passed to MR and SAD (mtz_triage.py, default: 2; 0: all MTZs)
+#   OVERLAP                true: hand every finished MTZ to MR right away (EARLY_MTZ/, read by mr.sh)
 #
 # Outputs:
 #   DATA_REDUCTION/             Main directory for reduction runs
 #   DATA_REDUCTION_SUMMARY/     Summaries of logs and MTZ files from all pipelines
+#   NAME/STATISTICS_FIGURES/    Statistics figures of every pipeline (comparison.svg in DATA_REDUCTION_SUMMARY/)
 #   SAD_INPUT/                  For input to SAD if anomalous signal is found
+#   EARLY_MTZ/                  Stage overlap: MTZ of every pipeline and round as soon as it finished (NAME_r<round>.mtz)
 #
 # Exit Codes:
 #   0   Success
@@ -34,6 +50,19 @@
 
 start_time=$(date +%s)
 
+#############################################
+# Stream mode: wait for the first wedge of frames
+#############################################
+STREAM_ARGS=()
+if [ "${STREAM}" = "true" ]; then
+  if [ -z "${STREAM_FRAMES}" ] && [ -n "${IMAGE_START}" ] && [ -n "${IMAGE_END}" ]; then
+    STREAM_FRAMES=$(( IMAGE_END - IMAGE_START + 1 ))
+  fi
+  export STREAM_FRAMES
+  STREAM_ARGS=(--idle ${STREAM_IDLE:-60} ${STREAM_FRAMES:+--frames ${STREAM_FRAMES}})
+  python3 ${SOURCE_DIR}/stream_watch.py wait "${DATA_PATH}" --frames ${STREAM_WEDGE:-100} --idle ${STREAM_IDLE:-60} || exit 1
+fi
+
 #############################################
 # Determine input file type from DATA_PATH
 #############################################
@@ -45,13 +74,31 @@ export FILE_TYPE
 #############################################
 mkdir -p DATA_REDUCTION
 cd DATA_REDUCTION
-mkdir -p DATA_REDUCTION_SUMMARY SAD_INPUT
+mkdir -p DATA_REDUCTION_SUMMARY SAD_INPUT EARLY_MTZ
+
+# Stage overlap: command appended to a pipeline job that hands its MTZ to MR as soon as the job succeeded
+# (copied under a temporary name first, mr.sh only picks up complete files)
+handoff() {
+  local name=$1
+  if [ "${OVERLAP}" = "true" ]; then
+    echo " && cp ${name}/${name}_SUMMARY/${name}.mtz EARLY_MTZ/.${name}_r${ROUND}.tmp && mv EARLY_MTZ/.${name}_r${ROUND}.tmp EARLY_MTZ/${name}_r${ROUND}.mtz"
+  fi
+}
 
 #############################################
 # Extract header information
 #############################################
+# HDF5 (one master file for the sweep) is processed once the collection is complete
+if [ "${STREAM}" = "true" ] && [ "${FILE_TYPE}" = "h5" ]; then
+  python3 ${SOURCE_DIR}/stream_watch.py complete "${DATA_PATH}" "${STREAM_ARGS[@]}"
+fi
+# header.json of an earlier run in this directory is reused while the images are unchanged
+cp DATA_REDUCTION_SUMMARY/header.json . 2>/dev/null
 ${SOURCE_DIR}/header.sh > header.log
 
+# Memory one pipeline is expected to need (frames x image size), used by scheduler.py
+JOB_MEM_MB=$(python3 ${SOURCE_DIR}/scheduler.py estimate header.json)
+
 #############################################
 # First round of data processing
 #############################################
@@ -60,7 +107,38 @@ echo "-------------------------------- First round data processing -------------
 echo ""
 ROUND=1
 
-parallel -u "{}" ::: "${SOURCE_DIR}/xds.sh round=${ROUND}" "${SOURCE_DIR}/xds_xia2.sh round=${ROUND}" "${SOURCE_DIR}/dials_xia2.sh round=${ROUND}" "${SOURCE_DIR}/autoproc.sh round=${ROUND}"
+# Race mode: the first pipeline whose statistics meet the thresholds stops the others
+RACE_ARGS=()
+if [ "${RACE}" = "true" ]; then
+  RACE_CHECK="python3 ${SOURCE_DIR}/dr_quality.py {name}/{name}_SUMMARY/{name}_STATISTICS.json --rmeas ${RACE_RMEAS:-0.2} --cchalf ${RACE_CCHALF:-0.95} --completeness ${RACE_COMPLETENESS:-90}"
+  if [ -n "${RACE_RESOLUTION}" ]; then
+    RACE_CHECK="${RACE_CHECK} --resolution ${RACE_RESOLUTION}"
+  fi
+  RACE_ARGS=(--stop-when "${RACE_CHECK}" --winner race_winner.txt)
+fi
+
+if [ "${STREAM}" = "true" ] && [ "${FILE_TYPE}" != "h5" ]; then
+  # Stream mode: XDS follows the frames as they land with the whole CPU budget; the wait for the end of
+  # the sweep runs outside the budget, then xia2 and autoPROC share it. The XDS job of the second run
+  # stands for the background XDS (race check, stops it when another pipeline wins).
+  python3 ${SOURCE_DIR}/scheduler.py run --job-mem ${JOB_MEM_MB} \
+    --job XDS "${SOURCE_DIR}/xds.sh round=${ROUND}$(handoff XDS)" &
+  xds_pid=$!
+  if python3 ${SOURCE_DIR}/stream_watch.py complete "${DATA_PATH}" "${STREAM_ARGS[@]}" > /dev/null; then
+    python3 ${SOURCE_DIR}/scheduler.py run --job-mem ${JOB_MEM_MB} "${RACE_ARGS[@]}" \
+      --job XDS:0:0 "trap 'kill ${xds_pid} 2>/dev/null' TERM; tail --pid=${xds_pid} -f /dev/null & wait \$!" \
+      --job XDS_XIA2 "${SOURCE_DIR}/xds_xia2.sh round=${ROUND}$(handoff XDS_XIA2)" \
+      --job DIALS_XIA2 "${SOURCE_DIR}/dials_xia2.sh round=${ROUND}$(handoff DIALS_XIA2)" \
+      --job autoPROC "${SOURCE_DIR}/autoproc.sh round=${ROUND}$(handoff autoPROC)"
+  fi
+  wait ${xds_pid}
+else
+  python3 ${SOURCE_DIR}/scheduler.py run --job-mem ${JOB_MEM_MB} "${RACE_ARGS[@]}" \
+    --job XDS "${SOURCE_DIR}/xds.sh round=${ROUND}$(handoff XDS)" \
+    --job XDS_XIA2 "${SOURCE_DIR}/xds_xia2.sh round=${ROUND}$(handoff XDS_XIA2)" \
+    --job DIALS_XIA2 "${SOURCE_DIR}/dials_xia2.sh round=${ROUND}$(handoff DIALS_XIA2)" \
+    --job autoPROC "${SOURCE_DIR}/autoproc.sh round=${ROUND}$(handoff autoPROC)"
+fi
 
 #############################################
 # Gather success/failure flags from each tool
@@ -76,7 +154,9 @@ done
 # Second round if needed
 #############################################
 echo ""
-if [[ (${FLAG_XDS} -eq 1 && ${FLAG_XDS_XIA2} -eq 1 && ${FLAG_DIALS_XIA2} -eq 1 && ${FLAG_autoPROC} -eq 1) ]] || [[ -n "$CELL_CONSTANTS_INPUT" ]]; then
+if [ -f "race_winner.txt" ]; then
+    echo "$(cat race_winner.txt) met the race thresholds, no need for second round data processing."
+elif [[ (${FLAG_XDS} -eq 1 && ${FLAG_XDS_XIA2} -eq 1 && ${FLAG_DIALS_XIA2} -eq 1 && ${FLAG_autoPROC} -eq 1) ]] || [[ -n "$CELL_CONSTANTS_INPUT" ]]; then
     echo "No need for second round data processing."
 elif [[ (${FLAG_XDS} -eq 0 && ${FLAG_XDS_XIA2} -eq 0 && ${FLAG_DIALS_XIA2} -eq 0 && ${FLAG_autoPROC} -eq 0) ]];then
     echo "Data reduction failed."
@@ -89,9 +169,9 @@ else
 
     # Extract refined space group and cell parameters
     #SPACE_GROUP_NUMBER=$(grep 'Space group number:' ${BEST_1}/${BEST_1}_SUMMARY/${BEST_1}_SUMMARY.log | cut -d ':' -f 2 | sed 's/ //g')
-    SPACE_GROUP=$(grep 'Space group:' ${BEST_1}/${BEST_1}_SUMMARY/${BEST_1}_SUMMARY.log | cut -d ':' -f 2 | sed 's/ //g')
-    UNIT_CELL_CONSTANTS=$(grep 'Unit cell:' ${BEST_1}/${BEST_1}_SUMMARY/${BEST_1}_SUMMARY.log | cut -d ':' -f 2 | sed 's/^ *//g' | sed 's/ *$//g' | sed 's/  */,/g')
-    UNIT_CELL="\"$(grep 'Unit cell:' ${BEST_1}/${BEST_1}_SUMMARY/${BEST_1}_SUMMARY.log | cut -d ':' -f 2 | sed 's/^ *//g' | sed 's/ *$//g')\"" # | sed 's/  */ /g'
+    SPACE_GROUP=$(python3 ${SOURCE_DIR}/dr_parse.py get ${BEST_1}/${BEST_1}_SUMMARY/${BEST_1}_STATISTICS.json space_group)
+    UNIT_CELL_CONSTANTS=$(python3 ${SOURCE_DIR}/dr_parse.py get ${BEST_1}/${BEST_1}_SUMMARY/${BEST_1}_STATISTICS.json aimless.unit_cell | sed 's/ *$//g' | sed 's/  */,/g')
+    UNIT_CELL="\"$(python3 ${SOURCE_DIR}/dr_parse.py get ${BEST_1}/${BEST_1}_SUMMARY/${BEST_1}_STATISTICS.json aimless.unit_cell | sed 's/ *$//g')\"" # | sed 's/  */ /g'
 
     # Correct problematic space groups to their proper equivalents
     if [ "${SPACE_GROUP}" == "P2122" ] || [ "${SPACE_GROUP}" == "P2212" ]; then
@@ -104,7 +184,11 @@ else
       SPACE_GROUP="C1211"
     fi
     ROUND=2
-    parallel -u ::: "${SOURCE_DIR}/xds.sh round=${ROUND} flag=${FLAG_XDS} sp=${SPACE_GROUP} cell_constants=\"${UNIT_CELL_CONSTANTS}\"" "${SOURCE_DIR}/xds_xia2.sh round=${ROUND} flag=${FLAG_XDS_XIA2} sp=${SPACE_GROUP} cell_constants=\"${UNIT_CELL_CONSTANTS}\"" "${SOURCE_DIR}/dials_xia2.sh round=${ROUND} flag=${FLAG_DIALS_XIA2} sp=${SPACE_GROUP} cell_constants=\"${UNIT_CELL_CONSTANTS}\"" "${SOURCE_DIR}/autoproc.sh round=${ROUND} flag=${FLAG_autoPROC} sp=${SPACE_GROUP} cell_constants=${UNIT_CELL}"
+    python3 ${SOURCE_DIR}/scheduler.py run --job-mem ${JOB_MEM_MB} \
+      --job XDS "${SOURCE_DIR}/xds.sh round=${ROUND} flag=${FLAG_XDS} sp=${SPACE_GROUP} cell_constants=\"${UNIT_CELL_CONSTANTS}\"$(handoff XDS)" \
+      --job XDS_XIA2 "${SOURCE_DIR}/xds_xia2.sh round=${ROUND} flag=${FLAG_XDS_XIA2} sp=${SPACE_GROUP} cell_constants=\"${UNIT_CELL_CONSTANTS}\"$(handoff XDS_XIA2)" \
+      --job DIALS_XIA2 "${SOURCE_DIR}/dials_xia2.sh round=${ROUND} flag=${FLAG_DIALS_XIA2} sp=${SPACE_GROUP} cell_constants=\"${UNIT_CELL_CONSTANTS}\"$(handoff DIALS_XIA2)" \
+      --job autoPROC "${SOURCE_DIR}/autoproc.sh round=${ROUND} flag=${FLAG_autoPROC} sp=${SPACE_GROUP} cell_constants=${UNIT_CELL}$(handoff autoPROC)"
 fi
 
 #############################################
@@ -116,43 +200,62 @@ echo ""
 echo "           Resolution   Rmerge   Rmeas   I/Sigma   CC(1/2)   Completeness   Multiplicity   Space group                           Cell"
 echo ""
 
-# Function to extract summary metrics from logs
+# In race mode, pipelines stopped before they finished are left out
+completed() {
+    [ "${RACE}" != "true" ] || grep -q "FLAG_${1}=1" temp.txt
+}
+
+# Function to print the summary line of a pipeline from its statistics JSON
 extract_values() {
-    local log_file=$1
+    local stats_file=$1
     local prefix=$2
 
-    if [ -f "${log_file}" ]; then
-        local resolution=$(grep 'High resolution limit' ${log_file} | awk '{print $4}')
-        local rmerge=$(grep 'Rmerge  (all I+ and I-)' ${log_file} | awk '{print $6}')
-        local rmeas=$(grep 'Rmeas (all I+ & I-)' ${log_file} | awk '{print $6}')
-        local i_over_sigma=$(grep 'Mean((I)/sd(I))' ${log_file} | awk '{print $2}')
-        local cc_half=$(grep 'Mn(I) half-set correlation CC(1/2)' ${log_file} | awk '{print $5}')
-        local completeness=$(grep 'Completeness' ${log_file} | awk '{print $2}')
-        local multiplicity=$(grep 'Multiplicity' ${log_file} | awk '{print $2}')
-        local space_group=$(grep 'Space group:' ${log_file} | cut -d ':' -f 2 | sed 's/ //g')
-        local cell=$(grep 'Unit cell:' ${log_file} | cut -d ':' -f 2 | sed 's/^ *//g' | sed 's/ *$//g' | sed 's/  */ /g')
-
-        printf "%-10s  %.2f       %.3f      %.3f     %.1f     %.3f        %.1f           %.1f          %s     %.4f %.4f %.4f %.4f %.4f %.4f\n" \
-       "${prefix}" ${resolution} ${rmerge} ${rmeas} ${i_over_sigma} ${cc_half} ${completeness} ${multiplicity} ${space_group} ${cell}
+    if [ -f "${stats_file}" ] && completed "${prefix}"; then
+        python3 ${SOURCE_DIR}/dr_parse.py row ${stats_file} ${prefix}
         echo ""
     fi
 }
 
 # Collect results from all pipelines
-extract_values "XDS/XDS_SUMMARY/XDS_SUMMARY.log" "XDS"
-extract_values "XDS_XIA2/XDS_XIA2_SUMMARY/XDS_XIA2_SUMMARY.log" "XDS_XIA2"
-extract_values "DIALS_XIA2/DIALS_XIA2_SUMMARY/DIALS_XIA2_SUMMARY.log" "DIALS_XIA2"
-extract_values "autoPROC/autoPROC_SUMMARY/autoPROC_SUMMARY.log" "autoPROC"
+extract_values "XDS/XDS_SUMMARY/XDS_STATISTICS.json" "XDS"
+extract_values "XDS_XIA2/XDS_XIA2_SUMMARY/XDS_XIA2_STATISTICS.json" "XDS_XIA2"
+extract_values "DIALS_XIA2/DIALS_XIA2_SUMMARY/DIALS_XIA2_STATISTICS.json" "DIALS_XIA2"
+extract_values "autoPROC/autoPROC_SUMMARY/autoPROC_STATISTICS.json" "autoPROC"
 
 # Copy MTZs and summaries into central summary folder
 names=("XDS" "XDS_XIA2" "DIALS_XIA2" "autoPROC")
 for name in "${names[@]}"; do
-  if [ -f "${name}/${name}_SUMMARY/${name}.mtz" ]; then
+  if [ -f "${name}/${name}_SUMMARY/${name}.mtz" ] && completed "${name}"; then
     cp "${name}/${name}_SUMMARY/${name}.mtz" "DATA_REDUCTION_SUMMARY/${name}.mtz"
     cp "${name}/${name}_SUMMARY/${name}_SUMMARY.log" "DATA_REDUCTION_SUMMARY/${name}_SUMMARY.log"
+    cp "${name}/${name}_SUMMARY/${name}_STATISTICS.json" "DATA_REDUCTION_SUMMARY/${name}_STATISTICS.json"
   fi
 done
 
+# Plot the statistics of all pipelines in one process (NAME/STATISTICS_FIGURES and a comparison figure)
+plot_args=()
+for name in "${names[@]}"; do
+  if [ -f "${name}/${name}_SUMMARY/${name}_STATISTICS.json" ] && completed "${name}"; then
+    plot_args+=(--pipeline "${name}" "${name}/${name}_SUMMARY/${name}_STATISTICS.json")
+  fi
+done
+if [ ${#plot_args[@]} -gt 0 ]; then
+  python3 ${SOURCE_DIR}/plot_stats.py "${plot_args[@]}" --comparison DATA_REDUCTION_SUMMARY/comparison.svg
+fi
+
+cp header.json DATA_REDUCTION_SUMMARY/header.json
+
+# Group redundant MTZs; MR and SAD only use the distinct ones selected in TRIAGE.txt
+rm -f DATA_REDUCTION_SUMMARY/TRIAGE.txt SAD_INPUT/TRIAGE.txt
+if [ "${TRIAGE:-2}" -gt 0 ]; then
+  python3 ${SOURCE_DIR}/mtz_triage.py DATA_REDUCTION_SUMMARY --top ${TRIAGE:-2}
+  python3 ${SOURCE_DIR}/mtz_triage.py SAD_INPUT --top ${TRIAGE:-2} > /dev/null
+fi
+
+# Convert the MTZs for MR (F SIGF FreeR_flag) and SAD once, into the read-only store
+python3 ${SOURCE_DIR}/mtz_store.py prepare DATA_REDUCTION_SUMMARY --sets F
+python3 ${SOURCE_DIR}/mtz_store.py prepare SAD_INPUT --sets ANOM
+
 # Cleanup temporary files
 rm *.*
 
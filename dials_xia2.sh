@@ -11,17 +11,18 @@
 #   ./dials_xia2.sh round=1 flag=0 sp="P212121" cell_constants="78.3 84.1 96.5 90 90 90"
 #
 # Required Environment Variables:
-#   SOURCE_DIR     Path to helper scripts (e.g., plot.sh, dr_log.sh, durin-plugin.so)
+#   SOURCE_DIR     Path to helper scripts (e.g., dr_parse.py, durin-plugin.so)
 #   DATA_PATH      Directory containing diffraction image files
 #   FILE_TYPE      Format of diffraction images (e.g., h5, cbf, img)
 #
 # Optional Variables:
-#   BEAM_X, BEAM_Y           Beam center in mm (converted to pixels from header.log)
+#   BEAM_X, BEAM_Y           Beam center in mm (converted to pixels from header.json)
 #   DISTANCE                 Crystal-to-detector distance (mm)
 #   IMAGE_START, IMAGE_END   Image range for processing
 #   ROTATION_AXIS            Rotation axis vector (comma-separated, e.g., "1,0,0")
 #   SPACE_GROUP              Space group symbol (e.g., "P212121")
 #   UNIT_CELL_CONSTANTS      Unit cell parameters "a b c alpha beta gamma"
+#   AUTOPD_NPROC             CPU slots granted by scheduler.py (passed as xia2 nproc)
 #
 # Exit Codes:
 #   0  Success
@@ -70,8 +71,8 @@ esac
 # Compute beam center in pixels if provided
 #############################################
 if [ -n "${BEAM_X}" ]; then
-    PIXEL_X=$(grep "Pixel size (X,Y)" header.log | awk '{print $6}' | cut -d ',' -f1)
-    PIXEL_Y=$(grep "Pixel size (X,Y)" header.log | awk '{print $6}' | cut -d ',' -f2)
+    PIXEL_X=$(python3 ${SOURCE_DIR}/read_header.py get header.json pixel_size.0)
+    PIXEL_Y=$(python3 ${SOURCE_DIR}/read_header.py get header.json pixel_size.1)
     BEAM_X=$(echo "scale=2; ${BEAM_X}*${PIXEL_X}" | bc)
     BEAM_Y=$(echo "scale=2; ${BEAM_Y}*${PIXEL_Y}" | bc)
     BEAM=${BEAM_X},${BEAM_Y}
@@ -91,56 +92,40 @@ cd DIALS_XIA2_${ROUND}
 #############################################
 args=()
 
-for param in "goniometer.axes=${ROTATION_AXIS}" "xia2.settings.space_group=${SPACE_GROUP}" "xia2.settings.unit_cell=${UNIT_CELL_CONSTANTS}" "mosflm_beam_centre=${BEAM}" "geometry.detector.distance=${DISTANCE}"; do
+for param in "goniometer.axes=${ROTATION_AXIS}" "xia2.settings.space_group=${SPACE_GROUP}" "xia2.settings.unit_cell=${UNIT_CELL_CONSTANTS}" "mosflm_beam_centre=${BEAM}" "geometry.detector.distance=${DISTANCE}" "nproc=${AUTOPD_NPROC}"; do
     IFS="=" read -r key value <<< "$param"
     [ -n "$value" ] && args+=("$key=$value")
 done
 
 #############################################
 # Run xia2 with pipeline=dials
-# Start asynchronously to monitor timeout/errors
-#############################################d
+# Supervised (supervisor.py): stopped as soon as xia2-error.txt appears or after 10 hours
+#############################################
+XIA2_SUPERVISOR=(python3 ${SOURCE_DIR}/supervisor.py run --name DIALS_XIA2 --timeout 10h --fail-on xia2-error.txt --)
 if [ -n "${IMAGE_START}" ] && [ -n "${IMAGE_END}" ]; then
   if [ "${FILE_TYPE}" = "h5" ]; then
     IMAGE_NAME=$(find "${DATA_PATH}" -maxdepth 1 -type f -name "*master.h5" -print -quit | xargs realpath)
   else
     IMAGE_NAME=$(ls -1 "${DATA_PATH}" | head -1 | xargs -I{} realpath "${DATA_PATH}/{}")
   fi     
-  xia2 pipeline=dials image=${IMAGE_NAME}:${IMAGE_START}:${IMAGE_END} hdf5_plugin=${SOURCE_DIR}/durin-plugin.so atom=X "${args[@]}" > /dev/null &
-  CMD_PID=$!
+  "${XIA2_SUPERVISOR[@]}" ${AUTOPD_PROFILE} xia2 pipeline=dials image=${IMAGE_NAME}:${IMAGE_START}:${IMAGE_END} hdf5_plugin=${SOURCE_DIR}/durin-plugin.so atom=X "${args[@]}" > /dev/null
 else
-  xia2 pipeline=dials ${DATA_PATH} hdf5_plugin=${SOURCE_DIR}/durin-plugin.so atom=X "${args[@]}" > /dev/null &
-  CMD_PID=$!
+  "${XIA2_SUPERVISOR[@]}" ${AUTOPD_PROFILE} xia2 pipeline=dials ${DATA_PATH} hdf5_plugin=${SOURCE_DIR}/durin-plugin.so atom=X "${args[@]}" > /dev/null
 fi
+XIA2_STATUS=$?
 
 #############################################
-# Monitor runtime and check for errors
+# Check for errors and timeout
 #############################################
-TIMEOUT=36000 # 10 hours max runtime
-COUNTER=0
-
-# Loop to check both the file and the timeout
-while kill -0 $CMD_PID 2> /dev/null; do
-  if [[ -e "xia2-error.txt" ]]; then
+if [ ${XIA2_STATUS} -eq 125 ]; then
     FLAG_DIALS_XIA2=0
     echo "FLAG_DIALS_XIA2=${FLAG_DIALS_XIA2}" >> ../../temp.txt
     echo "Round ${ROUND} DIALS_XIA2 processing failed!"
     exit 1
-  fi
-
-  # Break the loop if the command runs more than the timeout
-  if [[ $COUNTER -ge $TIMEOUT ]]; then
+elif [ ${XIA2_STATUS} -eq 124 ]; then
     echo "Round ${ROUND} DIALS_XIA2 processing failed! Timeout!"
-    kill $CMD_PID
     exit 1
-  fi
-
-  sleep 10 # Check every 2 seconds
-  ((COUNTER+=10)) # Increment the counter by 2 for each sleep
-done
-
-# Wait for your xia2 command to finish if it didn't time out
-wait $CMD_PID
+fi
 
 #############################################
 # Check for successful MTZ output
@@ -155,7 +140,7 @@ fi
 #############################################
 # Post-processing with AIMLESS, CTRUNCATE, and Pointless
 #############################################
-aimless hklin DEFAULT/scale/AUTOMATIC_DEFAULT_scaled_unmerged.mtz hklout DEFAULT/scale/AUTOMATIC_DEFAULT_aimless.mtz > LogFiles/AUTOMATIC_DEFAULT_aimless.log << EOF
+${AUTOPD_PROFILE} aimless hklin DEFAULT/scale/AUTOMATIC_DEFAULT_scaled_unmerged.mtz hklout DEFAULT/scale/AUTOMATIC_DEFAULT_aimless.mtz > LogFiles/AUTOMATIC_DEFAULT_aimless.log << EOF
 bins 20
 scales constant
 anomalous on
@@ -169,9 +154,9 @@ if [ ! -f "DEFAULT/scale/AUTOMATIC_DEFAULT_aimless.mtz" ]; then
     exit 1
 fi
 
-ctruncate -mtzin DataFiles/AUTOMATIC_DEFAULT_free.mtz -mtzout DataFiles/AUTOMATIC_DEFAULT_truncated.mtz -colin '/*/*/[IMEAN,SIGIMEAN]' -colano '/*/*/[I(+),SIGI(+),I(-),SIGI(-)]' > LogFiles/AUTOMATIC_DEFAULT_ctruncate.log
+${AUTOPD_PROFILE} ctruncate -mtzin DataFiles/AUTOMATIC_DEFAULT_free.mtz -mtzout DataFiles/AUTOMATIC_DEFAULT_truncated.mtz -colin '/*/*/[IMEAN,SIGIMEAN]' -colano '/*/*/[I(+),SIGI(+),I(-),SIGI(-)]' > LogFiles/AUTOMATIC_DEFAULT_ctruncate.log
 
-pointless hklin DataFiles/AUTOMATIC_DEFAULT_free.mtz hklout DataFiles/pointless.mtz > LogFiles/pointless.log
+${AUTOPD_PROFILE} pointless hklin DataFiles/AUTOMATIC_DEFAULT_free.mtz hklout DataFiles/pointless.mtz > LogFiles/pointless.log
 
 cd ..
 
@@ -184,24 +169,24 @@ cp ../header.log DIALS_XIA2_SUMMARY/DIALS_XIA2_SUMMARY.log
 
 # Extract refined geometry from DIALS experiment file
 echo "Refined parameters:" >> DIALS_XIA2_SUMMARY/DIALS_XIA2_SUMMARY.log
-dials.show DIALS_XIA2_${ROUND}/DataFiles/*SWEEP1.expt > DIALS_XIA2_${ROUND}/DataFiles/SWEEP1.log
+${AUTOPD_PROFILE} dials.show DIALS_XIA2_${ROUND}/DataFiles/*SWEEP1.expt > DIALS_XIA2_${ROUND}/DataFiles/SWEEP1.log
 distance_refined=$(grep "distance" DIALS_XIA2_${ROUND}/DataFiles/SWEEP1.log | awk '{print $2}')
 echo "Distance_refined               [mm] = ${distance_refined}" >> DIALS_XIA2_SUMMARY/DIALS_XIA2_SUMMARY.log
 beam_center_refined=$(grep "px:" DIALS_XIA2_${ROUND}/DataFiles/SWEEP1.log | cut -d '(' -f2 | cut -d ')' -f1)
 echo "Beam_center_refined         [pixel] = ${beam_center_refined}" >> DIALS_XIA2_SUMMARY/DIALS_XIA2_SUMMARY.log
 rm DIALS_XIA2_${ROUND}/DataFiles/SWEEP1.log
-${SOURCE_DIR}/dr_log.sh DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_aimless.log DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_ctruncate.log DIALS_XIA2_${ROUND}/LogFiles/pointless.log >> DIALS_XIA2_SUMMARY/DIALS_XIA2_SUMMARY.log
+python3 ${SOURCE_DIR}/dr_parse.py parse --aimless DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_aimless.log --ctruncate DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_ctruncate.log --pointless DIALS_XIA2_${ROUND}/LogFiles/pointless.log --json DIALS_XIA2_SUMMARY/DIALS_XIA2_STATISTICS.json >> DIALS_XIA2_SUMMARY/DIALS_XIA2_SUMMARY.log
 
 #############################################
 # Evaluate Rmeas and determine success/failure
 #############################################
-Rmeas_DIALS_XIA2=$(grep 'Rmeas (all I+ & I-)' DIALS_XIA2_SUMMARY/DIALS_XIA2_SUMMARY.log | awk '{print $6}')
+Rmeas_DIALS_XIA2=$(python3 ${SOURCE_DIR}/dr_parse.py get DIALS_XIA2_SUMMARY/DIALS_XIA2_STATISTICS.json overall.rmeas)
 Rmeas_DIALS_XIA2=${Rmeas_DIALS_XIA2:-0}
 
 if [ $(echo "${Rmeas_DIALS_XIA2} <= 0" | bc) -eq 1 ] || [ $(echo "${Rmeas_DIALS_XIA2} >= 100" | bc) -eq 1 ];then
     FLAG_DIALS_XIA2=0
     echo "Round ${ROUND} DIALS_XIA2 processing failed!"
-    rm DIALS_XIA2_SUMMARY/DIALS_XIA2_SUMMARY.log
+    rm DIALS_XIA2_SUMMARY/DIALS_XIA2_SUMMARY.log DIALS_XIA2_SUMMARY/DIALS_XIA2_STATISTICS.json
     exit 1
 else
     echo "FLAG_DIALS_XIA2=1" >> ../temp.txt
@@ -217,39 +202,9 @@ if grep -q "strong anomalous signal" "DIALS_XIA2_SUMMARY/DIALS_XIA2_SUMMARY.log"
     cp DIALS_XIA2_SUMMARY/DIALS_XIA2.mtz ../SAD_INPUT
 fi
 
-#############################################
-# Extract statistics for plotting
-#############################################
-mkdir -p STATISTICS_FIGURES
-cd STATISTICS_FIGURES
-
-#cchalf_vs_resolution
-grep -A25 '$TABLE:  Correlations CC(1/2) within dataset' ../DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_aimless.log | tail -20 > cchalf_vs_resolution.dat
-
-#completeness_vs_resolution
-grep -A24 '$TABLE:  Completeness & multiplicity v. resolution' ../DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_aimless.log | tail -20 > completeness_vs_resolution.dat
-
-#i_over_sigma_vs_resolution & rmerge_rmeans_rpim_vs_resolution
-grep -m1 -A28 '$TABLE:  Analysis against resolution' ../DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_aimless.log | tail -20 > analysis_vs_resolution.dat
-
-#scales_vs_batch
-start=$(($(grep -n '    N  Run    Phi    Batch     Mn(k)        0k      Number   Bfactor    Bdecay' ../DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_aimless.log | head -1 | cut -d ':' -f 1)+1))
-end=$(($(grep -n '    N  Run    Phi    Batch     Mn(k)        0k      Number   Bfactor    Bdecay' ../DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_aimless.log | tail -1 | cut -d ':' -f 1)-2))
-sed -n "${start},${end}p" ../DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_aimless.log > scales_vs_batch.dat
-
-#rmerge_and_i_over_sigma_vs_batch
-start=$(($(grep -n '    N   Batch    Mn(I)   RMSdev  I/rms  Rmerge    Number  Nrej Cm%poss  AnoCmp MaxRes CMlplc   Chi^2  Chi^2c SmRmerge' ../DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_aimless.log | head -1 | cut -d ':' -f 1)+1))
-end=$(($(grep -n '    N   Batch    Mn(I)   RMSdev  I/rms  Rmerge    Number  Nrej Cm%poss  AnoCmp MaxRes CMlplc   Chi^2  Chi^2c SmRmerge' ../DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_aimless.log | tail -1 | cut -d ':' -f 1)-2))
-sed -n "${start},${end}p" ../DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_aimless.log > rmerge_and_i_over_sigma_vs_batch.dat
-
-#L_test
-grep -A24 '$TABLE: L test for twinning:' ../DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_ctruncate.log | tail -21 > L_test.dat
-L_statistic=$(grep 'L statistic =' ../DIALS_XIA2_${ROUND}/LogFiles/AUTOMATIC_DEFAULT_ctruncate.log | awk '{print $4}')
-
-# Generate plots
-${SOURCE_DIR}/plot.sh ${L_statistic}
+# Figures of all pipelines are plotted once by data_reduction.sh (plot_stats.py)
 
 #############################################
 # Return to main directory
 #############################################
-cd ../..
+cd ..
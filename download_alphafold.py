@@ -3,55 +3,133 @@
 # Script Name: download_alphafold.py
 # Description: Download AlphaFold PDB file from EBI AlphaFold DB, calculate average pLDDT,
 #              and insert it into the PDB as a REMARK line.
-# Usage:       python3 download_alphafold.py <UniProt_ID>
+#              Models are kept in a local cache, ${AUTOPD_CACHE:-~/.cache/autopd}/afdb/AF-<ID>-F1-model_v<N>.pdb,
+#              and served from there without network access. --prefetch fills the cache for a list of
+#              UniProt IDs ahead of time (e.g. on a node with internet access), downloading them concurrently
+#              over one pooled session with retries and streaming every file straight to disk.
+# Usage:       python3 download_alphafold.py <UniProt_ID> [--version 4] [--offline]
+#              python3 download_alphafold.py --prefetch <ID,ID,...|file of IDs> [--jobs 8]
 # Example:     python3 download_alphafold.py P00520
 #
 # Input:       UniProt accession ID (string, e.g., P00520).
 # Output:      PDB file saved in the current directory with an additional REMARK line showing average pLDDT.
 #
+# Environment:
+#   AUTOPD_CACHE   Cache root (default ~/.cache/autopd)
+#   AFDB_URL       Base URL of the model files (default https://alphafold.ebi.ac.uk/files)
+#
 # Dependencies:
 #   - Python 3.7+
-#   - requests library (`pip install requests`)
+#   - requests library (`pip install requests`), not needed with --offline
 #
 # Author: ZHANG Xin
 # Date Created: 2023-06-01
-# Last Modified: 2025-08-03
+# Last Modified: 2025-09-01
 #############################################################################################################
 
-import requests
 import argparse
-import re
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from model_stats import pdb_atoms
+
+AFDB_URL = 'https://alphafold.ebi.ac.uk/files'
+CHUNK_SIZE = 1 << 16
+
+
+def cache_directory(cache=None):
+    root = cache or os.environ.get('AUTOPD_CACHE') or os.path.expanduser('~/.cache/autopd')
+    return os.path.join(root, 'afdb')
+
+
+def model_name(uniprot_id, version):
+    return f"AF-{uniprot_id.upper()}-F1-model_v{version}.pdb"
 
-def download_alphafold_pdb(uniprot_id):
-    # Construct API URL for the PDB file
-    pdb_url = f"https://alphafold.ebi.ac.uk/files/AF-{uniprot_id}-F1-model_v4.pdb"
-    
+
+def make_session(pool_size, retries=5):
+    """One session for all downloads: pooled connections, retries with backoff on errors and rate limits."""
+    # Imported here so that the cache (--offline) works without requests
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(total=retries, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504],
+                  allowed_methods=['GET'])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch(session, uniprot_id, version, directory, base_url):
+    """Cached path of the model, downloading it (streamed to disk) if it is not cached yet."""
+    path = os.path.join(directory, model_name(uniprot_id, version))
+    if os.path.isfile(path) and os.path.getsize(path) > 0:
+        return path
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.part"
     try:
-        # Download PDB file
-        pdb_response = requests.get(pdb_url, stream=True)
-        pdb_response.raise_for_status()
-
-        # Read lines and collect pLDDT values
-        pdb_lines = []
-        plddt_values = []
-        for line in pdb_response.iter_lines():
-            decoded_line = line.decode('utf-8')
-            pdb_lines.append(decoded_line)
-            
-            # Check if the line is an ATOM or HETATM record
-            if decoded_line.startswith(('ATOM', 'HETATM')):
-                # Extract pLDDT from columns 61-66 (0-based index 60-66)
-                if len(decoded_line) >= 66:
-                    plddt_str = decoded_line[60:66].strip()
-                    if plddt_str:
-                        try:
-                            plddt = float(plddt_str)
-                            plddt_values.append(plddt)
-                        except ValueError:
-                            pass  # Skip invalid pLDDT values
-
-        # Calculate average pLDDT
-        avg_plddt = sum(plddt_values) / len(plddt_values) if plddt_values else 0.0
+        with session.get(f"{base_url.rstrip('/')}/{model_name(uniprot_id, version)}", stream=True,
+                         timeout=(10, 120)) as response:
+            response.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def prefetch(ids, version, directory, base_url, jobs):
+    """Download the models of many UniProt IDs concurrently; returns the IDs that failed."""
+    session = make_session(jobs)
+
+    def task(uniprot_id):
+        try:
+            fetch(session, uniprot_id, version, directory, base_url)
+            print(f"{uniprot_id} cached")
+            return None
+        except OSError as err:  # requests errors are OSErrors
+            print(f"{uniprot_id} failed: {err}")
+            return uniprot_id
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return [uniprot_id for uniprot_id in executor.map(task, ids) if uniprot_id]
+
+
+def read_ids(value):
+    """UniProt IDs from a file (whitespace or comma separated) or a comma separated list."""
+    if os.path.isfile(value):
+        with open(value, 'r', encoding='utf-8') as f:
+            value = f.read()
+    return [uniprot_id for uniprot_id in value.replace(',', ' ').split() if uniprot_id]
+
+
+def download_alphafold_pdb(uniprot_id, version=4, cache=None, base_url=AFDB_URL, offline=False):
+    directory = cache_directory(cache)
+    filename = model_name(uniprot_id, version)
+    cached = os.path.join(directory, filename)
+
+    try:
+        # Served from the cache; the network is only used for models not cached yet
+        if not os.path.isfile(cached):
+            if offline:
+                print(f"{filename} is not in the cache {directory} (offline)")
+                return False
+            try:
+                cached = fetch(make_session(1), uniprot_id, version, directory, base_url)
+            except OSError as err:  # requests errors are OSErrors
+                print(f"Download Error: {err}")
+                return False
+
+        with open(cached, 'rb') as f:
+            avg_plddt = pdb_atoms(f).atom_mean() or 0.0
+        with open(cached, 'r', encoding='utf-8') as f:
+            pdb_lines = f.read().splitlines()
 
         # Create new REMARK line
         new_remark = f"REMARK   1   Average pLDDT: {avg_plddt:.2f}"
@@ -87,14 +165,6 @@ def download_alphafold_pdb(uniprot_id):
         # Insert the new REMARK line
         pdb_lines.insert(insert_pos, new_remark)
 
-        # Determine filename from Content-Disposition or default
-        filename = f"AF-{uniprot_id}-F1-model_v4.pdb"
-        if 'Content-Disposition' in pdb_response.headers:
-            content_disp = pdb_response.headers['Content-Disposition']
-            match = re.search(r'filename=(["\']?)([^;"\']+)\1', content_disp)
-            if match:
-                filename = match.group(2)
-
         # Write the modified content to the file
         with open(filename, 'w') as f:
             f.write('\n'.join(pdb_lines))
@@ -102,15 +172,27 @@ def download_alphafold_pdb(uniprot_id):
         print(f"File saved as {filename} plddt={avg_plddt}")
         return True
 
-    except requests.exceptions.HTTPError as err:
-        print(f"HTTP Error: {err}")
     except Exception as e:
         print(f"Error processing file: {e}")
     return False
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Download AlphaFold PDB with average pLDDT remark')
-    parser.add_argument('uniprot_id', type=str, help='UniProt ID (e.g. P00520)')
+    parser.add_argument('uniprot_id', type=str, nargs='?', help='UniProt ID (e.g. P00520)')
+    parser.add_argument('--version', type=int, default=4, help='AlphaFold DB model version')
+    parser.add_argument('--prefetch', default=None, help='Cache the models of these IDs (comma separated or file)')
+    parser.add_argument('--jobs', type=int, default=8, help='Concurrent downloads of --prefetch')
+    parser.add_argument('--offline', action='store_true', help='Only use the cache')
+    parser.add_argument('--cache', default=None, help='Cache root (default: ${AUTOPD_CACHE} or ~/.cache/autopd)')
+    parser.add_argument('--url', default=os.environ.get('AFDB_URL', AFDB_URL), help='Base URL of the model files')
     args = parser.parse_args()
-    
-    download_alphafold_pdb(args.uniprot_id)
+
+    if args.prefetch:
+        failed = prefetch(read_ids(args.prefetch), args.version, cache_directory(args.cache), args.url,
+                          max(1, args.jobs))
+        sys.exit(1 if failed else 0)
+    if not args.uniprot_id:
+        parser.error('a UniProt ID or --prefetch is required')
+
+    if not download_alphafold_pdb(args.uniprot_id, args.version, args.cache, args.url, args.offline):
+        sys.exit(1)
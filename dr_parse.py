@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: dr_parse.py
+# Description: Single-pass parser of the AIMLESS, CTRUNCATE and POINTLESS logs of a data reduction pipeline.
+#              Every log is read once; summary values, the AIMLESS summary table and all loggraph tables
+#              ($TABLE) are collected into one JSON document (NAME_SUMMARY/NAME_STATISTICS.json) that the
+#              shell scripts, the race check and the plots use instead of grep/awk/sed on the logs.
+#
+# Usage:
+#   python3 dr_parse.py parse --aimless aimless.log --ctruncate ctruncate.log [--pointless pointless.log] [--json out.json]
+#       Writes the JSON document and prints the summary text (formerly dr_log.sh) to stdout.
+#   python3 dr_parse.py dat XDS_STATISTICS.json STATISTICS_FIGURES
+#       Writes the .dat tables used for plotting.
+#   python3 dr_parse.py get XDS_STATISTICS.json overall.rmeas
+#       Prints one value (empty if missing).
+#   python3 dr_parse.py row XDS_STATISTICS.json XDS
+#       Prints the line of the data reduction summary table.
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import json
+import os
+import sys
+
+# Loggraph tables written as .dat files: name -> (log, title prefix, occurrence)
+DAT_TABLES = {
+    'cchalf_vs_resolution': ('aimless', 'Correlations CC(1/2) within dataset', -1),
+    'completeness_vs_resolution': ('aimless', 'Completeness & multiplicity v. resolution', -1),
+    'analysis_vs_resolution': ('aimless', 'Analysis against resolution', 0),
+    'L_test': ('ctruncate', 'L test for twinning', -1),
+}
+
+# Text tables of AIMLESS delimited by their (repeated) header line
+BATCH_TABLES = {
+    'scales_vs_batch': '    N  Run    Phi    Batch     Mn(k)        0k      Number   Bfactor    Bdecay',
+    'rmerge_and_i_over_sigma_vs_batch': '    N   Batch    Mn(I)   RMSdev  I/rms  Rmerge    Number  Nrej Cm%poss  AnoCmp MaxRes CMlplc   Chi^2  Chi^2c SmRmerge',
+}
+
+# Rows of the AIMLESS summary table -> keys of "overall"
+OVERALL_LABELS = {
+    'High resolution limit': 'resolution',
+    'Low resolution limit': 'low_resolution',
+    'Rmerge  (all I+ and I-)': 'rmerge',
+    'Rmeas (all I+ & I-)': 'rmeas',
+    'Rpim (all I+ & I-)': 'rpim',
+    'Mean((I)/sd(I))': 'i_over_sigma',
+    'Mn(I) half-set correlation CC(1/2)': 'cc_half',
+    'Completeness': 'completeness',
+    'Multiplicity': 'multiplicity',
+    'Anomalous completeness': 'anomalous_completeness',
+    'Anomalous multiplicity': 'anomalous_multiplicity',
+}
+
+# Keys of "overall" printed in the data reduction summary table; every AIMLESS summary has them
+ROW_KEYS = ('resolution', 'rmerge', 'rmeas', 'i_over_sigma', 'cc_half', 'completeness', 'multiplicity')
+
+SUMMARY_HEADER = 'Overall  InnerShell  OuterShell'
+SUMMARY_LINES = 25
+
+
+def read_lines(path):
+    if not path or not os.path.isfile(path):
+        return []
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        return f.read().splitlines()
+
+
+def to_number(token):
+    try:
+        value = float(token)
+    except ValueError:
+        return token
+    return int(value) if token.lstrip('+-').isdigit() else value
+
+
+def field(line, n):
+    """awk '{print $n}'"""
+    fields = line.split()
+    return fields[n - 1] if len(fields) >= n else ''
+
+
+def cut(line, delimiter, n):
+    """cut -d delimiter -f n"""
+    if delimiter not in line:
+        return line
+    fields = line.split(delimiter)
+    return fields[n - 1] if len(fields) >= n else ''
+
+
+def grep_after(lines, pattern, after):
+    """grep -A after, including the '--' separators between groups."""
+    printed = set()
+    for i, line in enumerate(lines):
+        if pattern in line:
+            printed.update(range(i, min(i + after + 1, len(lines))))
+    output = []
+    previous = None
+    for i in sorted(printed):
+        if previous is not None and i != previous + 1:
+            output.append('--')
+        output.append(lines[i])
+        previous = i
+    return output
+
+
+def parse_loggraph(lines):
+    """
+    All $TABLE blocks: $TABLE: title / $GRAPHS ... $$ / column names $$ / $$ data $$.
+    Returns a list of {'title', 'columns', 'rows'} in file order.
+    """
+    tables = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not line.lstrip().startswith('$TABLE'):
+            i += 1
+            continue
+        title = line.split(':', 1)[1].strip() if ':' in line else ''
+        sections = [[]]
+        i += 1
+        while i < len(lines) and len(sections) <= 4:
+            parts = lines[i].split('$$')
+            sections[-1].append(parts[0])
+            for part in parts[1:]:
+                sections.append([part])
+            i += 1
+        # sections: [graphs, columns, (empty), data, ...]
+        columns = ' '.join(sections[1]).split() if len(sections) > 1 else []
+        rows = []
+        for raw in (sections[3] if len(sections) > 3 else []):
+            tokens = raw.split()
+            if tokens:
+                rows.append([to_number(token) for token in tokens])
+        tables.append({'title': title, 'columns': columns, 'rows': rows})
+    return tables
+
+
+def batch_table(lines, header):
+    """Rows between the first and the last occurrence of the header (the last one preceded by a blank/rule)."""
+    positions = [i for i, line in enumerate(lines) if header in line]
+    if len(positions) < 2:
+        return []
+    return [[to_number(token) for token in line.split()] for line in lines[positions[0] + 1:positions[-1] - 1] if line.split()]
+
+
+def parse_summary_row(line):
+    """'Label   overall inner outer' -> (label, [numbers])"""
+    tokens = line.split()
+    for j, token in enumerate(tokens):
+        if isinstance(to_number(token), (int, float)):
+            return ' '.join(tokens[:j]), [to_number(t) for t in tokens[j:]]
+    return ' '.join(tokens), []
+
+
+def parse_aimless(lines):
+    batches, space_groups, space_group_numbers, mosaicity = [], [], [], []
+    low_overall, low_outer, high_overall, high_outer = [], [], [], []
+    for line in lines:
+        if '* Number of Batches' in line:
+            batches.append(field(line, 6))
+        if '* Space group' in line:
+            space_groups.append(cut(line, "'", 2))
+            space_group_numbers.append(cut(cut(line[::-1], ')', 2), ' ', 1)[::-1])
+        if 'Low resolution limit' in line:
+            low_overall.append(field(line, 4))
+            low_outer.append(field(line, 6))
+        if 'High resolution limit' in line:
+            high_overall.append(field(line, 4))
+            high_outer.append(field(line, 6))
+        if 'Average mosaicity' in line:
+            mosaicity.append(cut(line, ':', 2).lstrip(' '))
+
+    cell_lines = grep_after(lines, '* Cell Dimensions', 2)
+    unit_cell = cell_lines[-1].lstrip(' ') if cell_lines else ''
+    summary_block = grep_after(lines, SUMMARY_HEADER, SUMMARY_LINES)
+
+    summary = {}
+    for line in summary_block:
+        label, values = parse_summary_row(line)
+        if label and values and label not in summary:
+            summary[label] = values
+
+    return {
+        'batches': '\n'.join(batches),
+        'space_group': '\n'.join(space_groups),
+        'space_group_number': '\n'.join(space_group_numbers),
+        'unit_cell': unit_cell,
+        'low_resolution_overall': '\n'.join(low_overall),
+        'low_resolution_outershell': '\n'.join(low_outer),
+        'high_resolution_overall': '\n'.join(high_overall),
+        'high_resolution_outershell': '\n'.join(high_outer),
+        'average_mosaicity': '\n'.join(mosaicity),
+        'summary': summary,
+        'summary_block': summary_block,
+    }
+
+
+def parse_ctruncate(lines):
+    l_statistic = ''
+    for line in lines:
+        if 'L statistic =' in line and not l_statistic:
+            l_statistic = field(line, 4)
+    return {
+        'L_statistic': l_statistic,
+        'L_block': grep_after(lines, 'L statistic =', 5),
+        'twinning_block': grep_after(lines, 'TWINNING SUMMARY', 5),
+    }
+
+
+def parse_pointless(lines):
+    pointless = {}
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith('Best Solution:') and 'best_solution' not in pointless:
+            pointless['best_solution'] = stripped.split(':', 1)[1].replace('space group', '').strip()
+        elif stripped.startswith('Reindex operator:') and 'reindex_operator' not in pointless:
+            pointless['reindex_operator'] = stripped.split(':', 1)[1].strip()
+        elif stripped.startswith('Laue group probability:') and 'laue_group_probability' not in pointless:
+            pointless['laue_group_probability'] = to_number(stripped.split(':', 1)[1].strip())
+        elif stripped.startswith('Space group confidence:') and 'space_group_confidence' not in pointless:
+            pointless['space_group_confidence'] = to_number(stripped.split(':', 1)[1].strip())
+    return pointless
+
+
+def parse(aimless_path, ctruncate_path, pointless_path=None):
+    aimless_lines = read_lines(aimless_path)
+    ctruncate_lines = read_lines(ctruncate_path)
+    aimless = parse_aimless(aimless_lines)
+    ctruncate = parse_ctruncate(ctruncate_lines)
+
+    # Labels are compared with single spaces: AIMLESS pads some of them ('Rmerge  (all I+ and I-)')
+    summary = {' '.join(label.split()): values for label, values in aimless['summary'].items()}
+    overall = {}
+    for label, key in OVERALL_LABELS.items():
+        values = summary.get(' '.join(label.split()))
+        if values:
+            overall[key] = values[0]
+    if summary:
+        missing = [key for key in ROW_KEYS if key not in overall]
+        if missing:
+            print(f"Warning: {', '.join(missing)} not found in the AIMLESS summary of {aimless_path}", file=sys.stderr)
+
+    loggraphs = {'aimless': parse_loggraph(aimless_lines), 'ctruncate': parse_loggraph(ctruncate_lines)}
+    tables = {}
+    for name, (log, title, occurrence) in DAT_TABLES.items():
+        matches = [table for table in loggraphs[log] if table['title'].startswith(title)]
+        if matches:
+            tables[name] = {'columns': matches[occurrence]['columns'], 'rows': matches[occurrence]['rows']}
+    for name, header in BATCH_TABLES.items():
+        tables[name] = {'columns': header.split(), 'rows': batch_table(aimless_lines, header)}
+
+    return {
+        'logs': {'aimless': aimless_path, 'ctruncate': ctruncate_path, 'pointless': pointless_path},
+        'aimless': aimless,
+        'ctruncate': ctruncate,
+        'pointless': parse_pointless(read_lines(pointless_path)),
+        'overall': overall,
+        'space_group': aimless['space_group'].replace(' ', ''),
+        'unit_cell': [to_number(token) for token in aimless['unit_cell'].split()],
+        'tables': tables,
+        'loggraphs': {log: [table['title'] for table in found] for log, found in loggraphs.items()},
+    }
+
+
+def summary_text(stats):
+    """The summary appended to NAME_SUMMARY.log (same text as the former dr_log.sh)."""
+    aimless, ctruncate = stats['aimless'], stats['ctruncate']
+    lines = [
+        '',
+        '------------------------------------ Summary from AIMLESS -----------------------------------',
+        '',
+        f"The number of batches:  {aimless['batches']}",
+        f"Space group:  {aimless['space_group']}",
+        f"Space group number:  {aimless['space_group_number']}",
+        f"Unit cell:  {aimless['unit_cell']}",
+        f"Resolution:  {aimless['low_resolution_overall']} - {aimless['high_resolution_overall']} "
+        f"({aimless['low_resolution_outershell']} - {aimless['high_resolution_outershell']})",
+        f"Average mosaicity:  {aimless['average_mosaicity']}",
+        '',
+    ]
+    lines += aimless['summary_block']
+    lines += ['', '--------------------------------------- Twinning test ---------------------------------------', '']
+    lines += ctruncate['L_block']
+    lines += ['']
+    lines += ctruncate['twinning_block']
+    return '\n'.join(lines)
+
+
+def format_number(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def write_dat(stats, directory):
+    os.makedirs(directory, exist_ok=True)
+    for name, table in stats['tables'].items():
+        with open(os.path.join(directory, f"{name}.dat"), 'w', encoding='utf-8') as f:
+            for row in table['rows']:
+                f.write(' '.join(format_number(value) for value in row) + '\n')
+
+
+def get_value(stats, path):
+    value = stats
+    for key in path.split('.'):
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return format_number(value)
+
+
+def summary_row(stats, name):
+    """Line of the data reduction summary table printed by data_reduction.sh."""
+    overall = stats['overall']
+    values = [overall.get(key, 0) for key in ROW_KEYS]
+    cell = (stats['unit_cell'] + [0] * 6)[:6]
+    return ("%-10s  %.2f       %.3f      %.3f     %.1f     %.3f        %.1f           %.1f          %s     "
+            "%.4f %.4f %.4f %.4f %.4f %.4f" % tuple([name] + values + [stats['space_group']] + cell))
+
+
+def load(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parse AIMLESS/CTRUNCATE/POINTLESS logs into JSON statistics')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parse_parser = subparsers.add_parser('parse', help='Parse the logs, write JSON and print the summary text')
+    parse_parser.add_argument('--aimless', required=True, help='AIMLESS log')
+    parse_parser.add_argument('--ctruncate', required=True, help='CTRUNCATE log')
+    parse_parser.add_argument('--pointless', default=None, help='POINTLESS log')
+    parse_parser.add_argument('--json', default=None, help='Output JSON document')
+
+    dat_parser = subparsers.add_parser('dat', help='Write the plotting tables as .dat files')
+    dat_parser.add_argument('json', help='JSON document written by parse')
+    dat_parser.add_argument('directory', help='Output directory')
+
+    get_parser = subparsers.add_parser('get', help='Print one value of the JSON document')
+    get_parser.add_argument('json', help='JSON document written by parse')
+    get_parser.add_argument('path', help='Dotted key, e.g. overall.rmeas')
+
+    row_parser = subparsers.add_parser('row', help='Print the line of the data reduction summary table')
+    row_parser.add_argument('json', help='JSON document written by parse')
+    row_parser.add_argument('name', help='Pipeline name')
+
+    args = parser.parse_args()
+
+    if args.command == 'parse':
+        stats = parse(args.aimless, args.ctruncate, args.pointless)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(stats, f, indent=1)
+        print(summary_text(stats))
+        return
+
+    try:
+        stats = load(args.json)
+    except (OSError, ValueError):
+        sys.exit(1)
+    if args.command == 'dat':
+        write_dat(stats, args.directory)
+    elif args.command == 'get':
+        print(get_value(stats, args.path))
+    elif args.command == 'row':
+        print(summary_row(stats, args.name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: dr_quality.py
+# Description: Check whether a data reduction result is good enough to stop the other pipelines (race mode).
+#              Reads the overall statistics from NAME_STATISTICS.json (written by dr_parse.py) and compares
+#              them with the thresholds on Rmeas, CC(1/2), completeness and resolution.
+#
+# Usage:
+#   python3 dr_quality.py XDS/XDS_SUMMARY/XDS_STATISTICS.json [--rmeas 0.2] [--cchalf 0.95] [--completeness 90] [--resolution 2.5]
+#
+# Exit Codes:
+#   0  All thresholds are met
+#   1  At least one threshold is not met or a statistic is missing
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import json
+import sys
+
+# Key of "overall" in the statistics JSON -> key
+KEYS = {
+    'resolution': 'resolution',
+    'rmeas': 'rmeas',
+    'cc_half': 'cchalf',
+    'completeness': 'completeness',
+}
+
+
+def read_overall_statistics(stats_json):
+    """Overall column of the AIMLESS summary table, as parsed by dr_parse.py."""
+    with open(stats_json, 'r', encoding='utf-8') as f:
+        overall = json.load(f).get('overall', {})
+    stats = {}
+    for name, key in KEYS.items():
+        if isinstance(overall.get(name), (int, float)):
+            stats[key] = float(overall[name])
+    return stats
+
+
+def check(stats, rmeas, cchalf, completeness, resolution):
+    """Return the list of thresholds that are not met."""
+    failed = []
+    if 'rmeas' not in stats or stats['rmeas'] > rmeas:
+        failed.append('Rmeas')
+    if 'cchalf' not in stats or stats['cchalf'] < cchalf:
+        failed.append('CC(1/2)')
+    if 'completeness' not in stats or stats['completeness'] < completeness:
+        failed.append('Completeness')
+    if resolution is not None and ('resolution' not in stats or stats['resolution'] > resolution):
+        failed.append('Resolution')
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check data reduction statistics against race mode thresholds')
+    parser.add_argument('stats_json', help='NAME_STATISTICS.json written by the reduction pipeline')
+    parser.add_argument('--rmeas', type=float, default=0.2, help='Maximum overall Rmeas')
+    parser.add_argument('--cchalf', type=float, default=0.95, help='Minimum overall CC(1/2)')
+    parser.add_argument('--completeness', type=float, default=90.0, help='Minimum overall completeness (%%)')
+    parser.add_argument('--resolution', type=float, default=None, help='Maximum high resolution limit (A)')
+    args = parser.parse_args()
+
+    try:
+        stats = read_overall_statistics(args.stats_json)
+    except (OSError, ValueError):
+        sys.exit(1)
+
+    failed = check(stats, args.rmeas, args.cchalf, args.completeness, args.resolution)
+    if failed:
+        print(f"{args.stats_json}: race thresholds not met ({', '.join(failed)})")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -58,7 +58,7 @@ do
 done < "${SEQUENCE}"
 
 # Generate ASU contents file
-$CCP4/lib/python3.9/site-packages/ccp4i2/bin/i2run ProvideAsuContents \
+${AUTOPD_PROFILE} $CCP4/lib/python3.9/site-packages/ccp4i2/bin/i2run ProvideAsuContents \
 	--ASU_CONTENT \
                    sequence=${sequence} \
 	           nCopies=1 \
@@ -73,7 +73,7 @@ fi
 ASU=$(readlink -f ASUCONTENTFILE.asu.xml)
 
 # Run Buccaneer with CCP4i2 wrapper
-$CCP4/lib/python3.9/site-packages/ccp4i2/bin/i2run buccaneer_build_refine_mr \
+${AUTOPD_PROFILE} $CCP4/lib/python3.9/site-packages/ccp4i2/bin/i2run buccaneer_build_refine_mr \
 	--F_SIGF \
 		fullPath=${MTZ} \
 		columnLabels="/*/*/[F,SIGF]" \
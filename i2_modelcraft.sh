@@ -53,7 +53,7 @@ Z_NUMBER=$(tail -1 $MTZ_DIR/phaser_cca.log | cut -d= -f2)
 python3 ${SOURCE_DIR}/make_contents.py $Z_NUMBER ${SEQUENCE} contents.json
 
 # Run Modelcraft with CCP4i2 wrapper
-modelcraft xray \
+${AUTOPD_PROFILE} modelcraft xray \
   --data ${MTZ} \
   --observations F,SIGF \
   --freerflag FreeR_flag \
@@ -62,7 +62,7 @@ modelcraft xray \
   > MODELCRAFT.log
   
 cd modelcraft
-phenix.cif_as_pdb modelcraft.cif > /dev/null 2>&1
+${AUTOPD_PROFILE} phenix.cif_as_pdb modelcraft.cif > /dev/null 2>&1
 cd ..
 	
 if grep -q "Error" MODELCRAFT.log; then
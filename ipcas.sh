@@ -22,6 +22,8 @@
 #4: solvent content
 #5: cycle number
 #6: output folder
+# IPCAS_PATIENCE (environment): stop once Rfree has not improved for
+# this many cycles (converge.sh); 0 or unset runs every cycle
 ##############################################
 
 SECONDS=0
@@ -49,12 +51,19 @@ then
 fi
 mkdir $out_dir
 
-${scr_dir}/ipcas_mtz.sh ${1} ${1}  F SIGF FreeR_flag FP SIGFP FREE #FP SIGFP FREE
+# MTZ with FP SIGFP FREE: read-only artefact of mtz_store.py, or the input converted in place
+store_file=$(python3 ${scr_dir}/mtz_store.py get ${mtz_dir} FP 2>/dev/null)
+if [ -n "${store_file}" ]; then
+    mtz_dir=${store_file}
+else
+    ${scr_dir}/ipcas_mtz.sh ${1} ${1}  F SIGF FreeR_flag FP SIGFP FREE #FP SIGFP FREE
+fi
 
 # run cycle
 num=1
 last_num=0
 cycle=$5
+patience=${IPCAS_PATIENCE:-0}
 while(($num <= $cycle))
 do
     mkdir $tmp_dir
@@ -68,19 +77,19 @@ do
     fi
     cp $mtz_dir start/start.mtz
     cp $seq_dir start/seq
-    $scr_dir/prepare.sh start/start.mtz
+    ${AUTOPD_PROFILE} $scr_dir/prepare.sh start/start.mtz
     echo "1"
-    $scr_dir/fraction.sh para/prepare.sh start/start.pdb
+    ${AUTOPD_PROFILE} $scr_dir/fraction.sh para/prepare.sh start/start.pdb
     echo "2"
-    $scr_dir/oasis.csh start/start.mtz
+    ${AUTOPD_PROFILE} $scr_dir/oasis.csh start/start.mtz
     echo "3"
-    $scr_dir/dm.csh $4
+    ${AUTOPD_PROFILE} $scr_dir/dm.csh $4
     if [ $(($num%2)) -eq 1 ]
     then
-        $scr_dir/phenix.csh start/seq start/start.pdb
+        ${AUTOPD_PROFILE} $scr_dir/phenix.csh start/seq start/start.pdb
     elif [ $(($num%2)) -eq 0 ]
     then
-        $scr_dir/buccaneer.csh start/seq dm/dm.mtz start/start.pdb
+        ${AUTOPD_PROFILE} $scr_dir/buccaneer.csh start/seq dm/dm.mtz start/start.pdb
     fi
     $scr_dir/outlog.sh $num result/result.pdb $out_dir/result
     cd ..
@@ -88,6 +97,12 @@ do
     mv cycle_$num $out_dir
     let "num++"
     let "last_num++"
+    # convergence: stop when Rfree has plateaued or got worse
+    if [ $patience -gt 0 ] && $scr_dir/converge.sh $out_dir/result $patience
+    then
+        echo "Rfree has not improved for $patience cycles, stop after cycle $last_num of $cycle"
+        break
+    fi
 done
 
 # make summary
@@ -97,6 +112,10 @@ echo "" >> $out_dir/result
 r_work=$(grep 'R VALUE            (WORKING SET) :' $out_dir/Summary/Free*.pdb 2>/dev/null | cut -d ':' -f 2 | xargs)
 r_free=$(grep 'FREE R VALUE                     :' $out_dir/Summary/Free*.pdb 2>/dev/null | cut -d ':' -f 2 | xargs)
 echo "IPCAS Results: R-work=${r_work} R-free=${r_free}" >> $out_dir/result
+if [ $last_num -lt $cycle ]
+then
+    echo "IPCAS stopped after cycle $last_num of $cycle: Rfree converged" >> $out_dir/result
+fi
 
 duration=$SECONDS
 mins=$(($duration / 60))
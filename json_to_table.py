@@ -20,7 +20,7 @@
 #
 # Dependencies:
 #   - Python 3.7+
-#   - pandas (`pip install pandas`)
+#   - rank_models.py (release date index and table writer)
 #
 # Author: ZHANG Xin
 # Date Created: 2023-06-01
@@ -28,33 +28,11 @@
 #############################################################################################################
 
 import json
-import pandas as pd
 import sys
 import os
 import re
-from datetime import datetime
 
-def extract_release_dates(log_file_name, names):
-    """Extract release dates from log file for given names"""
-    release_dates = {}
-    try:
-        with open(log_file_name, 'r', encoding='utf-8') as file:
-            for line in file:
-                for name in names.copy():  # Iterate over a copy to avoid modification during iteration
-                    if name in line:
-                        # Search for release_date pattern in log line
-                        match = re.search(r'release_date: (\d{4}-\d{2}-\d{2})', line)
-                        if match:
-                            release_dates[name] = match.group(1)
-                            names.remove(name)
-                        break  # Proceed to next line after match
-    except FileNotFoundError:
-        print(f"Warning: {log_file_name} not found. 'release_date' will be set to 'Unknown' for all entries.")
-    
-    # Set 'Unknown' for remaining names without dates
-    for name in names:
-        release_dates[name] = 'Unknown'
-    return release_dates
+from rank_models import AF_FIELDS, HOMOLOG_FIELDS, filter_by_date, release_dates, write_table
 
 def json_to_txt(json_file_path, cutoff_date=None):
     """Convert JSON data to formatted text table"""
@@ -71,33 +49,17 @@ def json_to_txt(json_file_path, cutoff_date=None):
     
     # Process homologs data
     if file_name == 'homologs.json':
-        # Collect names for date extraction
-        names = [item['name'] for item in data]
-        release_dates = extract_release_dates('mrparse.log', names)
-        
-        # Add release dates to items
+        # Release dates from one pass over mrparse.log
+        release_date = release_dates('mrparse.log', [item['name'] for item in data])
         for item in data:
-            item['release_date'] = release_dates.get(item['name'], 'Unknown')
+            item['release_date'] = release_date.get(item['name'], 'Unknown')
         
         # Apply date filtering if specified
         if cutoff_date:
-            try:
-                cutoff_date_obj = datetime.strptime(cutoff_date, "%Y-%m-%d")
-                filtered_data = []
-                for item in data:
-                    rd = item['release_date']
-                    if rd == 'Unknown':
-                        continue  # Skip items with unknown dates
-                    try:
-                        item_date = datetime.strptime(rd, "%Y-%m-%d")
-                        if item_date < cutoff_date_obj:
-                            filtered_data.append(item)
-                    except ValueError:
-                        continue
-                data = filtered_data
-            except ValueError:
+            if not re.fullmatch(r'\d{4}-\d{2}-\d{2}', cutoff_date):
                 print(f"Error: Invalid cutoff date format {cutoff_date}, expected YYYY-MM-DD")
                 sys.exit(1)
+            data = filter_by_date(data, cutoff_date)
         
         # Exit if no data remains after filtering
         if not data:
@@ -105,30 +67,16 @@ def json_to_txt(json_file_path, cutoff_date=None):
             sys.exit(1)
 
         # Define output fields and sort
-        fields = ['name', 'seq_ident', 'region_id', 'range', 'length', 'release_date']
+        fields = HOMOLOG_FIELDS
         data.sort(key=lambda x: (x['seq_ident'], x.get('avg_plddt', 0)), reverse=True)
 
     # Process AlphaFold models data
     elif file_name == 'af_models.json':
-        fields = ['name', 'seq_ident', 'region_id', 'range', 'length', 'h_score', 'avg_plddt']
+        fields = AF_FIELDS
         data.sort(key=lambda x: (x['seq_ident'], x['avg_plddt']), reverse=True)
-        if not data:
-            print("Error: No AlphaFold models found")
-            sys.exit(1)
 
-    # Create DataFrame with specified columns
-    df = pd.DataFrame(data, columns=fields)
-    
-    # Generate output text file
-    txt_file_path = os.path.splitext(json_file_path)[0] + '.txt'
-    with open(txt_file_path, 'w', encoding='utf-8') as f:
-        # Calculate column widths
-        max_lengths = [max(len(str(x)) for x in df[col]) for col in df.columns]
-        
-        # Write formatted rows only
-        for _, row in df.iterrows():
-            formatted = [str(row[col]).ljust(width) for col, width in zip(df.columns, max_lengths)]
-            f.write('\t'.join(formatted) + '\n')
+    # Generate output text file with padded columns
+    write_table(data, fields, os.path.splitext(json_file_path)[0] + '.txt')
 
 if __name__ == '__main__':
     # Validate command line arguments
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: model_cache.py
+# Description: Persistent cache of the final search models (SEARCH_MODELS/HOMOLOGS and AF_MODELS) keyed on
+#              the normalized sequence and the options that change them (mp_date, uniprot_id, af_predict,
+#              af_split, pae_split). A run of a sequence seen before restores the ensembles instead of
+#              repeating MrParse, the AlphaFold prediction, the trimming and the VRMS annotation. Entries live
+#              in ${AUTOPD_CACHE:-~/.cache/autopd}/models/<key>/ with provenance.json (options, run directory,
+#              date, checksums and the ranking decisions); the cache is bounded in size and the least
+#              recently used entries are evicted first.
+#
+# Usage:
+#   python3 model_cache.py restore SEARCH_MODELS        exit 0 on a hit (ensembles copied), 1 on a miss
+#   python3 model_cache.py store SEARCH_MODELS [--ranking MRPARSE]
+#   python3 model_cache.py invalidate (--sequence seq.fasta | --key KEY | --all)
+#   python3 model_cache.py list
+#
+# Environment:
+#   SEQUENCE, DATE, UNIPROT_ID, AF_PREDICT, AF_SPLIT, PAE_SPLIT   as exported by autopipeline.sh
+#   AUTOPD_CACHE          Cache root (default ~/.cache/autopd)
+#   AUTOPD_MODEL_CACHE_MB Size limit of the model cache in MB (default 2048)
+#
+# Exit Codes:
+#   0  Success (restore: cache hit)
+#   1  Cache miss, nothing to store, or invalid input
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import datetime
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+
+# Environment variables of autopipeline.sh that change the search models of a sequence
+OPTIONS = ['DATE', 'UNIPROT_ID', 'AF_PREDICT', 'AF_SPLIT', 'PAE_SPLIT']
+# Subdirectories of SEARCH_MODELS kept in the cache (INPUT_MODELS are the user's own)
+ENSEMBLES = ['HOMOLOGS', 'AF_MODELS']
+DEFAULT_MAX_MB = 2048
+
+
+def read_sequences(path):
+    """Chains of a FASTA file, upper case without whitespace, headers and stop codons; in file order."""
+    sequences = []
+    current = []
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('>'):
+                if current:
+                    sequences.append(''.join(current))
+                current = []
+            elif line:
+                current.append(''.join(line.split()).upper().rstrip('*'))
+    if current:
+        sequences.append(''.join(current))
+    return sequences
+
+
+def sequence_key(sequences):
+    return hashlib.sha256('\n'.join(sequences).encode()).hexdigest()
+
+
+def options_from_env():
+    return {name: os.environ.get(name, '') for name in OPTIONS}
+
+
+def entry_key(sequences, options):
+    digest = hashlib.sha256(f"sequence {sequence_key(sequences)}\n".encode())
+    for name in OPTIONS:
+        digest.update(f"option {name}={options.get(name, '')}\n".encode())
+    return digest.hexdigest()[:32]
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ModelCache(object):
+    """Directory of search model entries with least-recently-used eviction."""
+
+    def __init__(self, root=None, max_mb=None):
+        root = root or os.environ.get('AUTOPD_CACHE') or os.path.expanduser('~/.cache/autopd')
+        self.directory = os.path.join(root, 'models')
+        self.max_bytes = int(max_mb or os.environ.get('AUTOPD_MODEL_CACHE_MB') or DEFAULT_MAX_MB) * 1024 * 1024
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        lock = open(os.path.join(self.directory, '.lock'), 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def entries(self):
+        """Complete entries (with provenance.json), least recently used first."""
+        paths = [path for path in glob.glob(os.path.join(self.directory, '*'))
+                 if os.path.isfile(os.path.join(path, 'provenance.json'))]
+        return sorted(paths, key=os.path.getmtime)
+
+    def restore(self, key, destination):
+        """Copy the ensembles of an entry into destination (SEARCH_MODELS). Returns the provenance or None."""
+        path = self.entry_path(key)
+        provenance_path = os.path.join(path, 'provenance.json')
+        try:
+            with open(provenance_path, 'r', encoding='utf-8') as f:
+                provenance = json.load(f)
+        except (OSError, ValueError):
+            return None
+        for name in ENSEMBLES:
+            source = os.path.join(path, name)
+            if os.path.isdir(source):
+                shutil.copytree(source, os.path.join(destination, name), dirs_exist_ok=True)
+        # The modification time of the entry is its last use
+        os.utime(path)
+        return provenance
+
+    def store(self, key, source, provenance, ranking=None):
+        """Copy the ensembles of source (SEARCH_MODELS) into a new entry, then evict down to the size limit."""
+        files = {}
+        for name in ENSEMBLES:
+            for path in sorted(glob.glob(os.path.join(source, name, '*.pdb'))):
+                files[os.path.join(name, os.path.basename(path))] = sha256_file(path)
+        if not files:
+            return None
+        provenance = dict(provenance, files=files)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self.entry_path(key)}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        for relative in files:
+            os.makedirs(os.path.join(tmp_path, os.path.dirname(relative)), exist_ok=True)
+            shutil.copy2(os.path.join(source, relative), os.path.join(tmp_path, relative))
+        # Decisions of rank_models.py, for the record
+        if ranking:
+            for path in sorted(glob.glob(os.path.join(ranking, 'ranking_*.json'))):
+                os.makedirs(os.path.join(tmp_path, 'RANKING'), exist_ok=True)
+                shutil.copy2(path, os.path.join(tmp_path, 'RANKING'))
+        with open(os.path.join(tmp_path, 'provenance.json'), 'w', encoding='utf-8') as f:
+            json.dump(provenance, f, indent=2, sort_keys=True)
+
+        with self.lock():
+            path = self.entry_path(key)
+            if os.path.isdir(path):
+                old_path = f"{path}.{os.getpid()}.old"
+                os.rename(path, old_path)
+                shutil.rmtree(old_path, ignore_errors=True)
+            os.rename(tmp_path, path)
+            evicted = self.evict(keep=path)
+        return path, evicted
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits into its size limit (call with the lock)."""
+        entries = self.entries()
+        sizes = {path: directory_size(path) for path in entries}
+        total = sum(sizes.values())
+        evicted = []
+        for path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= sizes[path]
+            evicted.append(os.path.basename(path))
+        return evicted
+
+    def invalidate(self, key=None, sequence=None):
+        """Remove the entry of a key, every entry of a sequence key, or (both None) every entry."""
+        removed = []
+        with self.lock():
+            for path in self.entries():
+                name = os.path.basename(path)
+                if key is not None and name != key:
+                    continue
+                if sequence is not None:
+                    try:
+                        with open(os.path.join(path, 'provenance.json'), 'r', encoding='utf-8') as f:
+                            if json.load(f).get('sequence_key') != sequence:
+                                continue
+                    except (OSError, ValueError):
+                        continue
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(name)
+        return removed
+
+
+def current_key():
+    """Key and provenance of the run in the environment; None without a sequence."""
+    path = os.environ.get('SEQUENCE', '')
+    if not path or not os.path.isfile(path):
+        return None, None
+    sequences = read_sequences(path)
+    if not sequences:
+        return None, None
+    options = options_from_env()
+    provenance = {'sequence_key': sequence_key(sequences), 'chains': len(sequences),
+                  'lengths': [len(sequence) for sequence in sequences], 'options': options,
+                  'sequence_file': os.path.abspath(path), 'run': os.getcwd(),
+                  'created': datetime.datetime.now().isoformat(timespec='seconds')}
+    return entry_key(sequences, options), provenance
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sequence-keyed cache of AutoPD search models')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    restore_parser = subparsers.add_parser('restore', help='Copy cached ensembles into SEARCH_MODELS')
+    restore_parser.add_argument('search_models', help='SEARCH_MODELS directory of the run')
+
+    store_parser = subparsers.add_parser('store', help='Cache the ensembles of SEARCH_MODELS')
+    store_parser.add_argument('search_models', help='SEARCH_MODELS directory of the run')
+    store_parser.add_argument('--ranking', default=None, help='Directory with ranking_<i>.json (MRPARSE)')
+
+    invalidate_parser = subparsers.add_parser('invalidate', help='Remove cache entries')
+    group = invalidate_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--sequence', default=None, help='FASTA file: all entries of this sequence')
+    group.add_argument('--key', default=None, help='Entry key (see list)')
+    group.add_argument('--all', action='store_true', help='All entries')
+
+    subparsers.add_parser('list', help='List cache entries, least recently used first')
+
+    args = parser.parse_args()
+    cache = ModelCache()
+
+    if args.command == 'restore':
+        key, _ = current_key()
+        provenance = cache.restore(key, args.search_models) if key else None
+        if provenance is None:
+            sys.exit(1)
+        print(f"Search models restored from the model cache (entry {key}, run {provenance.get('run')}, "
+              f"{provenance.get('created')})")
+    elif args.command == 'store':
+        key, provenance = current_key()
+        result = cache.store(key, args.search_models, provenance, args.ranking) if key else None
+        if result is None:
+            sys.exit(1)
+        path, evicted = result
+        print(f"Search models cached in {path}")
+        if evicted:
+            print(f"Evicted least recently used entries: {' '.join(evicted)}")
+    elif args.command == 'invalidate':
+        if args.sequence:
+            sequences = read_sequences(args.sequence)
+            if not sequences:
+                print(f"No sequence in {args.sequence}", file=sys.stderr)
+                sys.exit(1)
+            removed = cache.invalidate(sequence=sequence_key(sequences))
+        else:
+            removed = cache.invalidate(key=args.key)
+        print(f"Removed {len(removed)} entries")
+    else:
+        for path in cache.entries():
+            try:
+                with open(os.path.join(path, 'provenance.json'), 'r', encoding='utf-8') as f:
+                    provenance = json.load(f)
+            except (OSError, ValueError):
+                continue
+            used = time.strftime('%Y-%m-%d %H:%M', time.localtime(os.path.getmtime(path)))
+            options = ' '.join(f"{name}={value}" for name, value in provenance.get('options', {}).items() if value)
+            print(f"{os.path.basename(path)}  {directory_size(path) / 1048576:7.1f} MB  used {used}  "
+                  f"chains {provenance.get('chains')}  {options}")
+
+
+if __name__ == '__main__':
+    main()
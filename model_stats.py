@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: model_stats.py
+# Description: Batch statistics of predicted and homologous search models in one process. The B-factor
+#              (pLDDT) column, chain and residue of all atoms of a PDB file are read into NumPy arrays from
+#              the fixed columns of the ATOM/HETATM records (mmCIF: _atom_site loop with gemmi), and the
+#              atom average, residue averages, per-chain summaries and the VRMS estimate of Phaser are
+#              computed as array operations. The vrms command writes the "REMARK   VRMS=" first line of any
+#              number of target models, reading each source model once.
+#
+# Usage:
+#   python3 model_stats.py stats <MODEL>... [--threshold 70] [--json stats.json]
+#   python3 model_stats.py vrms <SOURCE> <TARGET_PATTERN>... [--threshold 70] [--slope 1.0] [--intercept 0.25]
+#   python3 model_stats.py vrms --batch VRMS_TARGETS.txt   (lines "<SOURCE> <TARGET_PATTERN>")
+#
+# Exit Codes:
+#   0  Success
+#   1  A model could not be read (stats) or a source pattern does not match exactly one file (vrms)
+#   2  No target matched (vrms)
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+try:
+    import gemmi
+except ImportError:
+    gemmi = None
+
+RECORD_LENGTH = 80
+VRMS_REMARK = 'REMARK   VRMS='
+
+
+class ModelAtoms(object):
+    """Chain, residue and B-factor (pLDDT) of every atom of a model."""
+
+    def __init__(self, chains, residues, bfactors):
+        self.chains = np.asarray(chains)
+        self.residues = np.asarray(residues)
+        self.bfactors = np.asarray(bfactors, dtype=float)
+
+    def __len__(self):
+        return len(self.bfactors)
+
+    def atom_mean(self):
+        return float(self.bfactors.mean()) if len(self) else None
+
+    def residue_means(self):
+        """(chain of each residue, mean B-factor of each residue) in order of first appearance."""
+        if not len(self):
+            return np.array([]), np.array([])
+        keys = np.char.add(np.char.add(self.chains.astype(str), ':'), self.residues.astype(str))
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        means = np.bincount(inverse, weights=self.bfactors) / np.bincount(inverse)
+        order = np.argsort(first)
+        return self.chains[first][order], means[order]
+
+    def residue_mean(self, threshold=70.0):
+        """Number and mean of the residue averages above the threshold (0, None if there are none)."""
+        _, means = self.residue_means()
+        selected = means[means > threshold]
+        if not len(selected):
+            return 0, None
+        return int(len(selected)), float(selected.mean())
+
+    def chain_stats(self, threshold=70.0):
+        residue_chains, means = self.residue_means()
+        stats = {}
+        for chain in np.unique(self.chains):
+            atoms = self.bfactors[self.chains == chain]
+            residues = means[residue_chains == chain]
+            stats[str(chain)] = {
+                'atoms': int(len(atoms)),
+                'residues': int(len(residues)),
+                'atom_mean': float(atoms.mean()),
+                'residue_mean': float(residues.mean()),
+                'residues_above_threshold': int((residues > threshold).sum()),
+            }
+        return stats
+
+
+def pdb_atoms(lines):
+    """Atoms of the ATOM/HETATM records among PDB lines (bytes, first model only)."""
+    records = []
+    for line in lines:
+        if line.startswith((b'ATOM', b'HETATM')):
+            records.append(line.rstrip(b'\r\n')[:RECORD_LENGTH].ljust(RECORD_LENGTH))
+        elif line.startswith(b'ENDMDL'):
+            break
+    if not records:
+        return ModelAtoms([], [], [])
+    columns = np.frombuffer(b''.join(records), dtype='S1').reshape(len(records), RECORD_LENGTH)
+    bfactor_fields = np.char.strip(columns[:, 60:66].copy().view('S6').ravel())
+    present = bfactor_fields != b''
+    chains = columns[present, 21].astype(str)
+    residues = columns[present, 22:27].copy().view('S5').ravel().astype(str)
+    return ModelAtoms(chains, residues, bfactor_fields[present].astype(float))
+
+
+def read_pdb(path):
+    with open(path, 'rb') as f:
+        return pdb_atoms(f)
+
+
+def read_cif(path):
+    """Atoms of the _atom_site loop of an mmCIF file (needs gemmi)."""
+    if gemmi is None:
+        raise ValueError(f"gemmi is needed to read {path}")
+    block = gemmi.cif.read_file(path).sole_block()
+    table = block.find('_atom_site.', ['B_iso_or_equiv', '?auth_asym_id', '?auth_seq_id', '?pdbx_PDB_ins_code',
+                                        '?label_asym_id', '?label_seq_id'])
+    if not len(table):
+        return ModelAtoms([], [], [])
+
+    def column(primary, fallback):
+        if table.has_column(primary):
+            return np.array(table.column(primary), dtype=str)
+        if table.has_column(fallback):
+            return np.array(table.column(fallback), dtype=str)
+        return np.full(len(table), '.')
+
+    bfactors = np.array(table.column(0), dtype=str)
+    present = ~np.isin(bfactors, ['?', '.'])
+    chains = column(1, 4)
+    residues = np.char.add(column(2, 5), column(3, 3))
+    return ModelAtoms(chains[present], residues[present], bfactors[present].astype(float))
+
+
+def read_model(path):
+    if path.lower().endswith(('.cif', '.mmcif', '.cif.gz')):
+        return read_cif(path)
+    return read_pdb(path)
+
+
+def plddt_to_vrms(avg_plddt, slope=1.0, intercept=0.25):
+    """Estimated RMSD and VRMS of a model from its average pLDDT."""
+    rmsd_est = 1.5 * math.exp(4.0 * (0.7 - avg_plddt / 100.0))
+    return rmsd_est, slope * rmsd_est + intercept
+
+
+def vrms_remark(model, threshold=70.0, slope=1.0, intercept=0.25):
+    _, avg_plddt = model.residue_mean(threshold)
+    if avg_plddt is None:
+        return f"{VRMS_REMARK}N/A; pLDDT>{int(threshold)}"
+    _, vrms = plddt_to_vrms(avg_plddt, slope, intercept)
+    return f"{VRMS_REMARK}{vrms:.3f} A; pLDDT>{int(threshold)}"
+
+
+def write_remark(target, remark):
+    """Insert the remark as the first line of the target, replacing an earlier VRMS remark."""
+    with open(target, 'r', encoding='utf-8', errors='ignore') as f:
+        lines = f.readlines()
+    if lines and lines[0].startswith(VRMS_REMARK):
+        lines[0] = remark + '\n'
+    else:
+        lines.insert(0, remark + '\n')
+    with open(target, 'w', encoding='utf-8') as f:
+        f.writelines(lines)
+
+
+def write_vrms(pairs, threshold=70.0, slope=1.0, intercept=0.25):
+    """Write the VRMS remark of each source to its targets; pairs are (source pattern, [target patterns]).
+    Returns the number of targets written and whether a source pattern did not match exactly one file."""
+    remarks = {}
+    written = 0
+    failed = False
+    for source_pattern, target_patterns in pairs:
+        sources = glob.glob(source_pattern)
+        if len(sources) != 1:
+            print(f"[Error] Source pattern '{source_pattern}' matched {len(sources)} files: {sources}",
+                  file=sys.stderr)
+            failed = True
+            continue
+        source = os.path.abspath(sources[0])
+        if source not in remarks:
+            remarks[source] = vrms_remark(read_model(source), threshold, slope, intercept)
+        targets = sorted({path for pattern in target_patterns for path in glob.glob(pattern)})
+        for target in targets:
+            if os.path.isfile(target):
+                write_remark(target, remarks[source])
+                written += 1
+    return written, failed
+
+
+def summary(path, threshold=70.0):
+    model = read_model(path)
+    count, residue_mean = model.residue_mean(threshold)
+    result = {'model': path, 'atoms': len(model), 'atom_mean': model.atom_mean(),
+              'residue_mean': residue_mean, 'residues_above_threshold': count, 'vrms': None,
+              'chains': model.chain_stats(threshold)}
+    if residue_mean is not None:
+        result['vrms'] = plddt_to_vrms(residue_mean)[1]
+    return model, result
+
+
+def print_stats(paths, threshold=70.0, json_path=None):
+    """Per-model and combined average pLDDT (the output of the former avg_plddt_from_* scripts)."""
+    results = []
+    bfactors = []
+    failed = False
+    for path in paths:
+        try:
+            model, result = summary(path, threshold)
+        except (OSError, ValueError) as error:
+            print(f"{path}: could not be read - {error}")
+            failed = True
+            continue
+        if not len(model):
+            print(f"{path}: no B-factor values found")
+            continue
+        vrms = f"{result['vrms']:.3f}" if result['vrms'] is not None else 'N/A'
+        print(f"{path}: {len(model)} atoms, avg pLDDT = {result['atom_mean']:.2f}, "
+              f"residue avg pLDDT>{int(threshold)} = {result['residue_mean'] or 0:.2f}, VRMS = {vrms}")
+        bfactors.append(model.bfactors)
+        results.append(result)
+    if bfactors:
+        print(f"\nCombined average pLDDT for all chains: {np.concatenate(bfactors).mean():.2f}")
+    else:
+        print("No B-factor values in any file")
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch pLDDT, VRMS and B-factor statistics of models')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    stats_parser = subparsers.add_parser('stats', help='Atom, residue and chain averages of the B-factors (pLDDT)')
+    stats_parser.add_argument('models', nargs='+', help='PDB or mmCIF files')
+    stats_parser.add_argument('--threshold', type=float, default=70.0, help='Residue-average pLDDT threshold')
+    stats_parser.add_argument('--json', default=None, help='Also write the statistics to this JSON file')
+
+    vrms_parser = subparsers.add_parser('vrms', help='Write the VRMS remark of a source model to target models')
+    vrms_parser.add_argument('source', nargs='?', help='Source model or pattern (must match exactly one file)')
+    vrms_parser.add_argument('targets', nargs='*', help='Target PDB files or patterns')
+    vrms_parser.add_argument('--batch', default=None, help='File of "<source> <target pattern>" lines')
+    vrms_parser.add_argument('--threshold', type=float, default=70.0, help='Residue-average pLDDT threshold')
+    vrms_parser.add_argument('--slope', type=float, default=1.0, help='vrms_from_rmsd_slope')
+    vrms_parser.add_argument('--intercept', type=float, default=0.25, help='vrms_from_rmsd_intercept in A')
+
+    args = parser.parse_args()
+
+    if args.command == 'stats':
+        sys.exit(0 if print_stats(args.models, args.threshold, args.json) else 1)
+
+    pairs = []
+    if args.source:
+        pairs.append((args.source, args.targets))
+    if args.batch:
+        with open(args.batch, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2:
+                    pairs.append((fields[0], fields[1:]))
+    if not pairs:
+        parser.error('a source and targets, or --batch, are required')
+    written, failed = write_vrms(pairs, args.threshold, args.slope, args.intercept)
+    if failed:
+        sys.exit(1)
+    if not written:
+        print(f"[Error] No target matched {' '.join(p for _, patterns in pairs for p in patterns)}", file=sys.stderr)
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,8 +11,10 @@
 #   2. Create a working directory (PHASER_MR).
 #   3. Run Phaser MR with:
 #        - Input models (if provided), otherwise
-#        - Homologous models and AlphaFold models (in parallel), otherwise
+#        - Homologous models and AlphaFold models, otherwise
 #        - AlphaFold models only.
+#      The jobs (one per MTZ and model set) run through mr_queue.py, at most MR_JOBS at a time; once one
+#      job has a decisive solution (TFZ >= 8, LLG >= 60) the others are cancelled.
 #   4. Parse MR solutions and extract:
 #        - Log-Likelihood Gain (LLG)
 #        - Translation Function Z-score (TFZ)
@@ -24,24 +26,32 @@
 #   7. Append refinement results (R-work and R-free) to MR summary.
 #   8. Save outputs in PHASER_MR/MR_SUMMARY.
 #
+# Stage overlap (overlap=true of autopipeline.sh):
+#   mr.sh runs next to data reduction. Once search models exist, every MTZ a reduction pipeline hands to
+#   DATA_REDUCTION/EARLY_MTZ is queued right away; when data reduction is done, the triaged MTZs of
+#   DATA_REDUCTION_SUMMARY not queued yet follow as extra candidates. MTZs are compared by content, and the
+#   job directories link them under the name of their pipeline (e.g. XDS.mtz).
+#
 # Usage:
-#   ./mr.sh <MTZ_IN>
+#   ./mr.sh <MTZ_IN> [overlap]
 #
 # Arguments:
 #   MTZ_IN   Integer flag
 #            - 1: An experimental MTZ file was provided (skip data reduction).
 #            - 0: Use MTZ from data reduction results.
+#   overlap  Stage overlap; waits for .SEARCH_MODEL.done and follows until .DATA_REDUCTION.done
 #
 # Outputs:
 #   - PHASER_MR/MR_SUMMARY/MR_BEST.txt : Best MR solutions with LLG, TFZ, SG, PG, R-work, R-free
 #   - PHASER_MR/MR_SUMMARY/phaser_mr.log : Execution log with timing info
+#   - PHASER_MR/MR_SUMMARY/MR_QUEUE.txt : Status, LLG, TFZ and run time of every Phaser job
+#   - PHASER_MR/MR_SUMMARY/MR_SUMMARY.txt : Scores of all jobs; jobs cut short are marked CUT_SHORT
 #   - PHASER_MR/<run_folder>/PHASER.1.pdb : Best MR model
 #   - PHASER_MR/<run_folder>/REFINEMENT/XYZOUT.pdb : Refined structure
 #
 # Dependencies:
 #   - CCP4 (Phaser, REFMAC)
-#   - GNU Parallel
-#   - awk, grep, bc, sort, timeout
+#   - awk, grep, bc, sort; supervisor.py (wall-clock limit of the Phaser queue)
 #
 # Author: ZHANG Xin
 # Date Created: 2023-06-01
@@ -53,6 +63,18 @@ start_time=$(date +%s)
 
 # Input flag: determines whether to use provided MTZ or reduced MTZ
 MTZ_IN=${1}
+MODE=${2}
+
+# Stage overlap: nothing to do before the search models are ready
+if [ "${MODE}" = "overlap" ]; then
+  while [ ! -f .SEARCH_MODEL.done ]; do
+    sleep 10
+  done
+  if [ -z "$(find SEARCH_MODELS -maxdepth 2 -type f -name '*.pdb')" ]; then
+    echo "No search model was found, MR does not start during data reduction."
+    exit 0
+  fi
+fi
 
 # ----------------------------------------
 # Function: Standardize search model naming
@@ -92,25 +114,80 @@ echo ""
 if [ "${MTZ_IN}" -eq 1 ]; then
   mtz_dir=$(realpath ../INPUT_FILES)
 else
-  mtz_dir=$(realpath ../DATA_REDUCTION/DATA_REDUCTION_SUMMARY)
+  mtz_dir=$(realpath -m ../DATA_REDUCTION/DATA_REDUCTION_SUMMARY)
 fi
 
 # ----------------------------------------
 # Run Phaser MR with available models
 # ----------------------------------------
-if [ -d "../SEARCH_MODELS/INPUT_MODELS" ] && [ "$(ls -A ../SEARCH_MODELS/INPUT_MODELS)" ]; then
-  TEMPLATE_NUMBER=$(ls ../SEARCH_MODELS/INPUT_MODELS/*.pdb | wc -l)
-  timeout 600h ${SOURCE_DIR}/phaser.sh ${TEMPLATE_NUMBER} ${mtz_dir} ../SEARCH_MODELS/INPUT_MODELS I
-elif [ -d "../SEARCH_MODELS/HOMOLOGS" ] && [ "$(ls -A ../SEARCH_MODELS/HOMOLOGS)" ]; then
-  TEMPLATE_NUMBER_H=$(ls ../SEARCH_MODELS/HOMOLOGS/*.pdb | wc -l)
-  TEMPLATE_NUMBER_AF=$(ls ../SEARCH_MODELS/AF_MODELS/*.pdb | wc -l)
-  parallel -u ::: \
-    "timeout 600h ${SOURCE_DIR}/phaser.sh ${TEMPLATE_NUMBER_H} ${mtz_dir} ../SEARCH_MODELS/HOMOLOGS H" \
-    "timeout 600h ${SOURCE_DIR}/phaser.sh ${TEMPLATE_NUMBER_AF} ${mtz_dir} ../SEARCH_MODELS/AF_MODELS A"
+# Queue the Phaser jobs of the MTZs in a directory, one per model set (OFFSET: MTZs queued before)
+queue_models() {
+  local mtz_dir=$1
+  local offset=${2:-0}
+  if [ -d "../SEARCH_MODELS/INPUT_MODELS" ] && [ "$(ls -A ../SEARCH_MODELS/INPUT_MODELS)" ]; then
+    TEMPLATE_NUMBER=$(ls ../SEARCH_MODELS/INPUT_MODELS/*.pdb | wc -l)
+    ${SOURCE_DIR}/phaser.sh ${TEMPLATE_NUMBER} ${mtz_dir} ../SEARCH_MODELS/INPUT_MODELS I ${offset}
+  elif [ -d "../SEARCH_MODELS/HOMOLOGS" ] && [ "$(ls -A ../SEARCH_MODELS/HOMOLOGS)" ]; then
+    TEMPLATE_NUMBER_H=$(ls ../SEARCH_MODELS/HOMOLOGS/*.pdb | wc -l)
+    TEMPLATE_NUMBER_AF=$(ls ../SEARCH_MODELS/AF_MODELS/*.pdb | wc -l)
+    ${SOURCE_DIR}/phaser.sh ${TEMPLATE_NUMBER_H} ${mtz_dir} ../SEARCH_MODELS/HOMOLOGS H ${offset}
+    ${SOURCE_DIR}/phaser.sh ${TEMPLATE_NUMBER_AF} ${mtz_dir} ../SEARCH_MODELS/AF_MODELS A ${offset}
+  else
+    TEMPLATE_NUMBER=$(ls ../SEARCH_MODELS/AF_MODELS/*.pdb | wc -l)
+    ${SOURCE_DIR}/phaser.sh ${TEMPLATE_NUMBER} ${mtz_dir} ../SEARCH_MODELS/AF_MODELS A ${offset}
+  fi
+}
+
+# Stage overlap: link every MTZ not queued yet (by content) into CANDIDATES/<n> under the name of its
+# pipeline and queue it
+declare -A queued_mtz
+candidates=0
+queue_candidates() {
+  local mtz hash name
+  for mtz in "$@"; do
+    [ -f "${mtz}" ] || continue
+    hash=$(sha256sum < "${mtz}" | cut -c 1-32)
+    [ -z "${queued_mtz[${hash}]}" ] || continue
+    queued_mtz[${hash}]=1
+    candidates=$((candidates + 1))
+    name=$(basename "${mtz}" .mtz)
+    mkdir -p CANDIDATES/${candidates}
+    ln -sf "$(readlink -f "${mtz}")" CANDIDATES/${candidates}/${name%_r[0-9]}.mtz
+    echo "MTZ candidate ${candidates}: ${mtz}"
+    queue_models $(realpath CANDIDATES/${candidates}) $((candidates - 1))
+  done
+}
+
+# Jobs are prepared by phaser.sh and run by mr_queue.py: at most MR_JOBS at a time,
+# the others are cancelled once one job has a decisive solution
+export MR_QUEUE=$(pwd)/MR_SUMMARY/mr_queue.txt
+> "${MR_QUEUE}"
+if [ "${MODE}" = "overlap" ]; then
+  python3 ${SOURCE_DIR}/supervisor.py run --name mr_queue --timeout 600h -- \
+    python3 ${SOURCE_DIR}/mr_queue.py "${MR_QUEUE}" --jobs ${MR_JOBS:-4} --follow MR_SUMMARY/mr_queue.closed &
+  queue_pid=$!
+  while kill -0 ${queue_pid} 2>/dev/null; do
+    reduction_done=0
+    [ -f ../.DATA_REDUCTION.done ] && reduction_done=1
+    queue_candidates ../DATA_REDUCTION/EARLY_MTZ/*.mtz
+    if [ ${reduction_done} -eq 1 ]; then
+      if [ -f "${mtz_dir}/TRIAGE.txt" ]; then
+        queue_candidates $(awk -v dir="${mtz_dir}" '$2 == "selected" {print dir"/"$1}' "${mtz_dir}/TRIAGE.txt")
+      else
+        queue_candidates "${mtz_dir}"/*.mtz
+      fi
+      touch MR_SUMMARY/mr_queue.closed
+      break
+    fi
+    sleep 10
+  done
+  wait ${queue_pid}
 else
-  TEMPLATE_NUMBER=$(ls ../SEARCH_MODELS/AF_MODELS/*.pdb | wc -l)
-  timeout 600h ${SOURCE_DIR}/phaser.sh ${TEMPLATE_NUMBER} ${mtz_dir} ../SEARCH_MODELS/AF_MODELS A
+  queue_models ${mtz_dir}
+  python3 ${SOURCE_DIR}/supervisor.py run --name mr_queue --timeout 600h -- \
+    python3 ${SOURCE_DIR}/mr_queue.py "${MR_QUEUE}" --jobs ${MR_JOBS:-4}
 fi
+unset MR_QUEUE
 
 # ----------------------------------------
 # Extract MR results: LLG, TFZ, Space Group, Point Group
@@ -127,15 +204,21 @@ for dir in ./*/; do
   fi
 done
 
+# Jobs cut short by mr_queue.py after a decisive solution (not used for the selection below)
+if [ -f "MR_SUMMARY/MR_QUEUE.txt" ]; then
+  awk '$2 == "cancelled" || $2 == "skipped" {print $1, $3, "-", "-", $4, "CUT_SHORT("$2")"}' MR_SUMMARY/MR_QUEUE.txt >> MR_SUMMARY/MR_SUMMARY.txt
+fi
+
 # ----------------------------------------
 # Select best MR solutions
 # Prefer TFZ ≥ 8; one solution per space group
 # ----------------------------------------
-if [ -s "MR_SUMMARY/MR_SUMMARY.txt" ]; then
-  if awk '$5 >= 8 { exit 1 }' "MR_SUMMARY/MR_SUMMARY.txt"; then
-    cat "MR_SUMMARY/MR_SUMMARY.txt"
+grep -v "CUT_SHORT" MR_SUMMARY/MR_SUMMARY.txt > MR_SUMMARY/MR_SOLVED.tmp
+if [ -s "MR_SUMMARY/MR_SOLVED.tmp" ]; then
+  if awk '$5 >= 8 { exit 1 }' "MR_SUMMARY/MR_SOLVED.tmp"; then
+    cat "MR_SUMMARY/MR_SOLVED.tmp"
   else
-    awk '$5 >= 8' "MR_SUMMARY/MR_SUMMARY.txt"
+    awk '$5 >= 8' "MR_SUMMARY/MR_SOLVED.tmp"
   fi | sort -k5,5nr | awk '
     {
       if (!($3 in seen)) {
@@ -143,6 +226,7 @@ if [ -s "MR_SUMMARY/MR_SUMMARY.txt" ]; then
         seen[$3] = 1
       }
     }' > MR_SUMMARY/MR_BEST.txt
+  rm -f MR_SUMMARY/MR_SOLVED.tmp
   echo ""
   echo "MR Results:"
   awk '{print $1, "LLG="$2, "TFZ="$5, "Space Group: "$3}' MR_SUMMARY/MR_BEST.txt
@@ -169,7 +253,8 @@ if [ -s "MR_SUMMARY/MR_SUMMARY.txt" ]; then
         r_free=$(grep 'FREE R VALUE                     :' "$folder_name/REFINEMENT/XYZOUT.pdb" 2>/dev/null | cut -d ':' -f 2 | xargs)
     fi
     
-    cp -r "$folder_name" "MR_SUMMARY/"
+    # -L: the MTZ in the job directory is a link into the MTZ store
+    cp -rL "$folder_name" "MR_SUMMARY/"
 
     awk -v folder="$folder_name" -v r_work="$r_work" -v r_free="$r_free" '
     $1 == folder {print $0, r_work, r_free; next} {print}
@@ -14,12 +14,17 @@
 #            - 0: MTZ will be obtained from data reduction step.
 #
 # Workflow:
-#   1. Run Phaser Molecular Replacement (mr.sh).
+#   1. Run Phaser Molecular Replacement (mr.sh) as a checkpointed stage (run_stage of autopipeline.sh,
+#      under stage_timeout/stage_mem_gb), or restore it when resuming (already run during data
+#      reduction with overlap=true).
 #   2. If MR successful:
 #        - Perform model building with ModelCraft.
 #        - Evaluate ModelCraft R-free value.
 #        - If ModelCraft fails or R-free > 0.35, run Phenix Autobuild.
 #        - If Autobuild also fails or R-free > 0.35, run IPCAS 2.0 iterative model building.
+#      With model_build=race the three builders start at once (build_race.py), seeded with the best
+#      refined MR solution (copied to BUILD_SEED); once one reaches R-free <= BUILD_RFREE (0.35) the
+#      others are stopped.
 #   3. Copy best results (MTZ/PDB/logs) into SUMMARY directory for downstream use.
 #
 # Inputs:
@@ -32,6 +37,7 @@
 #   - SUMMARY/ModelCraft.pdb    : ModelCraft-built model (if available).
 #   - SUMMARY/AUTOBUILD.pdb     : Phenix Autobuild model (if available).
 #   - SUMMARY/IPCAS.pdb         : IPCAS 2.0 model (if available).
+#   - BUILD_RACE.txt            : R-work/R-free of every completed cycle (model_build=race).
 #   - Corresponding MTZ files and logs in SUMMARY/.
 #
 # Dependencies:
@@ -48,7 +54,21 @@
 MTZ_IN=${1}
 
 # Step 1: Run Molecular Replacement using Phaser
-${SOURCE_DIR}/mr.sh ${MTZ_IN}
+# Molecular replacement, unless an earlier run (RESUME_DIR) solved it from the same inputs
+# MR runs under the stage limits (stage_timeout, stage_mem_gb) and is not checkpointed if stopped at them
+if [ "${OVERLAP}" = "true" ] && [ -f ".MR.stopped" ]; then
+  echo "Molecular replacement during data reduction was stopped at its limits."
+  exit 1
+elif [ "${OVERLAP}" = "true" ] && [ -f "PHASER_MR/MR_SUMMARY/phaser_mr.log" ]; then
+  echo "Molecular replacement ran during data reduction."
+  python3 ${SOURCE_DIR}/checkpoint.py record mr
+else
+  run_stage mr "${SOURCE_DIR}/mr.sh ${MTZ_IN}"
+  status=$?
+  if [ ${status} -eq 123 ] || [ ${status} -eq 124 ]; then
+    exit 1
+  fi
+fi
 
 # Check if MR was successful
 if [ -s "PHASER_MR/MR_SUMMARY/MR_BEST.txt" ]; then
@@ -61,14 +81,91 @@ else
   exit 1
 fi
 
+# Copy Autobuild results into SUMMARY
+collect_autobuild() {
+    if [ -f "AUTOBUILD/AUTOBUILD_SUMMARY/AUTOBUILD.pdb" ]; then
+        cp AUTOBUILD/AUTOBUILD_SUMMARY/* SUMMARY/
+        r_free_autobuild=$(grep 'FREE R VALUE                     :' "AUTOBUILD/AUTOBUILD_SUMMARY/AUTOBUILD.pdb" 2>/dev/null | cut -d ':' -f 2 | xargs)
+    else
+        echo "AUTOBUILD.pdb does not exist."
+    fi
+}
+
+# Copy IPCAS results into SUMMARY
+collect_ipcas() {
+    echo ""
+    cat IPCAS/result
+    mkdir -p IPCAS/Summary
+    mv IPCAS.log IPCAS/Summary/
+
+    if [ -n "$(ls IPCAS/Summary/Free_*.pdb 2>/dev/null)" ]; then
+        cp IPCAS/Summary/Free_*.mtz SUMMARY/IPCAS.mtz
+        cp IPCAS/Summary/Free_*.pdb SUMMARY/IPCAS.pdb
+        cp IPCAS/Summary/IPCAS.log SUMMARY/
+    else
+        echo "IPCAS.pdb does not exist."
+    fi
+}
+
 # Step 2: Model building with ModelCraft
 echo ""
 echo "============================================================================================="
 echo "                                         Model building                                      "
 echo "============================================================================================="
 echo ""
+
+if [ "${MODEL_BUILD}" = "race" ]; then
+  BUILD_RFREE=${BUILD_RFREE:-0.35}
+  echo "ModelCraft, Phenix Autobuild and IPCAS 2.0 will be performed at the same time (target R-free ${BUILD_RFREE})."
+
+  # Seed all builders with the best refined MR solution. The seed is a private copy: modelcraft.sh
+  # overwrites the MR files in SUMMARY with its own best solution while the other builders still run
+  best=$(awk '$7 ~ /^[0-9.]+$/ && (best == "" || $7 < r_free) {best = $1; r_free = $7} END {print best}' PHASER_MR/MR_SUMMARY/MR_BEST.txt)
+  best=${best:-$(awk 'NR==1 {print $1}' PHASER_MR/MR_SUMMARY/MR_BEST.txt)}
+  echo "Seed: ${best}"
+  rm -rf BUILD_SEED
+  mkdir -p BUILD_SEED
+  cp PHASER_MR/MR_SUMMARY/${best}/*.* BUILD_SEED/
+  if [ -f "PHASER_MR/MR_SUMMARY/${best}/REFINEMENT/XYZOUT.pdb" ]; then
+    cp PHASER_MR/MR_SUMMARY/${best}/REFINEMENT/XYZOUT.pdb BUILD_SEED/REFINEMENT.pdb
+    cp PHASER_MR/MR_SUMMARY/${best}/REFINEMENT/FPHIOUT.mtz BUILD_SEED/REFINEMENT.mtz
+  fi
+  r_free_refine=$(grep 'FREE R VALUE                     :' "BUILD_SEED/REFINEMENT.pdb" 2>/dev/null | cut -d ':' -f 2 | xargs | grep -Eo '^[0-9.]+' || echo 0)
+  export r_free_refine
+
+  if [ -f "BUILD_SEED/PHASER.1.mtz" ]; then
+    MTZ=$(readlink -f "BUILD_SEED/PHASER.1.mtz")
+  else
+    MTZ=$(find BUILD_SEED -type f -name "*.mtz" ! -name "REFINEMENT.mtz" -print -quit | xargs readlink -f)
+  fi
+  if [ -f "BUILD_SEED/REFINEMENT.pdb" ] && [ $(echo "$r_free_refine > 0" | bc) -eq 1 ]; then
+    PDB=$(readlink -f "BUILD_SEED/REFINEMENT.pdb")
+  else
+    PDB=$(readlink -f "BUILD_SEED/PHASER.1.pdb")
+  fi
+  SEED=$(readlink -f BUILD_SEED)
+
+  python3 ${SOURCE_DIR}/build_race.py run --target ${BUILD_RFREE} --progress BUILD_RACE.txt --winner BUILD_RACE.winner \
+    --job MODELCRAFT "export AUTOPD_STAGE=MODELCRAFT; ${SOURCE_DIR}/modelcraft.sh" \
+    --job AUTOBUILD "export AUTOPD_STAGE=AUTOBUILD; ${SOURCE_DIR}/autobuild.sh ${MTZ} ${SEED}" \
+    --job IPCAS "export AUTOPD_STAGE=IPCAS; ${SOURCE_DIR}/ipcas.sh ${MTZ} ${PDB} ${SEQUENCE} 0.5 ${IPCAS_CYCLE} . > IPCAS.log"
+
+  # Without a finished ModelCraft run, the MR files in SUMMARY are those of the seed
+  if [ ! -f "SUMMARY/MODELCRAFT.log" ]; then
+    cp BUILD_SEED/* SUMMARY/
+  fi
+
+  # Results of the builders that ran to completion; the SUMMARY selection is unchanged
+  collect_autobuild
+  if [ -f "IPCAS.log" ]; then
+    collect_ipcas
+  fi
+  exit 0
+fi
+
 echo "ModelCraft will be performed."
 
+export AUTOPD_STAGE=MODELCRAFT
 ${SOURCE_DIR}/modelcraft.sh
 
 # Extract R-free values from ModelCraft and Refinement outputs
@@ -88,14 +185,9 @@ if [ ! -f "SUMMARY/modelcraft.pdb" ] || [ "$(echo "${r_free_modelcraft} > 0.35"
     echo ""
     echo "Phenix Autobuild will be performed."
     
+    export AUTOPD_STAGE=AUTOBUILD
     ${SOURCE_DIR}/autobuild.sh ${MTZ}
-    
-    if [ -f "AUTOBUILD/AUTOBUILD_SUMMARY/AUTOBUILD.pdb" ]; then
-        cp AUTOBUILD/AUTOBUILD_SUMMARY/* SUMMARY/
-        r_free_autobuild=$(grep 'FREE R VALUE                     :' "AUTOBUILD/AUTOBUILD_SUMMARY/AUTOBUILD.pdb" 2>/dev/null | cut -d ':' -f 2 | xargs)
-    else
-        echo "AUTOBUILD.pdb does not exist."
-    fi
+    collect_autobuild
     
     # Step 4: Run IPCAS 2.0 if Autobuild also fails or insufficient quality       
     if [ ! -f "SUMMARY/AUTOBUILD.pdb" ] || [ "$(echo "${r_free_autobuild} > 0.35" | bc)" -eq 1 ] || [ "${MODEL_BUILD}" = "all" ]; then
@@ -112,17 +204,8 @@ if [ ! -f "SUMMARY/modelcraft.pdb" ] || [ "$(echo "${r_free_modelcraft} > 0.35"
         fi
         
         # Run IPCAS
+        export AUTOPD_STAGE=IPCAS
         "${SOURCE_DIR}/ipcas.sh" "${MTZ}" "${PDB}" "${SEQUENCE}" 0.5 ${IPCAS_CYCLE} . > IPCAS.log
-        echo ""
-        cat IPCAS/result
-        mv IPCAS.log IPCAS/Summary/
-    
-        if [ "$(ls -A IPCAS/Summary/)" ]; then
-            cp IPCAS/Summary/Free_*.mtz SUMMARY/IPCAS.mtz
-            cp IPCAS/Summary/Free_*.pdb SUMMARY/IPCAS.pdb
-            cp IPCAS/Summary/IPCAS.log SUMMARY/
-        else
-            echo "IPCAS.pdb does not exist."
-        fi
+        collect_ipcas
     fi
 fi
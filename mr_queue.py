@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: mr_queue.py
+# Description: Bounded work queue of Phaser MR_AUTO jobs. phaser.sh prepares one directory per MTZ and model
+#              set (phaser_input.txt) and lists it in the queue file; this script runs at most --jobs of them
+#              at a time and follows LLG and TFZ in every job's log and PHASER.sol. As soon as one job has
+#              finished with a decisive solution (TFZ >= --tfz and LLG >= --llg), the running jobs are
+#              terminated and the queued ones are not started. The outcome of every job is written to the
+#              status file, which mr.sh uses to record the jobs that were cut short in MR_SUMMARY.txt.
+#              With --follow (stage overlap), jobs listed while the queue runs are picked up in the order they
+#              arrive, until the --follow file exists and all jobs are done.
+#
+# Usage:
+#   python3 mr_queue.py MR_SUMMARY/mr_queue.txt [--jobs 4] [--tfz 8] [--llg 60] [--status MR_SUMMARY/MR_QUEUE.txt]
+#                       [--follow MR_SUMMARY/mr_queue.closed]
+#
+# Status file (one line per job):
+#   <job> <status> <LLG> <TFZ> <seconds>
+#   status: complete | decisive | cancelled (terminated while running) | skipped (never started)
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+
+POLL_INTERVAL = 5
+LLG = re.compile(r'LLG=(-?\d+)')
+TFZ = re.compile(r'TFZ==?(\d+(?:\.\d+)?)')
+
+
+def best_scores(path, max_lines=None):
+    """Highest LLG and TFZ of the SOLU lines of a solution file or log (None if there are none)."""
+    llg = tfz = None
+    try:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            for number, line in enumerate(f):
+                if max_lines and number >= max_lines:
+                    break
+                if 'SOLU' not in line:
+                    continue
+                for value in LLG.findall(line):
+                    llg = max(llg, int(value)) if llg is not None else int(value)
+                for value in TFZ.findall(line):
+                    tfz = max(tfz, float(value)) if tfz is not None else float(value)
+    except OSError:
+        pass
+    return llg, tfz
+
+
+class PhaserJob(object):
+    """One prepared MR_<FLAG>_<i> directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.name = os.path.basename(os.path.normpath(directory))
+        self.process = None
+        self.status = 'skipped'
+        self.started = None
+        self.elapsed = 0
+        self.llg = None
+        self.tfz = None
+
+    def start(self):
+        command = '${AUTOPD_PROFILE} phaser < phaser_input.txt > phaser_mr.log'
+        self.process = subprocess.Popen(['bash', '-c', command], cwd=self.directory, start_new_session=True)
+        self.started = time.time()
+        self.status = 'running'
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def update(self):
+        """Scores so far: PHASER.sol once written (as mr.sh reads it), the log while running."""
+        solution = os.path.join(self.directory, 'PHASER.sol')
+        if os.path.isfile(solution):
+            self.llg, self.tfz = best_scores(solution, max_lines=5)
+        else:
+            self.llg, self.tfz = best_scores(os.path.join(self.directory, 'phaser_mr.log'))
+        if self.started:
+            self.elapsed = int(time.time() - self.started)
+
+    def decisive(self, tfz, llg):
+        return (os.path.isfile(os.path.join(self.directory, 'PHASER.1.pdb')) and self.tfz is not None
+                and self.llg is not None and self.tfz >= tfz and self.llg >= llg)
+
+    def stop(self):
+        if self.running():
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            self.process.wait()
+            self.status = 'cancelled'
+
+
+def mtz_index(name):
+    """Queue order: the model sets of the first MTZ, then of the second, ..."""
+    match = re.search(r'_(\d+)$', name)
+    return int(match.group(1)) if match else 0
+
+
+def read_queue(path, known):
+    """Jobs of the queue file not in known (by directory), in file order."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            directories = [line.strip() for line in f if line.strip()]
+    except OSError:
+        return []
+    return [PhaserJob(directory) for directory in directories if directory not in known]
+
+
+def run_queue(jobs, max_jobs, tfz, llg, queue=None, follow=None):
+    """
+    Run the jobs; with follow, also the jobs added to the queue file until the follow file exists.
+    Jobs picked up later are appended to jobs.
+    """
+    pending = list(jobs)
+    running = []
+    winner = None
+
+    def stop_all(signum, _frame):
+        # timeout in mr.sh
+        for job in running:
+            job.stop()
+        sys.exit(128 + signum)
+
+    signal.signal(signal.SIGTERM, stop_all)
+    signal.signal(signal.SIGINT, stop_all)
+
+    def open_queue():
+        # The follow file is checked before the queue is read, so no job listed before it is missed
+        closed = os.path.exists(follow)
+        added = read_queue(queue, {job.directory for job in jobs})
+        jobs.extend(added)
+        pending.extend(added)
+        return not closed
+
+    following = follow is not None and open_queue()
+    while pending or running or following:
+        while pending and len(running) < max_jobs:
+            job = pending.pop(0)
+            job.start()
+            running.append(job)
+            print(f"{job.name} started", flush=True)
+        time.sleep(POLL_INTERVAL)
+        for job in list(running):
+            job.update()
+            if job.running():
+                continue
+            running.remove(job)
+            job.status = 'complete'
+            print(f"{job.name} finished: LLG={job.llg} TFZ={job.tfz}", flush=True)
+            if job.decisive(tfz, llg):
+                job.status = 'decisive'
+                winner = job
+        if winner:
+            for job in running:
+                job.update()
+                job.stop()
+            print(f"{winner.name} reached TFZ={winner.tfz} LLG={winner.llg}: "
+                  f"{len(running)} running job(s) cancelled, {len(pending)} queued job(s) skipped", flush=True)
+            break
+        if following:
+            following = open_queue()
+    return winner
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run prepared Phaser MR jobs with bounded concurrency')
+    parser.add_argument('queue', help='File listing the prepared job directories, one per line')
+    parser.add_argument('--jobs', type=int, default=4, help='Concurrent Phaser jobs')
+    parser.add_argument('--tfz', type=float, default=8.0, help='TFZ of a decisive solution')
+    parser.add_argument('--llg', type=float, default=60.0, help='LLG of a decisive solution')
+    parser.add_argument('--status', default=None, help='Status file (default: MR_QUEUE.txt next to the queue)')
+    parser.add_argument('--follow', default=None,
+                        help='Keep reading the queue for new jobs until this file exists (stage overlap)')
+    args = parser.parse_args()
+
+    jobs = read_queue(args.queue, set())
+    if args.follow is None:
+        jobs.sort(key=lambda job: mtz_index(job.name))
+
+    run_queue(jobs, max(1, args.jobs), args.tfz, args.llg, args.queue, args.follow)
+    if args.follow is not None:
+        # Jobs listed after a decisive solution count as skipped
+        jobs.extend(read_queue(args.queue, {job.directory for job in jobs}))
+
+    status_path = args.status or os.path.join(os.path.dirname(args.queue), 'MR_QUEUE.txt')
+    with open(status_path, 'w', encoding='utf-8') as f:
+        for job in jobs:
+            llg = job.llg if job.llg is not None else '-'
+            tfz = job.tfz if job.tfz is not None else '-'
+            f.write(f"{job.name} {job.status} {llg} {tfz} {job.elapsed}\n")
+
+
+if __name__ == '__main__':
+    main()
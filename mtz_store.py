@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: mtz_store.py
+# Description: Content-addressed store of normalized MTZ files. Every reduced MTZ is converted once per label
+#              set into an immutable, read-only file named after the SHA-256 of the source,
+#                <sha>_F.mtz     F SIGF FreeR_flag      (Phaser, REFMAC, ModelCraft)
+#                <sha>_FP.mtz    FP SIGFP FREE          (IPCAS)
+#                <sha>_ANOM.mtz  all columns unchanged  (Crank2: I(+) SIGI(+) I(-) SIGI(-))
+#              instead of rewriting the source in place (ipcas_mtz.sh) and copying it into every job
+#              directory. Conversions hold a lock per source and are published with an atomic rename, so
+#              jobs running in parallel can ask for the same artefact safely.
+#
+# Usage:
+#   python3 mtz_store.py get <MTZ> <F|FP|ANOM> [--store DIR]       Prints the path of the artefact
+#   python3 mtz_store.py prepare <DIR>... [--sets F ANOM] [--store DIR]
+#       Converts the MTZs of the directories (those selected in TRIAGE.txt, if present) ahead of time
+#
+# Store directory: --store, else ${MTZ_STORE}, else ./MTZ_STORE
+#
+# Exit Codes:
+#   0  Artefact(s) available
+#   1  Source not readable or conversion failed (callers fall back to the source file)
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import fcntl
+import glob
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+
+from asu_estimate import header_position
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Output labels of a label set and the input label triples accepted, in order of preference
+LABEL_SETS = {
+    'F': (('F', 'SIGF', 'FreeR_flag'),
+          [('F', 'SIGF', 'FreeR_flag'), ('FP', 'SIGFP', 'FreeR_flag'), ('F', 'SIGF', 'FREE'), ('FP', 'SIGFP', 'FREE')]),
+    'FP': (('FP', 'SIGFP', 'FREE'),
+           [('F', 'SIGF', 'FreeR_flag'), ('FP', 'SIGFP', 'FreeR_flag'), ('F', 'SIGF', 'FREE'), ('FP', 'SIGFP', 'FREE')]),
+    'ANOM': (None, None),
+}
+
+
+def store_directory(store):
+    return os.path.abspath(store or os.environ.get('MTZ_STORE') or 'MTZ_STORE')
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def column_labels(path):
+    """Column labels from the COLUMN records of the MTZ header."""
+    with open(path, 'rb') as f:
+        f.seek(header_position(f))
+        records = f.read()
+    labels = []
+    for offset in range(0, len(records), 80):
+        record = records[offset:offset + 80].decode('ascii', 'replace')
+        if record.startswith('COLUMN'):
+            labels.append(record.split()[1])
+        elif record.startswith('END'):
+            break
+    return labels
+
+
+def convert(source, target, label_set):
+    """Write the label set of source to target (cad through ipcas_mtz.sh, or a plain copy)."""
+    outputs, candidates = LABEL_SETS[label_set]
+    if outputs is None:
+        shutil.copyfile(source, target)
+        return True
+    labels = column_labels(source)
+    inputs = next((triple for triple in candidates if all(label in labels for label in triple)), None)
+    if inputs is None:
+        print(f"{source}: none of the columns {candidates} found", file=sys.stderr)
+        return False
+    subprocess.run([os.path.join(SOURCE_DIR, 'ipcas_mtz.sh'), source, target, *inputs, *outputs],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return os.path.isfile(target) and os.path.getsize(target) > 0
+
+
+def get(source, label_set, store=None):
+    """Path of the artefact of source for the label set, converting it on first use (None if it failed)."""
+    directory = store_directory(store)
+    os.makedirs(directory, exist_ok=True)
+    key = sha256_file(source)[:32]
+    target = os.path.join(directory, f"{key}_{label_set}.mtz")
+    if os.path.isfile(target):
+        return target
+    with open(os.path.join(directory, f"{key}.lock"), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.isfile(target):
+            return target
+        tmp_path = os.path.join(directory, f"{key}_{label_set}.{os.getpid()}.tmp.mtz")
+        try:
+            if not convert(source, tmp_path, label_set):
+                return None
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return target
+
+
+def selected_mtz_files(directory):
+    triage = os.path.join(directory, 'TRIAGE.txt')
+    if os.path.isfile(triage):
+        with open(triage, 'r', encoding='utf-8') as f:
+            return [os.path.join(directory, line.split()[0]) for line in f
+                    if len(line.split()) > 1 and line.split()[1] == 'selected']
+    return sorted(glob.glob(os.path.join(directory, '*.mtz')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Content-addressed store of normalized MTZ files')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    get_parser = subparsers.add_parser('get', help='Print the path of an artefact, converting it on first use')
+    get_parser.add_argument('mtz', help='Source MTZ')
+    get_parser.add_argument('label_set', choices=sorted(LABEL_SETS), help='Label set')
+    get_parser.add_argument('--store', default=None, help='Store directory')
+
+    prepare_parser = subparsers.add_parser('prepare', help='Convert the MTZs of directories ahead of time')
+    prepare_parser.add_argument('directories', nargs='+', help='Directories with MTZ files')
+    prepare_parser.add_argument('--sets', nargs='+', default=['F'], choices=sorted(LABEL_SETS), help='Label sets')
+    prepare_parser.add_argument('--store', default=None, help='Store directory')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'get':
+            path = get(os.path.abspath(args.mtz), args.label_set, args.store)
+            if path is None:
+                sys.exit(1)
+            print(path)
+            return
+        failed = False
+        for directory in args.directories:
+            if not os.path.isdir(directory):
+                continue
+            for source in selected_mtz_files(directory):
+                for label_set in args.sets:
+                    failed |= get(os.path.abspath(source), label_set, args.store) is None
+        sys.exit(1 if failed else 0)
+    except (OSError, ValueError) as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
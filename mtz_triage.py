@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: mtz_triage.py
+# Description: Triage of the MTZ files of the data reduction pipelines before MR and SAD. All MTZs of a
+#              directory are loaded with gemmi and compared in one vectorized NumPy pass (space group, unit
+#              cell, resolution, completeness and the correlation of the amplitudes of common reflections).
+#              Datasets that agree within the tolerances are grouped as redundant; the best dataset of each
+#              group (highest resolution, then completeness) represents it, and the --top best representatives
+#              are selected. phaser.sh and sad.sh only run on the MTZs marked "selected" in TRIAGE.txt.
+#
+# Usage:
+#   python3 mtz_triage.py DATA_REDUCTION_SUMMARY [--top 2] [--cc 0.95] [--cell 0.01]
+#
+# Output (DIR/TRIAGE.txt, one line per MTZ, best first):
+#   <file> <selected|redundant|unselected> <representative> <space group> <resolution> <completeness> <CC>
+#
+# Exit Codes:
+#   0  TRIAGE.txt written
+#   1  Fewer than two MTZ files, or gemmi not available (no TRIAGE.txt: every MTZ is used)
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import glob
+import os
+import sys
+
+import numpy as np
+
+try:
+    import gemmi
+except ImportError:
+    gemmi = None
+
+# Amplitude columns in order of preference (ipcas_mtz.sh and the pipelines write F/SIGF)
+AMPLITUDE_LABELS = ['F', 'FP', 'F-obs', 'FMEAN']
+
+
+class Dataset(object):
+    """Reflections and summary values of one MTZ file."""
+
+    def __init__(self, path):
+        mtz = gemmi.read_mtz_file(path)
+        self.path = path
+        self.name = os.path.basename(path)
+        self.space_group = mtz.spacegroup.hm.replace(' ', '') if mtz.spacegroup else ''
+        cell = mtz.cell
+        self.cell = np.array([cell.a, cell.b, cell.c, cell.alpha, cell.beta, cell.gamma])
+        self.resolution = mtz.resolution_high()
+        data = np.array(mtz, copy=False)
+        labels = mtz.column_labels()
+        column = next((label for label in AMPLITUDE_LABELS if label in labels), None)
+        if column is None:
+            column = next((c.label for c in mtz.columns if c.type == 'F'), None)
+        values = data[:, labels.index(column)] if column else np.full(len(data), np.nan)
+        observed = np.isfinite(values)
+        hkl = data[observed, :3].astype(np.int64)
+        self.keys = miller_keys(hkl)
+        self.values = values[observed]
+        try:
+            possible = gemmi.count_reflections(mtz.cell, mtz.spacegroup, self.resolution)
+            self.completeness = 100.0 * len(np.unique(self.keys)) / possible if possible else 0.0
+        except (AttributeError, TypeError):
+            self.completeness = 0.0
+
+
+def miller_keys(hkl):
+    """One integer per Miller index, for set operations on reflections."""
+    offset = 1024
+    return ((hkl[:, 0] + offset) << 22) | ((hkl[:, 1] + offset) << 11) | (hkl[:, 2] + offset)
+
+
+def correlation_matrix(datasets):
+    """Pearson correlation of the amplitudes of the reflections common to every pair of datasets."""
+    keys = np.unique(np.concatenate([d.keys for d in datasets]))
+    values = np.zeros((len(datasets), len(keys)))
+    mask = np.zeros((len(datasets), len(keys)))
+    for i, d in enumerate(datasets):
+        index = np.searchsorted(keys, d.keys)
+        values[i, index] = d.values
+        mask[i, index] = 1.0
+    n = mask @ mask.T                      # common reflections
+    sx = values @ mask.T                   # sum of x_i over reflections common with j
+    sxx = (values ** 2) @ mask.T
+    sxy = values @ values.T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = n * sxy - sx * sx.T
+        var = (n * sxx - sx ** 2) * (n * sxx - sx ** 2).T
+        cc = cov / np.sqrt(var)
+    return np.where(n > 2, cc, np.nan)
+
+
+def cell_matrix(datasets, tolerance):
+    """True where space group and cell agree (lengths within the relative tolerance, angles within 1 degree)."""
+    cells = np.array([d.cell for d in datasets])
+    groups = np.array([d.space_group for d in datasets])
+    lengths = np.abs(cells[:, None, :3] - cells[None, :, :3]) / cells[None, :, :3]
+    angles = np.abs(cells[:, None, 3:] - cells[None, :, 3:])
+    return ((groups[:, None] == groups[None, :]) & np.all(lengths <= tolerance, axis=2)
+            & np.all(angles <= 1.0, axis=2))
+
+
+def triage(datasets, top, cc_min, cell_tolerance):
+    """(dataset, status, representative, CC to the representative) in order of quality."""
+    order = sorted(range(len(datasets)), key=lambda i: (datasets[i].resolution, -datasets[i].completeness))
+    cc = correlation_matrix(datasets)
+    same = cell_matrix(datasets, cell_tolerance) & (np.nan_to_num(cc) >= cc_min)
+    representatives = []
+    rows = []
+    for i in order:
+        group = next((r for r in representatives if same[i, r]), None)
+        if group is None:
+            representatives.append(i)
+            status = 'selected' if len(representatives) <= top else 'unselected'
+            rows.append((datasets[i], status, datasets[i], 1.0))
+        else:
+            rows.append((datasets[i], 'redundant', datasets[group], cc[i, group]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Group redundant MTZ files and select distinct representatives')
+    parser.add_argument('directory', help='Directory with the MTZ files (TRIAGE.txt is written there)')
+    parser.add_argument('--top', type=int, default=2, help='Representatives passed to MR and SAD')
+    parser.add_argument('--cc', type=float, default=0.95, help='Lowest CC of common amplitudes for redundant datasets')
+    parser.add_argument('--cell', type=float, default=0.01, help='Relative cell length tolerance of redundant datasets')
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.directory, '*.mtz')))
+    if len(paths) < 2:
+        sys.exit(1)
+    if gemmi is None:
+        print("gemmi not available, no MTZ triage")
+        sys.exit(1)
+
+    datasets = [Dataset(path) for path in paths]
+    rows = triage(datasets, max(1, args.top), args.cc, args.cell)
+    with open(os.path.join(args.directory, 'TRIAGE.txt'), 'w', encoding='utf-8') as f:
+        for dataset, status, representative, cc in rows:
+            f.write(f"{dataset.name} {status} {representative.name} {dataset.space_group} {dataset.resolution:.2f} "
+                    f"{dataset.completeness:.1f} {cc:.3f}\n")
+    selected = [dataset.name for dataset, status, _, _ in rows if status == 'selected']
+    print(f"MTZ triage of {args.directory}: {len(datasets)} datasets, {len(selected)} selected ({' '.join(selected)})")
+
+
+if __name__ == '__main__':
+    main()
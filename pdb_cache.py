@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: pdb_cache.py
+# Description: Persistent local cache of PDB entries for the homologous search models. Entries are kept in
+#              ${AUTOPD_CACHE:-~/.cache/autopd}/pdb/<xy>/<id>.pdb (or .cif), sharded like the wwPDB archive
+#              by the middle two characters of the ID, with index.json listing file, format and date of every
+#              entry. Lookups hit the cache first and only download missing entries (PDB format, mmCIF for
+#              entries without one); the chain of a homolog is extracted in-process with gemmi (fixed-column
+#              filter of the PDB records without gemmi).
+#
+# Usage:
+#   python3 pdb_cache.py fetch <PDB_ID> [--chain A] [--out homologs/1abc_A.pdb] [--offline]
+#       Prints the path of the cached entry, writes the chain (or the whole entry) to --out
+#   python3 pdb_cache.py add <PDB_ID> <FILE>       Adds a file fetched otherwise (e.g. phenix.fetch_pdb)
+#
+# Environment:
+#   AUTOPD_CACHE   Cache root (default ~/.cache/autopd)
+#   PDB_URL        Download URL of entries (default https://files.rcsb.org/download)
+#
+# Exit Codes:
+#   0  Success
+#   1  Entry not cached and not downloadable, or chain not found
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import datetime
+import fcntl
+import gzip
+import json
+import os
+import shutil
+import sys
+import urllib.error
+import urllib.request
+
+try:
+    import gemmi
+except ImportError:
+    gemmi = None
+
+PDB_URL = 'https://files.rcsb.org/download'
+FORMATS = ['pdb', 'cif']
+
+
+class PdbCache(object):
+    """Sharded directory of PDB entries with a JSON index."""
+
+    def __init__(self, root=None, url=None):
+        root = root or os.environ.get('AUTOPD_CACHE') or os.path.expanduser('~/.cache/autopd')
+        self.directory = os.path.join(root, 'pdb')
+        self.url = (url or os.environ.get('PDB_URL') or PDB_URL).rstrip('/')
+        self.index_path = os.path.join(self.directory, 'index.json')
+
+    def entry_path(self, pdb_id, fmt):
+        pdb_id = pdb_id.lower()
+        return os.path.join(self.directory, pdb_id[1:3], f"{pdb_id}.{fmt}")
+
+    def lookup(self, pdb_id):
+        for fmt in FORMATS:
+            path = self.entry_path(pdb_id, fmt)
+            if os.path.isfile(path) and os.path.getsize(path) > 0:
+                return path
+        return None
+
+    def add(self, pdb_id, source, fmt):
+        """Copy a file into the cache (atomic rename) and record it in the index."""
+        path = self.entry_path(pdb_id, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        opener = gzip.open if source.endswith('.gz') else open
+        with opener(source, 'rb') as src, open(tmp_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, path)
+        self.update_index(pdb_id, path, fmt)
+        return path
+
+    def download(self, pdb_id):
+        """Download the entry, PDB format first; None if no format is available."""
+        for fmt in FORMATS:
+            path = self.entry_path(pdb_id, fmt)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                with urllib.request.urlopen(f"{self.url}/{pdb_id.upper()}.{fmt}", timeout=60) as response, \
+                        open(tmp_path, 'wb') as f:
+                    shutil.copyfileobj(response, f)
+                os.replace(tmp_path, path)
+            except (urllib.error.URLError, OSError) as error:
+                print(f"{pdb_id}.{fmt}: {error}", file=sys.stderr)
+                continue
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.update_index(pdb_id, path, fmt)
+            return path
+        return None
+
+    def update_index(self, pdb_id, path, fmt):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f"{self.index_path}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = {}
+            index[pdb_id.lower()] = {'file': os.path.relpath(path, self.directory), 'format': fmt,
+                                     'date': datetime.date.today().isoformat()}
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.index_path)
+
+    def fetch(self, pdb_id, offline=False):
+        return self.lookup(pdb_id) or (None if offline else self.download(pdb_id))
+
+
+def extract_chain(path, chain, out):
+    """Write one chain (first model) of an entry as PDB; False if the chain is not found."""
+    if gemmi is not None:
+        structure = gemmi.read_structure(path)
+        while len(structure) > 1:
+            del structure[1]
+        model = structure[0]
+        for name in {c.name for c in model if c.name != chain}:
+            model.remove_chain(name)
+        if not len(model):
+            return False
+        structure.shorten_chain_names()
+        structure.write_pdb(out)
+        return True
+    if path.endswith('.cif'):
+        raise ValueError(f"gemmi is needed to extract chain {chain} from {path}")
+    # Same selection as the former awk filter: records with the chain ID in column 22
+    found = False
+    with open(path, 'r', encoding='utf-8', errors='ignore') as src, open(out, 'w', encoding='utf-8') as dst:
+        for line in src:
+            if line.startswith('ENDMDL'):
+                break
+            if len(line) > 21 and line[21] == chain:
+                dst.write(line)
+                found = found or line.startswith('ATOM')
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local cache of PDB entries')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fetch_parser = subparsers.add_parser('fetch', help='Cached path of an entry, downloading it if missing')
+    fetch_parser.add_argument('pdb_id', help='PDB ID')
+    fetch_parser.add_argument('--chain', default=None, help='Chain to extract to --out')
+    fetch_parser.add_argument('--out', default=None, help='Output PDB file (chain or whole entry)')
+    fetch_parser.add_argument('--offline', action='store_true', help='Only use the cache')
+
+    add_parser = subparsers.add_parser('add', help='Add a file to the cache')
+    add_parser.add_argument('pdb_id', help='PDB ID')
+    add_parser.add_argument('file', help='PDB or mmCIF file (optionally gzipped)')
+
+    args = parser.parse_args()
+    cache = PdbCache()
+
+    if args.command == 'add':
+        name = args.file[:-3] if args.file.endswith('.gz') else args.file
+        print(cache.add(args.pdb_id, args.file, 'cif' if name.endswith('.cif') else 'pdb'))
+        return
+
+    path = cache.fetch(args.pdb_id, args.offline)
+    if path is None:
+        print(f"{args.pdb_id} is not cached and could not be downloaded", file=sys.stderr)
+        sys.exit(1)
+    print(path)
+    if args.out:
+        try:
+            if args.chain:
+                if not extract_chain(path, args.chain, args.out):
+                    print(f"Chain {args.chain} not found in {args.pdb_id}", file=sys.stderr)
+                    sys.exit(1)
+            else:
+                shutil.copyfile(path, args.out)
+        except (OSError, ValueError, RuntimeError) as error:
+            print(error, file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
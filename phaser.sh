@@ -10,18 +10,21 @@
 #   1. Parse arguments: number of templates, MTZ directory, ensemble path, and model type flag.
 #   2. Iterate over each MTZ file in MTZ_DIR.
 #   3. For each MTZ:
-#        - Convert MTZ to Phaser-compatible format with ipcas_mtz.sh.
-#        - Estimate Z (number of molecules in the ASU) via phenix.xtriage, unless Z_INPUT is provided.
+#        - Get the MTZ with F SIGF FreeR_flag from the MTZ store (mtz_store.py), linked into the job
+#          directory (ipcas_mtz.sh in place as fallback).
+#        - Estimate Z (number of molecules in the ASU) from the Matthews coefficient (asu_estimate.py,
+#          cached per MTZ and sequence), with Phaser CCA as fallback or cross-check, unless Z is provided.
 #        - Generate Phaser input script (phaser_input.txt):
 #             * Input MTZ file
 #             * Sequence composition
 #             * Template ensemble models
 #             * Search parameters (ensembles and Z)
 #        - Run Phaser in MR_AUTO mode, outputting logs and solutions.
-#   4. Results are stored in MR_<FLAG>_<i> subdirectories.
+#   4. Results are stored in MR_<FLAG>_<i> subdirectories (i counted from OFFSET+1).
+#   5. With MR_QUEUE set, the MR_AUTO runs are left to mr_queue.py.
 #
 # Usage:
-#   ./phaser.sh <TEMPLATE_NUMBER> <MTZ_DIR> <ENSEMBLE_PATH> <FLAG>
+#   ./phaser.sh <TEMPLATE_NUMBER> <MTZ_DIR> <ENSEMBLE_PATH> <FLAG> [OFFSET]
 #
 # Arguments:
 #   TEMPLATE_NUMBER   Number of template models (ENSEMBLE#.pdb) to be used.
@@ -31,6 +34,12 @@
 #                       - I : Input models
 #                       - H : Homologs
 #                       - A : AlphaFold models
+#   OFFSET            Number of MTZs queued before (stage overlap, mr.sh), default 0
+#
+# Environment:
+#   MR_QUEUE          Queue file of mr_queue.py; if set, the prepared job directories are listed in it
+#                     instead of starting Phaser
+#   PHASER_CCA        true: also run Phaser CCA and report a Z that differs from the Matthews estimate
 #
 # Inputs:
 #   - MTZ files (*.mtz) in MTZ_DIR
@@ -45,8 +54,7 @@
 #
 # Dependencies:
 #   - CCP4 Phaser
-#   - Phenix Xtriage
-#   - ipcas_mtz.sh (internal script for MTZ preparation)
+#   - mtz_store.py, ipcas_mtz.sh (internal scripts for MTZ preparation)
 #
 # Author: ZHANG Xin
 # Date Created: 2023-06-01
@@ -58,9 +66,14 @@ TEMPLATE_NUMBER=${1}
 MTZ_DIR=${2}
 ENSEMBLE_PATH=$(readlink -f "${3}")
 FLAG=${4}
+OFFSET=${5:-0}
 
-# Collect all MTZ files
-mtz_files=($(ls "${MTZ_DIR}"/*.mtz))  
+# Collect all MTZ files (only the distinct datasets selected by mtz_triage.py, if triaged)
+if [ -f "${MTZ_DIR}/TRIAGE.txt" ]; then
+  mtz_files=($(awk -v dir="${MTZ_DIR}" '$2 == "selected" {print dir"/"$1}' "${MTZ_DIR}/TRIAGE.txt"))
+else
+  mtz_files=($(ls "${MTZ_DIR}"/*.mtz))
+fi
 num_mtz_files=${#mtz_files[@]}
 
 solution_num=0
@@ -69,41 +82,65 @@ solution_num=0
 for ((i=1; i<=num_mtz_files; i++)); do
   mtz_file=${mtz_files[$i-1]}
   
-  # Preprocess MTZ file for Phaser
-  ${SOURCE_DIR}/ipcas_mtz.sh ${mtz_file} ${mtz_file} FP SIGFP FreeR_flag F SIGF FreeR_flag > /dev/null 2>&1
+  # MTZ with F SIGF FreeR_flag for Phaser: read-only artefact of mtz_store.py (converted once per MTZ),
+  # or the MTZ converted in place if the store is not available
+  mtz_name=$(basename ${mtz_file})
+  store_file=$(python3 ${SOURCE_DIR}/mtz_store.py get ${mtz_file} F 2>/dev/null)
+  if [ -n "${store_file}" ]; then
+    mtz_file=${store_file}
+  else
+    ${SOURCE_DIR}/ipcas_mtz.sh ${mtz_file} ${mtz_file} FP SIGFP FreeR_flag F SIGF FreeR_flag > /dev/null 2>&1
+  fi
   
-  # Create directory for this MR job
-  mkdir -p MR_${FLAG}_$i
-  cd MR_${FLAG}_$i
-  cp ${mtz_file} .
+  # Create directory for this MR job, with a link to the MTZ under its original name
+  job=MR_${FLAG}_$((i + OFFSET))
+  mkdir -p ${job}
+  cd ${job}
+  ln -sf ${mtz_file} ${mtz_name}
   
   
-  # Determine Z (number of molecules per ASU)
+  # Determine Z (number of molecules per ASU): Matthews estimate from the MTZ header (cached per MTZ and
+  # sequence); Phaser CCA if the estimate fails, or as a cross-check with PHASER_CCA=true
   if [[ -z "${Z_NUMBER}" ]]; then
-    #phaser_cca
-    phaser << eof > phaser_cca.log
-    TITLE phaser_cca
-    MODE CCA
-    ROOT PHASER_CCA
-    HKLIN ${mtz_file}
-    LABIN F=F SIGF=SIGF
-    COMPOSITION BY ASU
-    COMPOSITION PROTEIN SEQ ${SEQUENCE} NUM 1
+    CCA_EXIT_STATUS="SUCCESS"
+    Z_NUMBER=$(python3 ${SOURCE_DIR}/asu_estimate.py ${mtz_file} ${SEQUENCE} --log asu_estimate.log)
+    if [ -n "${Z_NUMBER}" ]; then
+      echo ""
+      echo "${job} Most probable Z=${Z_NUMBER} (Matthews coefficient)"
+    fi
+
+    if [ -z "${Z_NUMBER}" ] || [ "${PHASER_CCA}" = "true" ]; then
+      #phaser_cca
+      ${AUTOPD_PROFILE} phaser << eof > phaser_cca.log
+      TITLE phaser_cca
+      MODE CCA
+      ROOT PHASER_CCA
+      HKLIN ${mtz_file}
+      LABIN F=F SIGF=SIGF
+      COMPOSITION BY ASU
+      COMPOSITION PROTEIN SEQ ${SEQUENCE} NUM 1
 eof
 
-    #Extract NUMBER from phaser_cca result
-    CCA_EXIT_STATUS=$(grep 'EXIT STATUS:' phaser_cca.log | awk '{print $3}')
+      #Extract NUMBER from phaser_cca result
+      CCA_EXIT_STATUS_CHECK=$(grep 'EXIT STATUS:' phaser_cca.log | awk '{print $3}')
+      CCA_Z=$(awk '/loggraph/{flag=1;next}/\$\$/{flag=0}flag' phaser_cca.log | sort -k2,2nr | head -n 1 | awk '{print $1}')
 
-    echo ""
-    echo "MR_${FLAG}_$i Phaser CCA EXIT STATUS: ${CCA_EXIT_STATUS}"
-    
-    if [ ${CCA_EXIT_STATUS} == "FAILURE" ]; then
-      Z_NUMBER=1
-    else
-      Z_NUMBER=$(awk '/loggraph/{flag=1;next}/\$\$/{flag=0}flag' phaser_cca.log | sort -k2,2nr | head -n 1 | awk '{print $1}')
+      echo ""
+      echo "${job} Phaser CCA EXIT STATUS: ${CCA_EXIT_STATUS_CHECK}"
+
+      if [ -z "${Z_NUMBER}" ]; then
+        CCA_EXIT_STATUS=${CCA_EXIT_STATUS_CHECK}
+        if [ "${CCA_EXIT_STATUS}" == "FAILURE" ]; then
+          Z_NUMBER=1
+        else
+          Z_NUMBER=${CCA_Z}
+        fi
+        echo ""
+        echo "${job} Most probable Z=${Z_NUMBER}"
+      elif [ "${CCA_EXIT_STATUS_CHECK}" == "SUCCESS" ] && [ "${CCA_Z}" != "${Z_NUMBER}" ]; then
+        echo "${job} Phaser CCA Z=${CCA_Z} differs from the Matthews estimate Z=${Z_NUMBER}"
+      fi
     fi
-    echo ""
-    echo "MR_${FLAG}_$i Most probable Z=${Z_NUMBER}"
   else
     echo "Input Z=${Z_NUMBER}"
   fi
@@ -162,7 +199,12 @@ fi
     echo "SEARCH ENSEMBLE ensemble${j} NUM ${Z_NUMBER}" >> phaser_input.txt
   done
 
-  phaser < phaser_input.txt > phaser_mr.log &
+  # Queued for mr_queue.py (bounded concurrency, early stop), or started right away
+  if [ -n "${MR_QUEUE}" ]; then
+    pwd >> "${MR_QUEUE}"
+  else
+    ${AUTOPD_PROFILE} phaser < phaser_input.txt > phaser_mr.log &
+  fi
 
   cd ..
   Z_NUMBER=""
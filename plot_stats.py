@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: plot_stats.py
+# Description: Quality-control plots of the data reduction statistics of all pipelines in one go (formerly
+#              plot.sh, run once per pipeline and round with one gnuplot process per figure).
+#              Reads the NAME_STATISTICS.json documents written by dr_parse.py, computes axis ranges and the
+#              resolution ticks with numpy, writes the .dat tables and renders every SVG with a single gnuplot
+#              process: the seven figures of every pipeline in NAME/STATISTICS_FIGURES and a side-by-side
+#              comparison of the pipelines (CC(1/2), completeness, I/sigI and Rmeas against resolution).
+#
+# Usage:
+#   python3 plot_stats.py --pipeline XDS XDS/XDS_SUMMARY/XDS_STATISTICS.json \
+#                         --pipeline autoPROC autoPROC/autoPROC_SUMMARY/autoPROC_STATISTICS.json \
+#                         [--comparison DATA_REDUCTION_SUMMARY/comparison.svg]
+#
+# Output:
+#   NAME/STATISTICS_FIGURES/*.dat and *.svg for every pipeline, and the comparison figure
+#
+# Dependencies:
+#   - gnuplot
+#   - numpy
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+import numpy as np
+
+from dr_parse import load, write_dat
+
+TERMINAL = "set term svg size 1000,600 enhanced background rgb 'white' font 'Arial Narrow,20'"
+COMPARISON_TERMINAL = "set term svg size 2000,1200 enhanced background rgb 'white' font 'Arial Narrow,20'"
+PIPELINE_COLORS = {'XDS': '#e31a1c', 'XDS_XIA2': '#1f78b4', 'DIALS_XIA2': '#33a02c', 'autoPROC': '#ff7f00'}
+RESOLUTION_TICKS = 10
+
+
+def as_array(stats, name):
+    """Table of the statistics JSON as a float array (rows x columns), None if missing or empty."""
+    rows = stats.get('tables', {}).get(name, {}).get('rows', [])
+    width = min((len(row) for row in rows), default=0)
+    if not rows or width == 0:
+        return None
+    try:
+        return np.array([row[:width] for row in rows], dtype=float)
+    except (TypeError, ValueError):
+        return None
+
+
+def value_range(*columns):
+    """Minimum and maximum over the columns; widened when they are equal (gnuplot rejects empty ranges)."""
+    values = np.concatenate([np.ravel(column) for column in columns])
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return -0.05, 0.05
+    low, high = float(values.min()), float(values.max())
+    if low == high:
+        low, high = low - 0.05, high + 0.05
+    return low, high
+
+
+def resolution_tics(low_value, high_value):
+    """Ticks evenly spaced in 1/d^2 and labelled with the resolution d."""
+    values = np.linspace(low_value, high_value, RESOLUTION_TICKS)
+    labels = 1.0 / np.sqrt(values)
+    return 'set xtics (' + ', '.join(f'"{label:.2f}" {value:.6f}' for label, value in zip(labels, values)) + ')'
+
+
+def resolution_axis(*tables):
+    """xrange and xtics of resolution plots, column 2 is 1/d^2."""
+    low_value, high_value = value_range(*[table[:, 1] for table in tables])
+    return [resolution_tics(low_value, high_value), f"set xrange [{low_value:.6f}:{high_value:.6f}]"]
+
+
+def yrange(*columns, axis='y'):
+    low, high = value_range(*columns)
+    return f"set {axis}range [{low}:{high}]"
+
+
+def figure(output, title, xlabel, ylabel, settings, plots):
+    lines = [TERMINAL, 'set encoding utf8; set grid; set key outside', f"set title '{title}'",
+             f"set xlabel '{xlabel}'; set ylabel '{ylabel}'"]
+    lines += settings
+    lines += [f"set output '{output}'", 'plot ' + ', \\\n     '.join(plots), 'reset', '']
+    return lines
+
+
+def pipeline_figures(name, stats, directory):
+    """gnuplot commands of the seven figures of one pipeline (figures without data are skipped)."""
+    write_dat(stats, directory)
+
+    def dat(table):
+        return f"'{os.path.join(directory, table + '.dat')}'"
+
+    def out(figure_name):
+        return os.path.join(directory, figure_name + '.svg')
+
+    cchalf = as_array(stats, 'cchalf_vs_resolution')
+    completeness = as_array(stats, 'completeness_vs_resolution')
+    analysis = as_array(stats, 'analysis_vs_resolution')
+    scales = as_array(stats, 'scales_vs_batch')
+    batches = as_array(stats, 'rmerge_and_i_over_sigma_vs_batch')
+    l_test = as_array(stats, 'L_test')
+    l_statistic = stats.get('ctruncate', {}).get('L_statistic') or '0.500'
+
+    commands = []
+    for table, data in (('cchalf_vs_resolution', cchalf), ('completeness_vs_resolution', completeness),
+                        ('analysis_vs_resolution', analysis), ('scales_vs_batch', scales),
+                        ('rmerge_and_i_over_sigma_vs_batch', batches), ('L_test', l_test)):
+        if data is None:
+            print(f"Warning: {name} has no {table} table, figure skipped")
+
+    # The resolution axis of the per-pipeline figures follows the CC(1/2) table, as in plot.sh
+    axis = resolution_axis(cchalf) if cchalf is not None else None
+    if cchalf is not None and cchalf.shape[1] >= 7:
+        commands += figure(out('cchalf_vs_resolution'), 'CC(1/2) and CC_Anom against Resolution',
+                           'Resolution [Å]', 'CC(1/2) and CC_Anom',
+                           ["set format y '%.2f'"] + axis + [yrange(cchalf[:, 3], cchalf[:, 6])],
+                           [f"{dat('cchalf_vs_resolution')} using 2:7 with lines lc rgb '#fb9a99' lw 2 ti 'CC(1/2)'",
+                            f"{dat('cchalf_vs_resolution')} using 2:4 with lines lc rgb '#a6cee3' lw 2 ti 'CC_Anom'"])
+    if axis and completeness is not None and completeness.shape[1] >= 10:
+        commands += figure(out('completeness_vs_resolution'), 'Completeness and AnomCompleteness against Resolution',
+                           'Resolution [Å]', 'Completeness (%)',
+                           ["set format y '%.2f'"] + axis + [yrange(completeness[:, 6], completeness[:, 9])],
+                           [f"{dat('completeness_vs_resolution')} using 2:7 with lines lc rgb '#e31a1c' lw 2 ti 'Completeness'",
+                            f"{dat('completeness_vs_resolution')} using 2:10 with lines lc rgb '#1f78b4' lw 2 ti 'AnomCmpl'"])
+    if axis and analysis is not None and analysis.shape[1] >= 14:
+        commands += figure(out('i_over_sigma_vs_resolution'), 'Mean(I/SigI) against Resolution',
+                           'Resolution [Å]', 'Mean(I/SigI)',
+                           ["set format y '%.2f'"] + axis + [yrange(analysis[:, 13])],
+                           [f"{dat('analysis_vs_resolution')} using 2:14 with lines lc rgb '#33a02c' lw 2 ti 'Mn(I/sigI)'"])
+        commands += figure(out('rmerge_rmeans_rpim_vs_resolution'), 'Rmerge, Rmeas and Rpim against Resolution',
+                           'Resolution [Å]', 'Merging Statistics',
+                           ["set format y '%.2f'"] + axis + [yrange(analysis[:, 3], analysis[:, 6], analysis[:, 7])],
+                           [f"{dat('analysis_vs_resolution')} using 2:4 with lines lc rgb '#e31a1c' lw 2 ti 'Rmerge'",
+                            f"{dat('analysis_vs_resolution')} using 2:7 with lines lc rgb '#1f78b4' lw 2 ti 'Rmeas'",
+                            f"{dat('analysis_vs_resolution')} using 2:8 with lines lc rgb '#33a02c' lw 2 ti 'Rpim'"])
+    if scales is not None and scales.shape[1] >= 9:
+        commands += figure(out('scales_vs_batch'), 'Scales against Rotation Range', 'Batch', 'Mn(k) & 0k',
+                           ["set y2label 'Bfactor & Bdecay'", 'set ytics nomirror; set y2tics',
+                            f"set xrange [1:{scales[-1, 0]:g}]", yrange(scales[:, 4], scales[:, 5]),
+                            yrange(scales[:, 7], scales[:, 8], axis='y2')],
+                           [f"{dat('scales_vs_batch')} using 4:5 with lines lc rgb '#e31a1c' lw 2 ti 'Mn(k)'",
+                            f"{dat('scales_vs_batch')} using 4:6 with lines lc rgb '#1f78b4' lw 2 ti '0k'",
+                            f"{dat('scales_vs_batch')} using 4:8 with lines lc rgb '#33a02c' lw 2 ti 'Bfactor' axes x1y2",
+                            f"{dat('scales_vs_batch')} using 4:9 with lines lc rgb '#b2df8a' lw 2 ti 'Bdecay' axes x1y2"])
+    if batches is not None and batches.shape[1] >= 6:
+        x_max = scales[-1, 0] if scales is not None else batches[-1, 1]
+        commands += figure(out('rmerge_and_i_over_sigma_vs_batch'), 'Rmerge and <I/σ> against Batches', 'Batch', 'Rmerge',
+                           ["set y2label '<I/σ>'", 'set ytics nomirror; set y2tics', f"set xrange [1:{x_max:g}]",
+                            yrange(batches[:, 5]), yrange(batches[:, 4], axis='y2')],
+                           [f"{dat('rmerge_and_i_over_sigma_vs_batch')} using 2:6 with lines lc rgb '#e31a1c' lw 2 ti 'Rmerge'",
+                            f"{dat('rmerge_and_i_over_sigma_vs_batch')} using 2:5 with lines lc rgb '#1f78b4' lw 2 ti '<I/σ>' axes x1y2"])
+    if l_test is not None and l_test.shape[1] >= 4:
+        commands += figure(out('L_test'), 'L-test', '|L|', '',
+                           ['set xrange [0:1]', yrange(l_test[:, 1], l_test[:, 2], l_test[:, 3]),
+                            f"set label 'L statistic = {l_statistic}' at graph 0.98,0.20 right textcolor rgb '#1f78b4' font 'Verdana,14'",
+                            "set label 'Twinning fraction = 0.000  L = 0.500' at graph 0.98,0.12 right textcolor rgb '#e31a1c' font 'Verdana,14'",
+                            "set label 'Twinning fraction = 0.100  L = 0.440' at graph 0.98,0.08 right textcolor rgb '#1f78b4' font 'Verdana,14'",
+                            "set label 'Twinning fraction = 0.500  L = 0.375' at graph 0.98,0.04 right textcolor rgb '#33a02c' font 'Verdana,14'"],
+                           [f"{dat('L_test')} using 1:2 with lines lc rgb '#1f78b4' lw 2 ti 'N(L)'",
+                            f"{dat('L_test')} using 1:3 with lines lc rgb '#e31a1c' lw 2 ti 'Untwinned'",
+                            f"{dat('L_test')} using 1:4 with lines lc rgb '#33a02c' lw 2 ti 'Twinned'"])
+    return commands
+
+
+def comparison_figure(pipelines, output):
+    """2x2 multiplot with one line per pipeline in every panel, on a common resolution axis."""
+    # (title, table, column (0-based), minimum number of columns)
+    panels = [('CC(1/2)', 'cchalf_vs_resolution', 6, 7),
+              ('Completeness (%)', 'completeness_vs_resolution', 6, 7),
+              ('Mean(I/SigI)', 'analysis_vs_resolution', 13, 14),
+              ('Rmeas', 'analysis_vs_resolution', 6, 7)]
+    available = {}
+    for title, table, column, width in panels:
+        for name, stats, directory in pipelines:
+            data = as_array(stats, table)
+            if data is not None and data.shape[1] >= width:
+                available.setdefault(title, []).append((name, directory, data))
+    if not available:
+        return []
+
+    all_tables = [data for found in available.values() for _, _, data in found]
+    commands = [COMPARISON_TERMINAL, 'set encoding utf8', f"set output '{output}'",
+                "set multiplot layout 2,2 title 'Data reduction pipelines against Resolution'"]
+    for title, table, column, _ in panels:
+        found = available.get(title)
+        if not found:
+            continue
+        plots = [f"'{os.path.join(directory, table + '.dat')}' using 2:{column + 1} with lines "
+                 f"lc rgb '{PIPELINE_COLORS.get(name, '#6a3d9a')}' lw 2 ti '{name.replace('_', ' ')}'"
+                 for name, directory, _ in found]
+        commands += ['set grid; set key top right', f"set title '{title} against Resolution'",
+                     f"set xlabel 'Resolution [Å]'; set ylabel '{title}'", "set format y '%.2f'"]
+        commands += resolution_axis(*all_tables)
+        commands += [yrange(*[data[:, column] for _, _, data in found]), 'plot ' + ', \\\n     '.join(plots)]
+    commands += ['unset multiplot', 'reset', '']
+    return commands
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Plot the data reduction statistics of all pipelines with one gnuplot process')
+    parser.add_argument('--pipeline', nargs=2, action='append', default=[], metavar=('NAME', 'STATISTICS_JSON'),
+                        help='Pipeline name and its NAME_STATISTICS.json (repeatable)')
+    parser.add_argument('--comparison', default=None, help='Output SVG of the side-by-side pipeline comparison')
+    args = parser.parse_args()
+
+    pipelines = []
+    for name, stats_json in args.pipeline:
+        try:
+            stats = load(stats_json)
+        except (OSError, ValueError):
+            print(f"Warning: {stats_json} not found or unreadable, {name} not plotted")
+            continue
+        # NAME/NAME_SUMMARY/NAME_STATISTICS.json -> NAME/STATISTICS_FIGURES
+        directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(stats_json))), 'STATISTICS_FIGURES')
+        pipelines.append((name, stats, directory))
+    if not pipelines:
+        print("Error: no statistics to plot!")
+        sys.exit(1)
+
+    commands = []
+    for name, stats, directory in pipelines:
+        commands += pipeline_figures(name, stats, directory)
+    if args.comparison and len(pipelines) > 1:
+        commands += comparison_figure(pipelines, os.path.abspath(args.comparison))
+
+    if not shutil.which('gnuplot'):
+        print("Error: gnuplot not found, figures not rendered!")
+        sys.exit(1)
+    result = subprocess.run(['gnuplot'], input='\n'.join(commands), text=True)
+    sys.exit(result.returncode)
+
+
+if __name__ == '__main__':
+    main()
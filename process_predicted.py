@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: process_predicted.py
+# Description: Processing of predicted models for MR without starting Phenix or CCP4i2, in place of
+#              phenix.process_predicted_model and i2run editbfac. In one NumPy pass over the residues:
+#                1. residues with pLDDT below --minimum_plddt are removed,
+#                2. pLDDT in the B-factor column is converted to B = 8 pi^2 / 3 * rmsd^2, with the estimated
+#                   error rmsd = 1.5 exp(4 (0.7 - pLDDT / 100)),
+#                3. the remaining residues are split into domains: connected components of the graph of
+#                   residue pairs with PAE below --pae_cutoff in both directions (--pae), or, without a PAE
+#                   matrix, of CA atoms closer than --contact_distance that are not sequence neighbours.
+#                   Fragments shorter than --minimum_domain_length join the domain next to them in sequence,
+#                   and the smallest domains are merged until at most --maximum_domains are left.
+#
+# Usage:
+#   python3 process_predicted.py <MODEL.pdb> [--minimum_plddt 70] [--pae pae.json] [--prefix NAME]
+#       [--b_value_field_is plddt|lddt|rmsd|b_value] [--maximum_domains 3] [--minimum_domain_length 10]
+#
+# Outputs:
+#   <prefix>.pdb       Trimmed model with converted B-factors (prefix default: <MODEL>_processed)
+#   <prefix>_<n>.pdb   Domain n (always written, also for a single domain)
+#   stdout             "Final residues: <N>" and one line per domain, as parsed by search_model.sh
+#
+# Exit Codes:
+#   0  Success
+#   1  Model without residues after trimming, or unreadable model/PAE file
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+RECORD_LENGTH = 80
+B_FROM_RMSD = 8 * math.pi ** 2 / 3
+
+
+class Residues(object):
+    """ATOM records of a model grouped by residue, with per-residue pLDDT and CA coordinates."""
+
+    def __init__(self, path):
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            records = [line.rstrip('\r\n').ljust(RECORD_LENGTH) for line in f if line.startswith('ATOM')]
+        if not records:
+            raise ValueError(f"No ATOM records in {path}")
+        keys = np.array([line[21:27] for line in records])
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        self.records = records
+        self.bfactors = np.array([float(line[60:66].strip() or 0) for line in records])
+        self.atom_residue = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(records)]))
+        self.chains = np.array([records[i][21] for i in starts])
+        self.values = np.bincount(self.atom_residue, weights=self.bfactors) / np.bincount(self.atom_residue)
+        coordinates = np.array([[float(line[30:38]), float(line[38:46]), float(line[46:54])] for line in records])
+        is_ca = np.array([line[12:16].strip() == 'CA' for line in records])
+        self.ca = np.full((len(starts), 3), np.nan)
+        self.ca[self.atom_residue[is_ca]] = coordinates[is_ca]
+        # Residues without CA: first atom
+        missing = np.isnan(self.ca[:, 0])
+        self.ca[missing] = coordinates[starts[missing]]
+
+    def __len__(self):
+        return len(self.chains)
+
+
+def read_pae(path, size):
+    """PAE matrix of the AlphaFold DB (v1-v4), ColabFold or Phenix JSON formats."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = data[0]
+    if 'predicted_aligned_error' in data:
+        pae = np.array(data['predicted_aligned_error'], dtype=float)
+    elif 'pae' in data:
+        pae = np.array(data['pae'], dtype=float)
+    elif 'distance' in data:
+        n = int(max(data['residue1']))
+        pae = np.zeros((n, n))
+        pae[np.array(data['residue1']) - 1, np.array(data['residue2']) - 1] = data['distance']
+    else:
+        raise ValueError(f"No PAE matrix in {path}")
+    if pae.shape != (size, size):
+        raise ValueError(f"PAE matrix {pae.shape} does not match {size} residues")
+    return pae
+
+
+def plddt_from_field(values, field, fraction):
+    """pLDDT (0-100) from the B-factor column (None for B-factors, which are kept)."""
+    if field in ('plddt', 'lddt'):
+        return values * 100 if fraction else values
+    if field == 'rmsd':
+        return 100 * (0.7 - np.log(np.maximum(values, 1e-3) / 1.5) / 4)
+    return None
+
+
+def connected_components(adjacency):
+    """Component label of each node of a boolean adjacency matrix (breadth-first, one frontier at a time)."""
+    labels = np.full(len(adjacency), -1)
+    component = 0
+    for seed in range(len(adjacency)):
+        if labels[seed] >= 0:
+            continue
+        frontier = np.zeros(len(adjacency), dtype=bool)
+        frontier[seed] = True
+        while frontier.any():
+            labels[frontier] = component
+            frontier = adjacency[frontier].any(axis=0) & (labels < 0)
+        component += 1
+    return labels
+
+
+def merge_into_neighbours(labels, chains, minimum_length, maximum_domains):
+    """Fragments shorter than minimum_length, then the smallest domains, join the preceding (else following)
+    domain in sequence."""
+    labels = labels.copy()
+    while True:
+        domains, sizes = np.unique(labels, return_counts=True)
+        small = sizes < minimum_length
+        if small.any() and len(domains) > 1:
+            target = domains[np.argmin(np.where(small, sizes, np.iinfo(int).max))]
+        elif len(domains) > maximum_domains:
+            target = domains[np.argmin(sizes)]
+        else:
+            return labels
+        positions = np.flatnonzero(labels == target)
+        for position in positions:
+            neighbours = [p for p in (position - 1, position + 1) if 0 <= p < len(labels)
+                          and labels[p] != target and chains[p] == chains[position]]
+            if not neighbours:
+                neighbours = [p for p in range(len(labels)) if labels[p] != target][:1]
+            if neighbours:
+                labels[labels == target] = labels[neighbours[0]]
+                break
+        else:
+            return labels
+
+
+def domain_labels(residues, keep, pae, pae_cutoff, contact_distance, minimum_length, maximum_domains):
+    index = np.flatnonzero(keep)
+    if pae is not None:
+        sub = pae[np.ix_(index, index)]
+        adjacency = (sub < pae_cutoff) & (sub.T < pae_cutoff)
+    else:
+        ca = residues.ca[index]
+        squared = (ca ** 2).sum(axis=1)
+        distances_squared = squared[:, None] + squared[None, :] - 2 * ca @ ca.T
+        # Sequence neighbours are left out, or the chain would link every domain through the linkers
+        separation = np.abs(index[:, None] - index[None, :])
+        adjacency = (distances_squared < contact_distance ** 2) & (separation > 2)
+    labels = connected_components(adjacency)
+    labels = merge_into_neighbours(labels, residues.chains[index], minimum_length, maximum_domains)
+    # Number the domains in order of first residue
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=int)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return rank[inverse] + 1
+
+
+def write_model(path, residues, atom_mask, bfactors):
+    with open(path, 'w', encoding='utf-8') as f:
+        chain = None
+        for i in np.flatnonzero(atom_mask):
+            line = residues.records[i]
+            if chain is not None and line[21] != chain:
+                f.write('TER\n')
+            chain = line[21]
+            f.write(f"{line[:60]}{bfactors[i]:6.2f}{line[66:]}".rstrip() + '\n')
+        f.write('TER\nEND\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trim, convert and split a predicted model for MR')
+    parser.add_argument('model', help='Predicted model (PDB) with pLDDT in the B-factor column')
+    parser.add_argument('--minimum_plddt', type=float, default=70.0, help='Residues below are removed')
+    parser.add_argument('--b_value_field_is', default='plddt', choices=['plddt', 'lddt', 'rmsd', 'b_value'],
+                        help='Contents of the B-factor column')
+    parser.add_argument('--pae', default=None, help='PAE matrix (JSON) of the model')
+    parser.add_argument('--pae_cutoff', type=float, default=5.0, help='PAE (A) below which residues are linked')
+    parser.add_argument('--contact_distance', type=float, default=8.0, help='CA distance (A) of contacts')
+    parser.add_argument('--minimum_domain_length', type=int, default=10, help='Shortest domain (residues)')
+    parser.add_argument('--maximum_domains', type=int, default=3, help='Largest number of domains')
+    parser.add_argument('--prefix', default=None, help='Output prefix (default: <model>_processed)')
+    args = parser.parse_args()
+
+    prefix = args.prefix or os.path.splitext(os.path.basename(args.model))[0] + '_processed'
+    try:
+        residues = Residues(args.model)
+        pae = read_pae(args.pae, len(residues)) if args.pae else None
+    except (OSError, ValueError, IndexError) as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+    fraction = residues.bfactors.max() <= 1.0
+    plddt = plddt_from_field(residues.values, args.b_value_field_is, fraction)
+    if plddt is None:
+        keep = np.ones(len(residues), dtype=bool)
+        bfactors = residues.bfactors
+    else:
+        keep = plddt >= args.minimum_plddt
+        atom_plddt = plddt_from_field(residues.bfactors, args.b_value_field_is, fraction)
+        rmsd = 1.5 * np.exp(4 * (0.7 - atom_plddt / 100))
+        bfactors = np.minimum(B_FROM_RMSD * rmsd ** 2, 999.99)
+    if not keep.any():
+        print(f"No residues with pLDDT >= {args.minimum_plddt}", file=sys.stderr)
+        sys.exit(1)
+
+    labels = np.zeros(len(residues), dtype=int)
+    labels[keep] = domain_labels(residues, keep, pae, args.pae_cutoff, args.contact_distance,
+                                 max(1, args.minimum_domain_length), max(1, args.maximum_domains))
+    atom_labels = labels[residues.atom_residue]
+
+    write_model(f"{prefix}.pdb", residues, atom_labels > 0, bfactors)
+    print(f"Starting residues: {len(residues)}")
+    print(f"Final residues: {int(keep.sum())}")
+    for domain in range(1, labels.max() + 1):
+        members = labels == domain
+        write_model(f"{prefix}_{domain}.pdb", residues, atom_labels == domain, bfactors)
+        print(f"Domain {domain}: {int(members.sum())} residues, mean pLDDT "
+              f"{plddt[members].mean() if plddt is not None else 0:.1f} -> {prefix}_{domain}.pdb")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: rank_models.py
+# Description: Ranking and selection of the search models of one chain (sequence i of MRPARSE/SEQ_FILES),
+#              in place of the sort/awk/bc glue of search_model.sh:
+#                - homologs (mrparse_<i>/homologs.json, else the files in homologs/) with their release dates
+#                  from an index of mrparse.log built in one regex pass, filtered by the mp_date cutoff and
+#                  ranked by sequence identity, then release date; the best one is used if its length ratio
+#                  is >= 0.3 (missing chains are fetched through pdb_cache.py, phenix.fetch_pdb as fallback)
+#                - AlphaFold DB models (af_models.json) ranked by sequence identity, then pLDDT
+#                - the AlphaFold DB model is used instead of the prediction (predict_<i>) if the prediction
+#                  failed, or if seq_id >= 0.85, its pLDDT is higher and its length ratio >= 0.6 (not with
+#                  af_predict or pae_split)
+#              The selected files are copied to SEARCH_MODELS and the decision is written as JSON.
+#
+# Usage:
+#   python3 rank_models.py select <i> [--date YYYY-MM-DD] [--json ranking_<i>.json]   (run in MRPARSE)
+#   python3 rank_models.py get ranking_<i>.json <key>                                  e.g. decision
+#
+# Output (JSON):
+#   decision       prediction | afdb | none
+#   homolog        name, file, seq_id, length, length_ratio, release_date, used
+#   afdb           name, file, seq_id, length, length_ratio, plddt
+#   prediction     ok, plddt, plddt_cutoff (60 if pLDDT >= 60, else 40)
+#
+# Environment:
+#   AF_PREDICT, PAE_SPLIT, SOURCE_DIR   as exported by autopipeline.sh
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import glob
+import json
+import math
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+from pdb_cache import PdbCache, extract_chain
+
+RELEASE_DATE = re.compile(r'release_date: (\d{4}-\d{2}-\d{2})')
+TOKEN = re.compile(r'[\w.:-]+')
+SEQUENCE_LENGTH = re.compile(r'L=(\d+)')
+PREDICTION_PLDDT = re.compile(r'plDDT =\s*([-\d.]+)')
+
+HOMOLOG_FIELDS = ['name', 'seq_ident', 'region_id', 'range', 'length', 'release_date']
+AF_FIELDS = ['name', 'seq_ident', 'region_id', 'range', 'length', 'h_score', 'avg_plddt']
+MIN_HOMOLOG_RATIO = 0.3
+MIN_AFDB_SEQ_ID = 0.85
+MIN_AFDB_RATIO = 0.6
+
+
+def release_date_index(log_path):
+    """Release date of every name on the lines of mrparse.log with a release_date (first one wins)."""
+    index = {}
+    dated_lines = []
+    try:
+        with open(log_path, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                match = RELEASE_DATE.search(line)
+                if match:
+                    dated_lines.append((line, match.group(1)))
+                    for token in TOKEN.findall(line):
+                        index.setdefault(token, match.group(1))
+    except OSError:
+        print(f"Warning: {log_path} not found. 'release_date' will be set to 'Unknown' for all entries.")
+    return index, dated_lines
+
+
+def release_dates(log_path, names):
+    index, dated_lines = release_date_index(log_path)
+    dates = {}
+    for name in names:
+        date = index.get(name)
+        if date is None:
+            # Names that are not a whole token of the line (only those are searched line by line)
+            date = next((d for line, d in dated_lines if name in line), 'Unknown')
+        dates[name] = date
+    return dates
+
+
+def filter_by_date(rows, cutoff):
+    """Homologs released before the cutoff (unknown dates are dropped)."""
+    if not cutoff:
+        return rows
+    return [row for row in rows if row['release_date'] != 'Unknown' and row['release_date'] < cutoff]
+
+
+def get_value(data, path):
+    """Value at a dotted key ('' if missing or null)."""
+    value = data
+    for key in path.split('.'):
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        else:
+            return ''
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return '%g' % value if isinstance(value, float) else str(value)
+
+
+def load_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def write_table(rows, fields, path):
+    """Tab-delimited table with padded columns (homologs.txt, af_models.txt)."""
+    if not rows:
+        return
+    cells = [[str(row.get(field, '')) for field in fields] for row in rows]
+    widths = [max(len(row[column]) for row in cells) for column in range(len(fields))]
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in cells:
+            f.write('\t'.join(value.ljust(width) for value, width in zip(row, widths)) + '\n')
+
+
+def residue_count(path):
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        return sum(1 for line in f if line.startswith('ATOM') and line[12:16].strip() == 'CA')
+
+
+def has_atoms(path):
+    try:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            return any(line.startswith('ATOM') for line in f)
+    except OSError:
+        return False
+
+
+def homolog_rows(cutoff):
+    """Homologs of the current mrparse_<i> directory, best first."""
+    data = load_json('homologs.json')
+    if data:
+        dates = release_dates('mrparse.log', [item['name'] for item in data])
+        rows = [dict(item, release_date=dates[item['name']]) for item in data]
+        rows = filter_by_date(rows, cutoff)
+        if not rows:
+            print("No homologs found before cutoff date.")
+    else:
+        # Empty homologs.json: the PDB files of homologs/ (sequence identity in % at the end of the first line)
+        rows = []
+        for path in sorted(glob.glob('homologs/*')):
+            if not os.path.isfile(path):
+                continue
+            if not has_atoms(path):
+                os.remove(path)
+                continue
+            with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                first = f.readline().split()
+            try:
+                seq_id = math.floor(float(first[-1])) / 100
+            except (IndexError, ValueError):
+                seq_id = 0.0
+            rows.append({'name': os.path.basename(path).rsplit('_', 1)[0], 'seq_ident': seq_id,
+                         'length': residue_count(path), 'release_date': 'Unknown'})
+    rows.sort(key=lambda row: (float(row.get('seq_ident') or 0), str(row.get('release_date', ''))), reverse=True)
+    return rows
+
+
+def af_rows():
+    data = load_json('af_models.json')
+    data.sort(key=lambda row: (float(row.get('seq_ident') or 0), float(row.get('avg_plddt') or 0)), reverse=True)
+    return data
+
+
+def fetch_homolog(name):
+    """homologs/<id>_<chain>.pdb from the PDB cache, or with phenix.fetch_pdb."""
+    model_id, chain_id = name[:4], name[5:6]
+    out = f"homologs/{model_id}_{chain_id}.pdb"
+    cache = PdbCache()
+    path = cache.fetch(model_id)
+    if path is None:
+        subprocess.run(['bash', '-c', f'${{AUTOPD_PROFILE}} phenix.fetch_pdb {model_id}'],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if os.path.isfile(f"{model_id}.pdb"):
+            os.makedirs('pdb_files', exist_ok=True)
+            shutil.move(f"{model_id}.pdb", f"pdb_files/{model_id}.pdb")
+            path = cache.add(model_id, f"pdb_files/{model_id}.pdb", 'pdb')
+    if path is not None:
+        try:
+            extract_chain(path, chain_id, out)
+        except (OSError, ValueError, RuntimeError) as error:
+            print(error, file=sys.stderr)
+    return out
+
+
+def first_match(pattern):
+    matches = sorted(glob.glob(pattern))
+    return matches[0] if matches else pattern
+
+
+def select_homolog(index, label, seq_length, cutoff, search_models):
+    rows = homolog_rows(cutoff)
+    write_table(rows, HOMOLOG_FIELDS, 'homologs.txt')
+    if not rows:
+        return None
+    best = rows[0]
+    length = int(best.get('length') or 0)
+    ratio = math.floor(100 * length / seq_length) / 100 if seq_length else 0.0
+    homolog = {'name': best['name'], 'file': first_match(f"homologs/{best['name']}*"), 'seq_id': best['seq_ident'],
+               'length': length, 'length_ratio': ratio, 'release_date': best.get('release_date'), 'used': False}
+    print(f"{label}    Homologous Model: {best['name']} model_length={length} seq_id={best['seq_ident']} "
+          f"model_date={best.get('release_date', '')}")
+    if ratio < MIN_HOMOLOG_RATIO:
+        print(f"{label}    Homologous model is too short for MR.")
+        return homolog
+    if not os.path.isfile(homolog['file']):
+        homolog['file'] = fetch_homolog(best['name'])
+    if has_atoms(homolog['file']):
+        print(f"{label}    Homologous model will be used in MR.")
+        shutil.copyfile(homolog['file'], os.path.join(search_models, 'HOMOLOGS', f"ENSEMBLE{index + 1}.pdb"))
+        homolog['used'] = True
+    else:
+        print(f"{label}    No atoms in homologous model.")
+    return homolog
+
+
+def select_afdb(label, seq_length):
+    rows = af_rows() if os.path.isdir('models') and os.listdir('models') else []
+    write_table(rows, AF_FIELDS, 'af_models.txt')
+    best = rows[0] if rows else None
+    path = first_match(f"models/{best['name']}_*") if best else ''
+    if not best or not has_atoms(path):
+        print(f"{label}    No AlphaFold Database models were found.")
+        return None
+    length = int(best.get('length') or 0)
+    afdb = {'name': best['name'], 'file': os.path.abspath(path), 'seq_id': float(best['seq_ident']),
+            'length': length, 'length_ratio': math.floor(100 * length / seq_length) / 100 if seq_length else 0.0,
+            'plddt': float(best.get('avg_plddt') or 0)}
+    print(f"{label}    AlphaFold Database Model: {best['name']} model_length={length} "
+          f"seq_id={best['seq_ident']} plddt={best.get('avg_plddt')}")
+    return afdb
+
+
+def sequence_length(log_path):
+    try:
+        with open(log_path, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                match = SEQUENCE_LENGTH.search(line)
+                if match:
+                    return int(match.group(1))
+    except OSError:
+        pass
+    return 0
+
+
+def prediction_state(predict_dir):
+    plddt = None
+    try:
+        with open(os.path.join(predict_dir, 'PredictAndBuild.log'), 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                match = PREDICTION_PLDDT.search(line)
+                if match:
+                    plddt = float(match.group(1))
+    except (OSError, ValueError):
+        pass
+    carry_on = os.path.join(predict_dir, 'PredictAndBuild_0_CarryOn')
+    ok = os.path.isdir(carry_on) and bool(os.listdir(carry_on))
+    return {'ok': ok, 'plddt': plddt, 'plddt_cutoff': 60 if (plddt or 0) >= 60 else 40}
+
+
+def select(index, cutoff):
+    """Rank the models of sequence index and copy the selected ones (run in MRPARSE)."""
+    label = f"Sequence {index + 1}"
+    work_dir = os.getcwd()
+    search_models = os.path.abspath(os.path.join(work_dir, '..', 'SEARCH_MODELS'))
+    af_predict = os.environ.get('AF_PREDICT') == 'true'
+    pae_split = os.environ.get('PAE_SPLIT') == 'true'
+    result = {'decision': 'none', 'homolog': None, 'afdb': None}
+
+    mrparse_dir = os.path.join(work_dir, f"mrparse_{index}")
+    if not af_predict and os.path.isdir(mrparse_dir):
+        os.chdir(mrparse_dir)
+        seq_length = sequence_length('mrparse.log')
+        if not os.path.isdir('homologs') or not os.listdir('homologs'):
+            print(f"{label}    No homologs were found.")
+        else:
+            result['homolog'] = select_homolog(index, label, seq_length, cutoff, search_models)
+        result['afdb'] = select_afdb(label, seq_length)
+        os.chdir(work_dir)
+
+    prediction = prediction_state(os.path.join(work_dir, f"predict_{index}"))
+    result['prediction'] = prediction
+    afdb = result['afdb']
+    if not prediction['ok']:
+        print("AlphaFold Prediction failed.")
+        if afdb:
+            result['decision'] = 'afdb'
+    elif (afdb and not af_predict and not pae_split and afdb['seq_id'] >= MIN_AFDB_SEQ_ID
+          and afdb['plddt'] > (prediction['plddt'] or 0) and afdb['length_ratio'] >= MIN_AFDB_RATIO):
+        print(f"{label}    AlphaFold Prediction Model: plddt={prediction['plddt']} ")
+        print(f"{label}    AlphaFold Database model will be used in MR.")
+        result['decision'] = 'afdb'
+    else:
+        result['decision'] = 'prediction'
+
+    if result['decision'] == 'afdb':
+        target = os.path.join(search_models, 'AF_MODELS', f"AF_DB{index + 1}.pdb")
+        shutil.copyfile(afdb['file'], target)
+        # VRMS remark from the AlphaFold DB model with pLDDT (written by search_model.sh in one batch)
+        with open(os.path.join(work_dir, 'VRMS_TARGETS.txt'), 'a', encoding='utf-8') as f:
+            f.write(f"{mrparse_dir}/AF2_files/{afdb['name']}* {target}\n")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank homologs and AlphaFold models and select the search models')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    select_parser = subparsers.add_parser('select', help='Select the search models of one sequence')
+    select_parser.add_argument('index', type=int, help='Sequence index (mrparse_<i>, predict_<i>)')
+    select_parser.add_argument('--date', default=None, help='Release date cutoff of homologs (YYYY-MM-DD)')
+    select_parser.add_argument('--json', default=None, help='Decision file (default: ranking_<i>.json)')
+
+    get_parser = subparsers.add_parser('get', help='Print one value of a decision file')
+    get_parser.add_argument('json', help='ranking_<i>.json')
+    get_parser.add_argument('path', help='Dotted key, e.g. decision or prediction.plddt_cutoff')
+
+    args = parser.parse_args()
+
+    if args.command == 'get':
+        print(get_value(load_json(args.json) or {}, args.path))
+        return
+
+    if args.date:
+        if not re.fullmatch(r'\d{4}-\d{2}-\d{2}', args.date):
+            print(f"Error: Invalid cutoff date format {args.date}, expected YYYY-MM-DD")
+            sys.exit(1)
+    result = select(args.index, args.date)
+    with open(args.json or f"ranking_{args.index}.json", 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: read_header.py
+# Description: Native reader of diffraction image headers. The fields of header.log (wavelength, oscillation,
+#              pixel size, image size, distance, beam centre, ...) are read straight from
+#                - an Eiger master file (NeXus/HDF5, needs h5py)
+#                - a (mini)CBF header (Pilatus/Eiger CBF, also .bz2/.gz compressed)
+#                - an SMV header (ADSC, Rigaku .img)
+#              and stored in header.json, which the downstream scripts read. The record is cached: as long as
+#              the first image, its size and mtime and the number of images are unchanged, header.json is
+#              reused without reading any image. Formats not recognised here exit with code 2 and header.sh
+#              falls back to dials.import/dials.show, whose output is converted to the same record.
+#
+# Usage:
+#   python3 read_header.py read DATA_PATH [--file-type h5] [--json header.json]
+#   python3 read_header.py dials imported.txt DATA_PATH [--json header.json]
+#   python3 read_header.py get header.json pixel_size.0
+#
+# Exit Codes:
+#   0  Header record written, header.log text printed
+#   1  header.json not readable (get)
+#   2  Image format not supported natively (use dials.import)
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import bz2
+import gzip
+import json
+import math
+import os
+import re
+import sys
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# Bytes read from the start of an image, enough for every CBF/SMV header
+HEADER_BYTES = 8192
+COMPRESSED = {'.bz2': bz2.open, '.gz': gzip.open}
+DIGITS = re.compile(r'(\d+)(?=\D*$)')
+FLOAT = re.compile(r'[-+]?\d*\.?\d+(?:[eE][-+]?\d+)?')
+
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+#############################################
+# Image files
+#############################################
+def image_files(data_path, file_type):
+    """Sorted image files of DATA_PATH (the master file for HDF5)."""
+    names = sorted(name for name in os.listdir(data_path)
+                   if not name.startswith('.') and os.path.isfile(os.path.join(data_path, name)))
+    if file_type == 'h5':
+        names = [name for name in names if name.endswith('master.h5')]
+    return [os.path.join(data_path, name) for name in names]
+
+
+def sweep(files):
+    """Files of the sweep of the first image (same template) and their frame numbers."""
+    first = os.path.basename(files[0])
+    match = DIGITS.search(first)
+    if not match:
+        return [files[0]], [1]
+    prefix, suffix = first[:match.start()], first[match.end():]
+    numbers = []
+    for path in files:
+        name = os.path.basename(path)
+        if name.startswith(prefix) and name.endswith(suffix):
+            digits = name[len(prefix):len(name) - len(suffix)]
+            if digits.isdigit():
+                numbers.append(int(digits))
+    return files, sorted(numbers)
+
+
+def read_start(path):
+    opener = COMPRESSED.get(os.path.splitext(path)[1], open)
+    with opener(path, 'rb') as f:
+        return f.read(HEADER_BYTES).decode('latin-1')
+
+
+def signature(path, number_of_images):
+    stat = os.stat(path)
+    return {'first_image': path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'images': number_of_images}
+
+
+#############################################
+# Format readers (lengths in mm, beam centre in pixels)
+#############################################
+def first_float(text):
+    match = FLOAT.search(text)
+    if not match:
+        raise UnsupportedFormat(text)
+    return float(match.group(0))
+
+
+def read_cbf(text):
+    if '_array_data.data' not in text and '# Wavelength' not in text:
+        raise UnsupportedFormat('no CBF header')
+    fields = {}
+    for line in text.splitlines():
+        if line.startswith('# '):
+            parts = line[2:].split(None, 1)
+            if len(parts) == 2:
+                fields[parts[0]] = parts[1]
+        elif line.startswith('X-Binary-Size-'):
+            key, value = line.split(':', 1)
+            fields[key] = value.strip()
+    try:
+        pixel = [float(v) * 1000 for v in FLOAT.findall(fields['Pixel_size'])[:2]]
+        beam = [float(v) for v in FLOAT.findall(fields['Beam_xy'])[:2]]
+        return {
+            'wavelength': first_float(fields['Wavelength']),
+            'exposure_time': first_float(fields['Exposure_time']),
+            'distance': first_float(fields['Detector_distance']) * 1000,
+            'oscillation_start': first_float(fields.get('Start_angle', '0')),
+            'oscillation': first_float(fields['Angle_increment']),
+            'pixel_size': pixel,
+            'image_size': [int(fields['X-Binary-Size-Fastest-Dimension']),
+                           int(fields['X-Binary-Size-Second-Dimension'])],
+            'beam_center': beam,
+        }
+    except (KeyError, ValueError, IndexError):
+        raise UnsupportedFormat('incomplete CBF header')
+
+
+def read_smv(text):
+    if not text.startswith('{') or 'HEADER_BYTES' not in text:
+        raise UnsupportedFormat('no SMV header')
+    fields = dict(re.findall(r'(\w+)\s*=\s*([^;]*);', text.split('}', 1)[0]))
+    try:
+        pixel = float(fields['PIXEL_SIZE'])
+        # ADSC convention (as generate_XDS.INP): BEAM_CENTER_Y is along the fast axis
+        return {
+            'wavelength': float(fields['WAVELENGTH']),
+            'exposure_time': float(fields.get('TIME', 0)),
+            'distance': float(fields['DISTANCE']),
+            'oscillation_start': float(fields.get('OSC_START', 0)),
+            'oscillation': float(fields['OSC_RANGE']),
+            'pixel_size': [pixel, pixel],
+            'image_size': [int(fields['SIZE1']), int(fields['SIZE2'])],
+            'beam_center': [float(fields['BEAM_CENTER_Y']) / pixel, float(fields['BEAM_CENTER_X']) / pixel],
+        }
+    except (KeyError, ValueError):
+        raise UnsupportedFormat('incomplete SMV header')
+
+
+def read_master(path):
+    if h5py is None:
+        raise UnsupportedFormat('h5py not installed')
+    try:
+        with h5py.File(path, 'r') as f:
+            detector = f['entry/instrument/detector']
+            specific = detector['detectorSpecific']
+            omega = f['entry/sample/goniometer/omega'][()]
+            if 'omega_range_average' in f['entry/sample/goniometer']:
+                oscillation = float(f['entry/sample/goniometer/omega_range_average'][()])
+            else:
+                oscillation = float(omega[1] - omega[0]) if len(omega) > 1 else 0.0
+            if 'wavelength' in f['entry/instrument/beam']:
+                wavelength = f['entry/instrument/beam/wavelength'][()]
+            else:
+                wavelength = f['entry/instrument/beam/incident_wavelength'][()]
+            images = int(specific['nimages'][()]) * int(specific['ntrigger'][()] if 'ntrigger' in specific else 1)
+            return {
+                'wavelength': float(wavelength),
+                'exposure_time': float(detector['count_time'][()]),
+                'distance': float(detector['detector_distance'][()]) * 1000,
+                'oscillation_start': float(omega[0]) if len(omega) else 0.0,
+                'oscillation': oscillation,
+                'pixel_size': [float(detector['x_pixel_size'][()]) * 1000, float(detector['y_pixel_size'][()]) * 1000],
+                'image_size': [int(specific['x_pixels_in_detector'][()]), int(specific['y_pixels_in_detector'][()])],
+                'beam_center': [float(detector['beam_center_x'][()]), float(detector['beam_center_y'][()])],
+                'number_of_images': images,
+                'image_range': [1, images],
+            }
+    except (KeyError, OSError, ValueError, IndexError):
+        raise UnsupportedFormat('incomplete NeXus master file')
+
+
+def max_resolution(header):
+    """d-spacing at the detector corners and at the inscribed circle (detector normal to the beam)."""
+    nx, ny = header['image_size']
+    px, py = header['pixel_size']
+    bx, by = header['beam_center'][0] * px, header['beam_center'][1] * py
+    width, height = nx * px, ny * py
+    corner = max(math.hypot(x - bx, y - by) for x in (0, width) for y in (0, height))
+    inscribed = min(bx, by, width - bx, height - by)
+
+    def d_spacing(radius):
+        theta = math.atan2(radius, header['distance']) / 2
+        return header['wavelength'] / (2 * math.sin(theta)) if theta > 0 else 0.0
+    return d_spacing(corner), d_spacing(max(inscribed, 0))
+
+
+def read_native(data_path, file_type):
+    files = image_files(data_path, file_type)
+    if not files:
+        raise UnsupportedFormat('no images')
+    if file_type == 'h5':
+        header = read_master(files[0])
+    else:
+        files, numbers = sweep(files)
+        text = read_start(files[0])
+        header = read_smv(text) if text.startswith('{') else read_cbf(text)
+        header['number_of_images'] = len(numbers)
+        header['image_range'] = [numbers[0], numbers[-1]]
+    header['data_path'] = data_path
+    header['format'] = file_type
+    header['reader'] = 'native'
+    header['max_resolution_corners'], header['max_resolution_inscribed'] = max_resolution(header)
+    header['signature'] = signature(files[0], header['number_of_images'])
+    return header
+
+
+#############################################
+# dials.show output (fallback)
+#############################################
+def braces(text, key):
+    match = re.search(re.escape(key) + r'\s*:?\s*\{([^}]*)\}', text)
+    return [float(v) for v in match.group(1).split(',')] if match else []
+
+
+def line_value(text, pattern, group=1):
+    match = re.search(pattern, text, re.MULTILINE)
+    return float(match.group(group)) if match else 0.0
+
+
+def read_dials(imported_txt, data_path, file_type):
+    with open(imported_txt, 'r', encoding='utf-8', errors='ignore') as f:
+        text = f.read()
+    image_range = [int(v) for v in braces(text, 'image range')] or [1, 1]
+    oscillation = braces(text, 'oscillation') or [0.0, 0.0]
+    beam = re.search(r'px:\s*\(([^)]*)\)', text)
+    header = {
+        'wavelength': line_value(text, r'wavelength:\s*([\d.]+)'),
+        'exposure_time': line_value(text, r'exposure time:\s*([\d.]+)'),
+        'distance': line_value(text, r'distance:\s*([\d.]+)'),
+        'oscillation_start': oscillation[0],
+        'oscillation': oscillation[1],
+        'pixel_size': braces(text, 'pixel_size'),
+        'image_size': [int(v) for v in braces(text, 'image_size')],
+        'beam_center': [float(v) for v in beam.group(1).split(',')] if beam else [],
+        'number_of_images': int(line_value(text, r'number of images:\s*(\d+)')),
+        'image_range': image_range,
+        'max_resolution_corners': line_value(text, r'Max resolution \(at corners\):\s*([\d.]+)'),
+        'max_resolution_inscribed': line_value(text, r'Max resolution \(inscribed\):\s*([\d.]+)'),
+        'data_path': data_path,
+        'format': file_type,
+        'reader': 'dials.import',
+    }
+    files = image_files(data_path, file_type)
+    if files:
+        header['signature'] = signature(files[0], header['number_of_images'])
+    return header
+
+
+#############################################
+# Output
+#############################################
+def format_number(value):
+    return '%g' % value if isinstance(value, float) else str(value)
+
+
+def header_text(header):
+    """header.log section (formerly printed by header.sh from dials.show)."""
+    oscillation_end = header['oscillation_start'] + header['number_of_images'] * header['oscillation']
+    pair = lambda values: ','.join(format_number(v) for v in values)
+    lines = [
+        "=============================================================================================",
+        "                                       Data reduction                                        ",
+        "=============================================================================================",
+        "",
+        "------------------------------------- Header information ------------------------------------",
+        "",
+        f"Location of raw images              = {header['data_path']}",
+        f"Number of images                    = {header['number_of_images']}",
+        f"Image range (start,end)             = {pair(header['image_range'])}",
+        f"Exposure time             [seconds] = {format_number(header['exposure_time'])}",
+        f"Wavelength                      [Å] = {format_number(header['wavelength'])}",
+        f"Oscillation (start,end)    [degree] = {header['oscillation_start']:.3f},{oscillation_end:.3f}",
+        f"Oscillation-angle          [degree] = {header['oscillation']:.3f}",
+        f"Pixel size (X,Y)               [mm] = {pair(header['pixel_size'])}",
+        f"Image size (X,Y)            [pixel] = {pair(header['image_size'])}",
+        f"Max resolution (at corners)     [Å] = {header['max_resolution_corners']:.2f}",
+        f"Max resolution (inscribed)      [Å] = {header['max_resolution_inscribed']:.2f}",
+        f"Distance_start                 [mm] = {header['distance']:.2f}",
+        f"Beam_center_start (X,Y)     [pixel] = {pair(round(v, 2) for v in header['beam_center'])}",
+    ]
+    return '\n'.join(lines)
+
+
+def cached(json_path, data_path, file_type):
+    """header.json of an earlier run when the images are unchanged, else None."""
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        previous = header['signature']
+        files = image_files(data_path, file_type)
+        if file_type != 'h5':
+            files, numbers = sweep(files)
+            if len(numbers) != previous['images']:
+                return None
+        if files and signature(files[0], previous['images']) == previous:
+            return header
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def write(header, json_path):
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump(header, f, indent=1)
+    print(header_text(header))
+
+
+def get_value(header, path):
+    value = header
+    for key in path.split('.'):
+        if isinstance(value, dict) and key in value:
+            value = value[key]
+        elif isinstance(value, list) and key.isdigit() and int(key) < len(value):
+            value = value[int(key)]
+        else:
+            return ''
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return format_number(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read diffraction image headers into header.json')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    read_parser = subparsers.add_parser('read', help='Read the header natively (exit code 2 if not supported)')
+    read_parser.add_argument('data_path', help='Directory of the images')
+    read_parser.add_argument('--file-type', default='', help='Extension of the images (h5 for Eiger master files)')
+    read_parser.add_argument('--json', default='header.json', help='Header record (also used as cache)')
+
+    dials_parser = subparsers.add_parser('dials', help='Convert dials.show output into the header record')
+    dials_parser.add_argument('imported_txt', help='Output of dials.show imported.expt')
+    dials_parser.add_argument('data_path', help='Directory of the images')
+    dials_parser.add_argument('--file-type', default='', help='Extension of the images')
+    dials_parser.add_argument('--json', default='header.json', help='Header record')
+
+    get_parser = subparsers.add_parser('get', help='Print one value of the header record')
+    get_parser.add_argument('json', help='header.json')
+    get_parser.add_argument('path', help='Dotted key, e.g. pixel_size.0')
+
+    args = parser.parse_args()
+
+    if args.command == 'read':
+        header = cached(args.json, args.data_path, args.file_type)
+        if header is None:
+            try:
+                header = read_native(args.data_path, args.file_type)
+            except UnsupportedFormat as error:
+                print(f"Header not read natively ({error}), using dials.import", file=sys.stderr)
+                sys.exit(2)
+        write(header, args.json)
+    elif args.command == 'dials':
+        write(read_dials(args.imported_txt, args.data_path, args.file_type), args.json)
+    else:
+        try:
+            with open(args.json, 'r', encoding='utf-8') as f:
+                header = json.load(f)
+        except (OSError, ValueError):
+            sys.exit(1)
+        print(get_value(header, args.path))
+
+
+if __name__ == '__main__':
+    main()
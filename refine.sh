@@ -16,7 +16,7 @@ PDB=$(readlink -f "${2}")
 mkdir -p REFINEMENT
 cd REFINEMENT
 
-i2run prosmart_refmac \
+${AUTOPD_PROFILE} i2run prosmart_refmac \
      --F_SIGF \
 		fullPath=${MTZ} \
 		columnLabels="/*/*/[F,SIGF]" \
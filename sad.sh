@@ -53,8 +53,12 @@ else
   summary_dir=$(realpath ../DATA_REDUCTION/DATA_REDUCTION_SUMMARY)
 fi
 
-# Collect MTZ files
-mtz_files=($(ls "${summary_dir}"/*.mtz))
+# Collect MTZ files (only the distinct datasets selected by mtz_triage.py, if triaged)
+if [ -f "${summary_dir}/TRIAGE.txt" ]; then
+  mtz_files=($(awk -v dir="${summary_dir}" '$2 == "selected" {print dir"/"$1}' "${summary_dir}/TRIAGE.txt"))
+else
+  mtz_files=($(ls "${summary_dir}"/*.mtz))
+fi
 num_mtz_files=${#mtz_files[@]}
 
 # Launch SAD phasing for each MTZ file
@@ -62,7 +66,14 @@ for ((i=1; i<=num_mtz_files; i++)); do
   mtz_file=${mtz_files[$i-1]}
   mkdir -p SAD_$i
   cd SAD_$i
-  cp ${mtz_file} .
+  # Read-only copy from the MTZ store, linked under the original name (plain copy if the store is not available)
+  store_file=$(python3 ${SOURCE_DIR}/mtz_store.py get ${mtz_file} ANOM 2>/dev/null)
+  if [ -n "${store_file}" ]; then
+    ln -sf ${store_file} $(basename ${mtz_file})
+    mtz_file=${store_file}
+  else
+    cp ${mtz_file} .
+  fi
   
   # Extract wavelength from MTZ file header
   mtzdmp ${mtz_file} > mtzdmp.log
@@ -104,7 +115,7 @@ else
     best=$(awk 'NR==1 {print $1}' result_sorted.log)
     best_r=$(awk 'NR==1 {print $2}' result_sorted.log)
     echo "Best SAD result: SAD_${best} R_factor=${best_r}" | tee -a SAD_SUMMARY/crank2.log
-    name=$(find "SAD_${best}" -type f -name "*.mtz" ! -name "crank2.mtz" -exec basename {} \; | sed 's/\.mtz$//' | head -n 1)
+    name=$(find "SAD_${best}" \( -type f -o -type l \) -name "*.mtz" ! -name "crank2.mtz" -exec basename {} \; | sed 's/\.mtz$//' | head -n 1)
     
     # Copy results from best SAD run
     cp SAD_${best}/crank2.log SAD_SUMMARY
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: scheduler.py
+# Description: Resource-aware launcher for the parallel fan-outs of AutoPD (data reduction pipelines,
+#              MR/SAD, model building). It owns a CPU and memory budget, hands every job an explicit
+#              slot count through AUTOPD_NPROC and holds a job back while its estimated memory does not
+#              fit into what is left of the budget. Output of the jobs is not grouped (like parallel -u).
+#
+# Usage:
+#   python3 scheduler.py run [--cpus N] [--mem-mb M] [--job-mem MB] [--stop-when "check {name}" --winner FILE]
+#                            --job NAME[:CPUS[:MEM_MB]] "command" ...
+#   python3 scheduler.py estimate header.json
+#
+#   NAME:0 requests no CPU slot, for a job that only waits (e.g. for a pipeline started elsewhere).
+#
+# Example:
+#   python3 scheduler.py run --job-mem 12000 --job XDS "xds.sh round=1" --job XDS_XIA2 "xds_xia2.sh round=1"
+#
+# Budget (defaults):
+#   --cpus      AUTOPD_CPUS   or all online CPUs
+#   --mem-mb    AUTOPD_MEM_MB or MemAvailable from /proc/meminfo
+#
+# Race mode:
+#   --stop-when runs a check command ({name} is replaced by the job name) whenever a job succeeds. The
+#   first job whose check exits with 0 wins: the other jobs are stopped, pending jobs are dropped and the
+#   name of the winner is written to --winner.
+#
+# Environment passed to every job:
+#   AUTOPD_NPROC     Number of CPU slots granted to the job
+#   AUTOPD_CPUS      Same value, so that nested fan-outs split the share of their parent
+#   AUTOPD_MEM_MB    Memory granted to the job
+#   AUTOPD_JOB_NAME  Name of the job
+#
+# Exit Codes:
+#   0  All jobs succeeded, or a job won the race
+#   1  At least one job failed
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+
+# Baseline memory of one reduction pipeline besides the frames it keeps in memory
+BASE_MEM_MB = 1024
+# Rotation range processed per INTEGRATE batch (XDS DELPHI default)
+WEDGE_DEGREES = 5.0
+# Number of forked INTEGRATE jobs used by xds.sh
+FORKED_JOBS = 2
+# Seconds between SIGTERM and SIGKILL when jobs are stopped
+KILL_GRACE = 10
+
+
+def available_cpus():
+    """CPU budget from AUTOPD_CPUS or the CPUs usable by this process."""
+    value = os.environ.get('AUTOPD_CPUS')
+    if value:
+        return max(1, int(value))
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_mem_mb():
+    """Memory budget from AUTOPD_MEM_MB or MemAvailable of the host."""
+    value = os.environ.get('AUTOPD_MEM_MB')
+    if value:
+        return max(1, int(value))
+    try:
+        with open('/proc/meminfo', 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return 1 << 30  # Unknown: do not hold anything back
+
+
+def estimate_job_mem_mb(header_json):
+    """
+    Estimate the memory of one reduction pipeline from frames x image size (header.json of read_header.py).
+    INTEGRATE keeps one wedge of frames (DELPHI) per forked job in memory as 32-bit pixels.
+    """
+    try:
+        with open(header_json, 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        frames = int(header['number_of_images'])
+        nx, ny = (int(v) for v in header['image_size'][:2])
+    except (OSError, ValueError, KeyError, TypeError):
+        return BASE_MEM_MB
+    oscillation = float(header.get('oscillation') or 0)
+    wedge = frames
+    if oscillation > 0:
+        wedge = min(frames, int(math.ceil(WEDGE_DEGREES / oscillation)))
+    image_mb = nx * ny * 4 / (1024 * 1024)
+    return int(BASE_MEM_MB + image_mb * wedge * FORKED_JOBS)
+
+
+class Job(object):
+    """One command with its resource request."""
+
+    def __init__(self, name, command, cpus=None, mem_mb=0, priority=0):
+        self.name = name
+        self.command = command
+        self.cpus = cpus            # Fixed request, None means an equal share of the remainder
+        self.mem_mb = mem_mb
+        self.priority = priority    # Higher priorities start first, equal ones in submission order
+        self.slots = 0
+        self.process = None
+        self.returncode = None
+        self.start_time = None
+        self.end_time = None
+
+    @classmethod
+    def from_spec(cls, spec, command, default_mem_mb):
+        """Build a job from NAME[:CPUS[:MEM_MB]]."""
+        parts = spec.split(':')
+        name = parts[0]
+        cpus = int(parts[1]) if len(parts) > 1 and parts[1] else None
+        mem_mb = int(parts[2]) if len(parts) > 2 and parts[2] else default_mem_mb
+        return cls(name, command, cpus, mem_mb)
+
+
+class Scheduler(object):
+    """Start jobs as soon as their CPU slots and memory fit into the budget."""
+
+    def __init__(self, cpus, mem_mb, poll_interval=0.5, stop_when=None):
+        self.cpus = cpus
+        self.mem_mb = mem_mb
+        self.poll_interval = poll_interval
+        self.stop_when = stop_when  # Check command of race mode, {name} is the job name
+        self.pending = []
+        self.running = []
+        self.finished = []
+        self.reported = set()
+        self.winner = None
+
+    def add(self, job):
+        position = len(self.pending)
+        while position > 0 and self.pending[position - 1].priority < job.priority:
+            position -= 1
+        self.pending.insert(position, job)
+
+    def assign_slots(self):
+        """Fixed requests first, the rest of the CPUs is shared equally by the other jobs."""
+        fixed = [job for job in self.pending if job.cpus is not None]
+        shared = [job for job in self.pending if job.cpus is None]
+        for job in fixed:
+            # NAME:0 is a job that only waits for something else and stays outside the CPU budget
+            job.slots = max(1, min(job.cpus, self.cpus)) if job.cpus else 0
+        remainder = max(1, self.cpus - sum(job.slots for job in fixed))
+        for job in shared:
+            job.slots = max(1, remainder // len(shared))
+
+    def used(self):
+        cpus = sum(job.slots for job in self.running)
+        mem_mb = sum(job.mem_mb for job in self.running)
+        return cpus, mem_mb
+
+    def fits(self, job):
+        """A job fits if both budgets allow it; an idle scheduler always starts the next job."""
+        if not self.running:
+            return True
+        cpus, mem_mb = self.used()
+        return cpus + job.slots <= self.cpus and mem_mb + job.mem_mb <= self.mem_mb
+
+    def start(self, job):
+        env = dict(os.environ)
+        env['AUTOPD_NPROC'] = str(job.slots)
+        env['AUTOPD_CPUS'] = str(job.slots)
+        env['AUTOPD_MEM_MB'] = str(job.mem_mb or self.mem_mb)
+        env['AUTOPD_JOB_NAME'] = job.name
+        job.process = subprocess.Popen(['bash', '-c', job.command], env=env, start_new_session=True)
+        job.start_time = time.time()
+        self.running.append(job)
+
+    def launch_ready(self):
+        for job in list(self.pending):
+            if self.fits(job):
+                self.pending.remove(job)
+                self.start(job)
+            else:
+                if job.name not in self.reported:
+                    self.reported.add(job.name)
+                    print(f"{job.name} is held back until {job.slots} CPUs and {job.mem_mb} MB are free.", flush=True)
+                break  # Keep the priority and submission order
+
+    def reap(self):
+        for job in list(self.running):
+            returncode = job.process.poll()
+            if returncode is not None:
+                job.returncode = returncode
+                job.end_time = time.time()
+                self.running.remove(job)
+                self.finished.append(job)
+                if returncode == 0 and self.stop_when and self.winner is None and self.passes(job):
+                    self.winner = job
+                    print(f"{job.name} meets the quality thresholds, stopping the other jobs.", flush=True)
+                    self.terminate()
+
+    def passes(self, job):
+        """Run the race check of a finished job."""
+        command = self.stop_when.replace('{name}', job.name)
+        return subprocess.run(['bash', '-c', command]).returncode == 0
+
+    def terminate(self, *_):
+        """Stop every running job including its children, SIGKILL after a grace period."""
+        self.pending = []
+        self.stop(self.running)
+
+    def stop(self, jobs):
+        """Stop some running jobs including their children, SIGKILL after a grace period."""
+        for job in jobs:
+            try:
+                os.killpg(job.process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + KILL_GRACE
+        for job in jobs:
+            try:
+                job.process.wait(timeout=max(0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                try:
+                    os.killpg(job.process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                job.process.wait()
+
+    def run(self):
+        self.assign_slots()
+        while self.pending or self.running:
+            self.launch_ready()
+            self.reap()
+            if self.pending or self.running:
+                time.sleep(self.poll_interval)
+        if self.winner is not None:
+            return 0
+        return 0 if all(job.returncode == 0 for job in self.finished) else 1
+
+
+def run_command(args):
+    if len(args.job) == 0:
+        print("Error: no jobs given")
+        return 1
+    scheduler = Scheduler(args.cpus or available_cpus(), args.mem_mb or available_mem_mb(), stop_when=args.stop_when)
+    for spec, command in args.job:
+        scheduler.add(Job.from_spec(spec, command, args.job_mem))
+    signal.signal(signal.SIGTERM, lambda *_: (scheduler.terminate(), sys.exit(143)))
+    signal.signal(signal.SIGINT, lambda *_: (scheduler.terminate(), sys.exit(130)))
+    returncode = scheduler.run()
+    if scheduler.winner is not None and args.winner:
+        with open(args.winner, 'w', encoding='utf-8') as f:
+            f.write(scheduler.winner.name + '\n')
+    return returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CPU/memory-budgeted job launcher for AutoPD')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run jobs under a CPU and memory budget')
+    run_parser.add_argument('--cpus', type=int, default=None, help='CPU budget (default: AUTOPD_CPUS or all CPUs)')
+    run_parser.add_argument('--mem-mb', type=int, default=None, help='Memory budget in MB (default: AUTOPD_MEM_MB or MemAvailable)')
+    run_parser.add_argument('--job-mem', type=int, default=0, help='Default memory estimate of a job in MB')
+    run_parser.add_argument('--job', nargs=2, action='append', default=[], metavar=('NAME[:CPUS[:MEM_MB]]', 'COMMAND'),
+                            help='Job to run; may be repeated')
+    run_parser.add_argument('--stop-when', default=None,
+                            help='Race mode: check command run for every successful job, {name} is the job name')
+    run_parser.add_argument('--winner', default=None, help='Race mode: file receiving the name of the winning job')
+
+    estimate_parser = subparsers.add_parser('estimate', help='Estimate the memory of a reduction pipeline in MB')
+    estimate_parser.add_argument('header_json', help='header.json written by header.sh')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        sys.exit(run_command(args))
+    print(estimate_job_mem_mb(args.header_json))
+
+
+if __name__ == '__main__':
+    main()
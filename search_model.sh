@@ -9,8 +9,11 @@
 #   2. Runs MrParse to identify homologous models from sequence input.
 #   3. Runs AlphaFold predictions (via Phenix) when no UniProt ID is provided.
 #   4. Processes and filters models based on sequence identity, length ratio,
-#      and pLDDT scores to prepare ensembles for MR.
+#      and pLDDT scores to prepare ensembles for MR (trimming and domain splitting
+#      with process_predicted.py, Phenix/CCP4i2 as fallback).
 #   5. Outputs processed models into SEARCH_MODELS directories for later use.
+#   6. Keeps the final ensembles in the model cache (model_cache.py); a later run of the same sequence and
+#      options restores them and skips steps 1-4.
 #
 # Usage:
 #   ./search_model.sh <date_cutoff>
@@ -29,6 +32,9 @@
 #   AF_SPLIT       Whether to split AF models by chain/domain (true/false)
 #   PAE_SPLIT      Whether to split models using PAE matrix (true/false)
 #   DATE           Date cutoff for homolog selection
+#   MRPARSE_JOBS   Concurrent MrParse jobs, one per chain (default: 4)
+#   AUTOPD_CACHE   Root of the local PDB entry and search model caches (default ~/.cache/autopd)
+#   MODEL_CACHE    Whether to use the search model cache (true/false, default: true)
 #
 # Author: ZHANG Xin
 # Created: 2023-06-01
@@ -39,6 +45,15 @@ start_time=$(date +%s)
 
 # Input variable: date filter for homolog selection
 DATE=${1}
+export DATE
+
+# ==============================================================================================
+# Search models of a sequence seen before with the same options (model_cache.py)
+# ==============================================================================================
+if [ "${MODEL_CACHE:-true}" = "true" ] && python3 ${SOURCE_DIR}/model_cache.py restore SEARCH_MODELS; then
+    echo "MrParse and AlphaFold Prediction will be skipped."
+    exit 0
+fi
 
 # ==============================================================================================
 # Case 1: UniProt ID is provided -> download AlphaFold DB models instead of running MrParse
@@ -60,9 +75,14 @@ if [[ -n "$UNIPROT_ID" ]]; then
       plddt_cutoff=40
     fi
     
-    # Process AlphaFold model
-    phenix.process_predicted_model *.pdb b_value_field_is=plddt minimum_plddt=$plddt_cutoff > ProcessPredictedModel.log
+    # Process AlphaFold model (trim, convert pLDDT to B, split into domains); Phenix if that fails
+    if ! python3 ${SOURCE_DIR}/process_predicted.py *.pdb --b_value_field_is plddt --minimum_plddt $plddt_cutoff > ProcessPredictedModel.log; then
+      ${AUTOPD_PROFILE} phenix.process_predicted_model *.pdb b_value_field_is=plddt minimum_plddt=$plddt_cutoff > ProcessPredictedModel.log
+    fi
     cp *_processed_*.pdb ../SEARCH_MODELS/AF_MODELS/
+    if [ "${MODEL_CACHE:-true}" = "true" ]; then
+      python3 ${SOURCE_DIR}/model_cache.py store ../SEARCH_MODELS
+    fi
     
     echo "UniProt ID was provided. MrParse and AlphaFold Prediction will be skipped."
     cd ..
@@ -95,10 +115,34 @@ echo ""
 echo "Sequence count: ${seq_count}"
 cd ..
 
-# Run MrParse for homologous model search (unless disabled)
+# Run MrParse for homologous model search (unless disabled), one job per chain, at most MRPARSE_JOBS at a
+# time. Each job runs in its own directory, so that its mrparse_0 becomes mrparse_<i> of sequence i.
+run_mrparse() {
+  local i=$1
+  local file=$2
+  rm -rf mrparse_run_${i} mrparse_${i}
+  mkdir -p mrparse_run_${i}
+  cd mrparse_run_${i}
+  ${AUTOPD_PROFILE} mrparse --seqin "../$file" --max_hits 5 --ccp4cloud > mrparse.log
+  cd ..
+  if [ -d mrparse_run_${i}/mrparse_0 ]; then
+    mv mrparse_run_${i}/mrparse_0 mrparse_${i}
+  fi
+}
+
 if [ "$AF_PREDICT" != "true" ];then
-  find SEQ_FILES -type f | while IFS= read -r file; do
-    mrparse --seqin "$file" --max_hits 5 --ccp4cloud >> mrparse.log
+  i=0
+  while IFS= read -r file; do
+    while [ $(jobs -rp | wc -l) -ge ${MRPARSE_JOBS:-4} ]; do
+      wait -n
+    done
+    run_mrparse $i "$file" &
+    i=$((i+1))
+  done < <(find SEQ_FILES -type f)
+  wait
+  for ((j=0; j<i; j++)); do
+    cat mrparse_run_${j}/mrparse.log >> mrparse.log 2>/dev/null
+    rm -rf mrparse_run_${j}
   done
 fi
 
@@ -116,7 +160,7 @@ process_af_prediction() {
   seq_file=$(find ../SEQ_FILES -type f | awk "NR==$(($i+1))")
   
   # Run AlphaFold prediction
-  phenix.predict_and_build seq_file=$seq_file prediction_server=PhenixServer stop_after_predict=True include_templates_from_pdb=False > PredictAndBuild.log
+  ${AUTOPD_PROFILE} phenix.predict_and_build seq_file=$seq_file prediction_server=PhenixServer stop_after_predict=True include_templates_from_pdb=False > PredictAndBuild.log
 }
 
 for i in $(seq 0 $((${seq_count}-1))); do
@@ -130,137 +174,51 @@ cd ${dir}
 # ==============================================================================================
 process_models() {
   local i=$1
-  
-# ------------------------
-# Process homolog models
-# ------------------------
-if [ "$AF_PREDICT" != "true" ];then
-  cd ${dir}/mrparse_${i}
-  seq_length=$(grep -m1 'L=' mrparse.log | grep -oP '(?<=L=)\d+')
-  if [ ! -d "homologs" ] || [ -z "$(ls -A homologs)" ]; then
-    echo "Sequence $((i+1))    No homologs were found."
-  else
-    if ! grep -qE '^\s*\[\s*\]\s*$' homologs.json; then
-      # The homologs.json is not empty
-      python3 ${SOURCE_DIR}/json_to_table.py homologs.json ${DATE}
-    else
-      # The homologs.json is empty
-      for file in "homologs"/*; do
-        if [ -f "$file" ]; then
-          # There are homologs
-          if grep -q "ATOM" "$file"; then
-            # There are atoms in the homologs file
-            filename=$(basename -- "$file")
-            filename="${filename%_*}"
 
-            seq_id=$(head -n 1 "$file" | awk '{print $NF}')
-            seq_id=$(echo "scale=2; $seq_id / 100" | bc)
-
-            echo -e "${filename}\t${seq_id}" >> homologs.txt
-          else
-            rm "$file"
-          fi
-        fi
-      done
-    fi
-    if [ -f "homologs.txt" ]; then
-      sort -k2,2nr -k6r,6 homologs.txt -o homologs.txt
-      model_name_h=$(awk 'NR==1 {print $1}' homologs.txt)
-      seq_id_h=$(awk 'NR==1 {print $2}' homologs.txt)
-      file_name_h=$(echo homologs/${model_name_h}* | cut -d ' ' -f 1)
-      model_length_h=$(awk 'NR==1 {print $5}' homologs.txt)
-      length_ratio_h=$(echo "scale=2; $model_length_h / $seq_length" | bc)
-      model_date=$(awk 'NR==1 {print $6}' homologs.txt)
-      echo "Sequence $((i+1))    Homologous Model: $model_name_h model_length=$model_length_h seq_id=$seq_id_h model_date=$model_date"
-      if (( $(echo "$length_ratio_h >= 0.3" | bc -l) )); then
-        if [ ! -f "$file_name_h" ]; then
-          model_id=$(echo "$model_name_h" | cut -c1-4)
-          chain_id=$(echo "$model_name_h" | cut -c6)
-          phenix.fetch_pdb $model_id 
-          mv $model_id.pdb pdb_files
-          awk -v chain="$chain_id" '{if (substr($0, 22, 1) == chain) print}' pdb_files/$model_id.pdb > homologs/${model_id}_${chain_id}.pdb
-        fi      
-        if grep -q "ATOM" $file_name_h; then
-          echo "Sequence $((i+1))    Homologous model will be used in MR." 
-          cp ${file_name_h} "../../SEARCH_MODELS/HOMOLOGS/ENSEMBLE$((i+1)).pdb"
-        else
-          echo "Sequence $((i+1))    No atoms in homologous model."
-        fi
-      else
-        echo "Sequence $((i+1))    Homologous model is too short for MR."
-      fi
-    fi
-  fi
-  
-  if [ -d "models" ] && [ -n "$(ls -A models)" ] && [ -f af_models.json ]; then
-    python3 ${SOURCE_DIR}/json_to_table.py af_models.json
-    sort -k2,2nr -k7,7nr af_models.txt -o af_models.txt
-    model_name_afdb=$(awk 'NR==1 {print $1}' af_models.txt)
-    model_length_afdb=$(awk 'NR==1 {print $5}' af_models.txt)
-    length_ratio_afdb=$(echo "scale=2; $model_length_afdb / $seq_length" | bc)
-    file_name_afdb=$(echo models/${model_name_afdb}_* | cut -d ' ' -f 1)
-    if grep -q "ATOM" "$file_name_afdb" 2>/dev/null; then
-      seq_id_afdb=$(awk 'NR==1 {print $2}' af_models.txt)
-      plddt_afdb=$(awk 'NR==1 {print $7}' af_models.txt)
-      echo "Sequence $((i+1))    AlphaFold Database Model: $model_name_afdb model_length=$model_length_afdb seq_id=$seq_id_afdb plddt=$plddt_afdb"
-    else
-      echo "Sequence $((i+1))    No AlphaFold Database models were found."
-      afdb=0
-      seq_id_afdb=0
-    fi
-  else
-    echo "Sequence $((i+1))    No AlphaFold Database models were found."
-    afdb=0
-    plddt_afdb=0
-    seq_id_afdb=0
-  fi
-  cd ..
-fi
+  # Rank homologs and AlphaFold DB models, copy the selected ones and decide between the AlphaFold DB model
+  # and the prediction (rank_models.py, decision in ranking_<i>.json)
+  cd ${dir}
+  python3 ${SOURCE_DIR}/rank_models.py select ${i} --date "${DATE}" --json ranking_${i}.json
+  decision=$(python3 ${SOURCE_DIR}/rank_models.py get ranking_${i}.json decision)
+  plddt_afp=$(python3 ${SOURCE_DIR}/rank_models.py get ranking_${i}.json prediction.plddt)
+  plddt_cutoff=$(python3 ${SOURCE_DIR}/rank_models.py get ranking_${i}.json prediction.plddt_cutoff)
 
   # ------------------------
   # Process AlphaFold predictions
   # ------------------------
   cd predict_${i}
-    plddt_afp=$(awk -F= '/plDDT =/ {gsub(/[[:space:]]/, "", $2); last=$2} END{print last}' PredictAndBuild.log)
-    if ! find "PredictAndBuild_0_CarryOn" -mindepth 1 -maxdepth 1 | read -r; then
-      echo "AlphaFold Prediction failed."
-      if [[ $afdb != 0 ]]; then
-        python3 ${SOURCE_DIR}/calc_vrms.py ../mrparse_${i}/AF2_files/${model_name_afdb}* ../mrparse_${i}/${file_name_afdb}
-        cp ../mrparse_${i}/${file_name_afdb} ../../SEARCH_MODELS/AF_MODELS/AF_DB$((i+1)).pdb
-      fi
-    elif [ "$AF_PREDICT" != "true" ] && [ "$PAE_SPLIT" != "true" ] && [ "$(echo "$seq_id_afdb >= 0.85" | bc -l)" -eq 1 ] && [ "$(echo "$plddt_afdb > $plddt_afp" | bc -l)" -eq 1 ] && [ "$(echo "$length_ratio_afdb >= 0.6" | bc -l)" -eq 1 ] ; then
-      echo "Sequence $((i+1))    AlphaFold Prediction Model: plddt=$plddt_afp "
-      echo "Sequence $((i+1))    AlphaFold Database model will be used in MR." 
-      python3 ${SOURCE_DIR}/calc_vrms.py ../mrparse_${i}/AF2_files/${model_name_afdb}* ../mrparse_${i}/${file_name_afdb}
-      cp ../mrparse_${i}/${file_name_afdb} ../../SEARCH_MODELS/AF_MODELS/AF_DB$((i+1)).pdb
-    else
+    if [ "${decision}" = "prediction" ]; then
       # Prediction is successful. Process this predicted model.
       if [ "$PAE_SPLIT" = "true" ]; then
-        i2run editbfac \
-	  --XYZIN PredictAndBuild_0_CarryOn/PredictAndBuild_0_rebuilt.pdb \
-	  --PAEIN pae_matrix.jsn \
-	  --noDb >log.txt
-        mv log.txt ProcessPredictedModel.log
-        model_length_afp=$(grep -m 1 "Total residues in final model:" ProcessPredictedModel.log | awk '{print $6}')
+        # Domains from the PAE matrix with process_predicted.py; CCP4i2 editbfac if that fails
+        if python3 ${SOURCE_DIR}/process_predicted.py PredictAndBuild_0_CarryOn/PredictAndBuild_0_rebuilt.pdb \
+            --pae pae_matrix.jsn --prefix converted_model_chain > ProcessPredictedModel.log; then
+          converted_models=(converted_model_chain_*.pdb)
+        else
+          ${AUTOPD_PROFILE} i2run editbfac \
+	    --XYZIN PredictAndBuild_0_CarryOn/PredictAndBuild_0_rebuilt.pdb \
+	    --PAEIN pae_matrix.jsn \
+	    --noDb >log.txt
+          mv log.txt ProcessPredictedModel.log
+          converted_models=(converted_model_chain*.pdb)
+        fi
+        model_length_afp=$(grep -m 1 -e "Total residues in final model:" -e "Final residues:" ProcessPredictedModel.log | awk '{print $NF}')
         echo "Sequence $((i+1))    AlphaFold Prediction Model: model_length=$model_length_afp plddt=$plddt_afp "
         echo "Sequence $((i+1))    AlphaFold Prediction model will be used in MR."
-        python3 ${SOURCE_DIR}/calc_vrms.py PredictAndBuild_0_CarryOn/PredictAndBuild_0_rebuilt.pdb "converted_model_chain*.pdb"
-        for file in converted_model_chain*.pdb; do
+        for file in "${converted_models[@]}"; do
           base=$(basename "$file" .pdb)
           cp "$file" "../../SEARCH_MODELS/AF_MODELS/${base}_${i}.pdb"
+          echo "$(pwd)/PredictAndBuild_0_CarryOn/PredictAndBuild_0_rebuilt.pdb $(readlink -f ../../SEARCH_MODELS/AF_MODELS/${base}_${i}.pdb)" >> ${dir}/VRMS_TARGETS.txt
         done
       else
-        if (( $(echo "${plddt_afp:-0} >= 60" | bc) )); then
-          plddt_cutoff=60
-        else
-          plddt_cutoff=40
+        if ! python3 ${SOURCE_DIR}/process_predicted.py PredictAndBuild_0_CarryOn/PredictAndBuild_0_rebuilt.pdb \
+            --b_value_field_is plddt --minimum_plddt $plddt_cutoff > ProcessPredictedModel.log; then
+          ${AUTOPD_PROFILE} phenix.process_predicted_model PredictAndBuild_0_CarryOn/PredictAndBuild_0_rebuilt.pdb b_value_field_is=*plddt minimum_plddt=$plddt_cutoff > ProcessPredictedModel.log
         fi
-        phenix.process_predicted_model PredictAndBuild_0_CarryOn/PredictAndBuild_0_rebuilt.pdb b_value_field_is=*plddt minimum_plddt=$plddt_cutoff > ProcessPredictedModel.log
         if [ -f "PredictAndBuild_0_rebuilt_processed.pdb" ]; then
           model_length_afp=$(grep -m 1 "Final residues:" ProcessPredictedModel.log | awk '{print $3}')
           echo "Sequence $((i+1))    AlphaFold Prediction Model: model_length=$model_length_afp plddt=$plddt_afp "
           echo "Sequence $((i+1))    AlphaFold Prediction model will be used in MR." 
-          python3 ${SOURCE_DIR}/calc_vrms.py PredictAndBuild_0_CarryOn/PredictAndBuild_0_rebuilt.pdb "PredictAndBuild_0_rebuilt_processed*"
           if [ "$AF_SPLIT" = "false" ]; then
             cp PredictAndBuild_0_rebuilt_processed.pdb "../../SEARCH_MODELS/AF_MODELS/PredictAndBuild_0_rebuilt_processed_${i}.pdb"
           else
@@ -269,6 +227,7 @@ fi
               cp "$file" "../../SEARCH_MODELS/AF_MODELS/${base}_${i}.pdb"
             done
           fi
+          echo "$(pwd)/PredictAndBuild_0_CarryOn/PredictAndBuild_0_rebuilt.pdb $(readlink -f ../../SEARCH_MODELS/AF_MODELS)/PredictAndBuild_0_rebuilt_processed*_${i}.pdb" >> ${dir}/VRMS_TARGETS.txt
         fi
       fi
     fi
@@ -276,12 +235,18 @@ fi
 
 export -f process_models
 
+rm -f VRMS_TARGETS.txt
 for i in $(seq 0 $((${seq_count}-1))); do
   process_models $i &
 done
 wait
 cd ${dir}
 
+# VRMS remarks (first line, read by phaser.sh) of all AlphaFold search models in one pass
+if [ -s VRMS_TARGETS.txt ]; then
+  python3 ${SOURCE_DIR}/model_stats.py vrms --batch VRMS_TARGETS.txt
+fi
+
 # Ensure AF models backfill homolog slots if needed
 if [ -d "../SEARCH_MODELS/HOMOLOGS" ] && [ "$(ls -A ../SEARCH_MODELS/HOMOLOGS)" ]; then
   for i in $(seq 0 $((${seq_count}-1))); do
@@ -291,6 +256,11 @@ if [ -d "../SEARCH_MODELS/HOMOLOGS" ] && [ "$(ls -A ../SEARCH_MODELS/HOMOLOGS)"
   done
 fi
 
+# Keep the final ensembles for later runs of this sequence
+if [ "${MODEL_CACHE:-true}" = "true" ]; then
+  python3 ${SOURCE_DIR}/model_cache.py store ../SEARCH_MODELS --ranking .
+fi
+
 # ==============================================================================================
 # Timing summary
 # ==============================================================================================
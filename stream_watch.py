@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: stream_watch.py
+# Description: "Process while collecting" support. Watches DATA_PATH while the detector is still writing
+#              frames (inotify, or polling where inotify is not available) and
+#                wait       returns once the first wedge of frames is on disk (spot finding and indexing)
+#                complete   returns once the sweep is complete (expected number of frames, or no new frame
+#                           for --idle seconds)
+#                integrate  runs XDS INTEGRATE in chunks as the frames land (in the XDS directory, after
+#                           DEFPIX) and merges the chunks into INTEGRATE.HKL when the last frame is there,
+#                           with DATA_RANGE of XDS.INP set to the complete sweep for CORRECT
+#              A frame counts once it is closed by the writer (inotify) or its size has not changed for
+#              SETTLE_SECONDS (polling).
+#
+# Usage:
+#   python3 stream_watch.py wait DATA_PATH [--frames 100] [--timeout 3600]
+#   python3 stream_watch.py complete DATA_PATH [--frames 3600] [--idle 60]
+#   python3 stream_watch.py integrate [--frames 3600] [--idle 60] [--chunk 300] [--processors 32]
+#
+# Exit Codes:
+#   0  Frames available / sweep complete / sweep integrated
+#   1  Timeout, or an INTEGRATE chunk failed
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import re
+import select
+import shutil
+import signal
+import struct
+import sys
+import time
+
+from xds_integrate import JOBS_DIR, IntegrateJob, merge_hkl, merge_lp, read_keyword, set_keyword
+
+# inotify events of a file that is complete
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+EVENT_HEADER = struct.Struct('iIII')
+# Seconds a file size must be stable to count as written (polling)
+SETTLE_SECONDS = 2.0
+POLL_INTERVAL = 1.0
+# Compression suffixes of frames
+COMPRESSED = ('.bz2', '.gz', '.xz')
+# Frame number: last group of digits of the file name (before the extension)
+FRAME_NUMBER = re.compile(r'(\d+)(?:\.[A-Za-z0-9]+)?$')
+
+
+def frame_number(name):
+    """Frame number of an image file name, None for files that are not frames."""
+    if name.startswith('.'):
+        return None
+    for suffix in COMPRESSED:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    match = FRAME_NUMBER.search(name)
+    return int(match.group(1)) if match else None
+
+
+def template_matcher(template):
+    """Frame number from an XDS NAME_TEMPLATE_OF_DATA_FRAMES (img_?????.cbf)."""
+    base = os.path.basename(template)
+    parts = re.split(r'(\?+)', base)
+    pattern = re.compile('^' + ''.join(r'(\d{%d})' % len(part) if part.startswith('?') else re.escape(part)
+                                       for part in parts) + r'(?:\.bz2|\.gz|\.xz)?$')
+
+    def match(name):
+        found = pattern.match(name)
+        return int(found.group(1)) if found else None
+    return match
+
+
+class Inotify(object):
+    """Minimal inotify through libc; None if not available (other OS, no permission, network file system)."""
+
+    @classmethod
+    def open(cls, directory):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            if libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+                os.close(fd)
+                return None
+        except (OSError, AttributeError):
+            return None
+        watcher = cls()
+        watcher.fd = fd
+        return watcher
+
+    def read(self, timeout):
+        """Names of the files closed or moved in within timeout seconds."""
+        names = []
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return names
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return names
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FrameWatcher(object):
+    """Frames of DATA_PATH that are completely written, updated by inotify or polling."""
+
+    def __init__(self, directory, matcher=frame_number):
+        self.directory = directory
+        self.matcher = matcher
+        self.frames = set()
+        self.last_new = time.time()
+        self.sizes = {}
+        self.inotify = Inotify.open(directory)
+        self.scan(initial=True)
+
+    def add(self, number):
+        if number not in self.frames:
+            self.frames.add(number)
+            self.last_new = time.time()
+
+    def scan(self, initial=False):
+        """Directory listing; files whose size is stable for SETTLE_SECONDS are complete."""
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            number = self.matcher(entry.name)
+            if number is None or number in self.frames or not entry.is_file():
+                continue
+            stat = entry.stat()
+            previous = self.sizes.get(entry.name)
+            if now - stat.st_mtime >= SETTLE_SECONDS or (previous and previous[0] == stat.st_size
+                                                         and now - previous[1] >= SETTLE_SECONDS):
+                self.add(number)
+            elif not previous or previous[0] != stat.st_size:
+                self.sizes[entry.name] = (stat.st_size, now)
+        if initial:
+            self.last_new = now
+
+    def update(self, timeout=POLL_INTERVAL):
+        if self.inotify:
+            for name in self.inotify.read(timeout):
+                number = self.matcher(name)
+                if number is not None:
+                    self.add(number)
+            # Files written before the watch started, or missed by inotify
+            if time.time() - self.last_new > SETTLE_SECONDS:
+                self.scan()
+        else:
+            time.sleep(timeout)
+            self.scan()
+
+    def contiguous(self):
+        """(first, last) of the frames present without gaps from the first one, None if there are none."""
+        if not self.frames:
+            return None
+        first = min(self.frames)
+        last = first
+        while last + 1 in self.frames:
+            last += 1
+        return first, last
+
+    def has_master(self):
+        return any(name.endswith('master.h5') for name in os.listdir(self.directory))
+
+    def complete(self, frames, idle):
+        """Expected number of frames reached, or no new frame for idle seconds."""
+        available = self.contiguous()
+        if frames and available and available[1] - available[0] + 1 >= frames:
+            return True
+        return bool(self.frames) and time.time() - self.last_new >= idle
+
+
+def wait_frames(args):
+    watcher = FrameWatcher(args.data_path)
+    deadline = time.time() + args.timeout
+    while True:
+        available = watcher.contiguous()
+        if watcher.has_master() or (available and available[1] - available[0] + 1 >= args.frames):
+            break
+        if watcher.complete(None, args.idle):
+            # Short sweep: fewer frames than the wedge
+            break
+        if time.time() > deadline:
+            print(f"Timeout: fewer than {args.frames} frames in {args.data_path} after {args.timeout} s")
+            return 1
+        watcher.update()
+    print(f"Stream: {len(watcher.frames)} frames in {args.data_path}")
+    return 0
+
+
+def wait_complete(args):
+    watcher = FrameWatcher(args.data_path)
+    while not watcher.complete(args.frames, args.idle):
+        watcher.update()
+    available = watcher.contiguous()
+    if available:
+        print(f"Stream: sweep complete, images {available[0]} - {available[1]}")
+    return 0
+
+
+def integrate_stream(args):
+    """INTEGRATE chunks of at least --chunk frames as they land; merge after the last frame."""
+    with open('XDS.INP', 'r', encoding='utf-8', errors='ignore') as f:
+        xds_inp = f.read().splitlines()
+    template = read_keyword(xds_inp, 'NAME_TEMPLATE_OF_DATA_FRAMES')
+    if not template:
+        print("Error: NAME_TEMPLATE_OF_DATA_FRAMES not found in XDS.INP")
+        return 1
+    first = int(read_keyword(xds_inp, 'DATA_RANGE')[0])
+    watcher = FrameWatcher(os.path.dirname(template[0]), template_matcher(template[0]))
+
+    jobs = []
+    integrated = first - 1
+    running = None
+
+    def stop(signum, _frame):
+        # timeout or scheduler.py stopping the pipeline
+        if running and running.process.poll() is None:
+            try:
+                os.killpg(running.process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(128 + signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    shutil.rmtree(JOBS_DIR, ignore_errors=True)
+    while True:
+        complete = watcher.complete(args.frames, args.idle)
+        available = watcher.contiguous()
+        last = available[1] if available else integrated
+        if args.frames:
+            last = min(last, first + args.frames - 1)
+
+        if running and running.process.poll() is not None:
+            if not running.succeeded():
+                print(f"{running.name} failed, see {os.path.join(running.directory, 'INTEGRATE.log')}")
+                return 1
+            running = None
+        if running is None and last > integrated and (last - integrated >= args.chunk or complete):
+            job = IntegrateJob(len(jobs), (integrated + 1, last))
+            job.prepare(xds_inp, args.processors)
+            job.start(None)
+            print(f"{job.name}: images {job.image_range[0]} - {job.image_range[1]}", flush=True)
+            jobs.append(job)
+            running = job
+            integrated = last
+        if running is None and complete and integrated >= last:
+            break
+        watcher.update()
+
+    data_range = (first, integrated)
+    merge_hkl(jobs, data_range)
+    merge_lp(jobs)
+    # CORRECT and the later steps use the complete sweep
+    xds_inp = set_keyword(xds_inp, 'DATA_RANGE', f"{data_range[0]} {data_range[1]}")
+    with open('XDS.INP', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(xds_inp) + '\n')
+    print(f"INTEGRATE.HKL merged from {len(jobs)} chunks, images {data_range[0]} - {data_range[1]}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch a data directory while frames are being collected')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    wait_parser = subparsers.add_parser('wait', help='Wait for the first wedge of frames')
+    wait_parser.add_argument('data_path', help='Directory the frames are written to')
+    wait_parser.add_argument('--frames', type=int, default=100, help='Frames of the first wedge')
+    wait_parser.add_argument('--idle', type=float, default=60, help='Seconds without new frames that end the sweep')
+    wait_parser.add_argument('--timeout', type=float, default=24 * 3600, help='Give up after this many seconds')
+
+    complete_parser = subparsers.add_parser('complete', help='Wait until the sweep is complete')
+    complete_parser.add_argument('data_path', help='Directory the frames are written to')
+    complete_parser.add_argument('--frames', type=int, default=None, help='Expected number of frames')
+    complete_parser.add_argument('--idle', type=float, default=60, help='Seconds without new frames that end the sweep')
+
+    integrate_parser = subparsers.add_parser('integrate', help='Integrate chunks while frames land (XDS directory)')
+    integrate_parser.add_argument('--frames', type=int, default=None, help='Expected number of frames')
+    integrate_parser.add_argument('--idle', type=float, default=60, help='Seconds without new frames that end the sweep')
+    integrate_parser.add_argument('--chunk', type=int, default=300, help='Fewest new frames per INTEGRATE chunk')
+    integrate_parser.add_argument('--processors', type=int, default=None, help='CPUs of an INTEGRATE chunk')
+
+    args = parser.parse_args()
+    if args.command == 'wait':
+        sys.exit(wait_frames(args))
+    elif args.command == 'complete':
+        sys.exit(wait_complete(args))
+    sys.exit(integrate_stream(args))
+
+
+if __name__ == '__main__':
+    main()
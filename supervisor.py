@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: supervisor.py
+# Description: Event-driven supervisor of one external program (xia2, the Phaser queue, a whole stage). The
+#              command runs in its own process group and is watched with asyncio: its exit, failure marker
+#              files (inotify on their directories, polling where inotify is not available), a wall-clock
+#              limit and a memory limit on the resident memory of the whole process tree. On a marker, a
+#              limit or SIGTERM/SIGINT the process groups of the tree get SIGTERM and, after a grace period,
+#              SIGKILL, so the cores of a failed job are free right away.
+#
+# Usage:
+#   python3 supervisor.py run [--timeout 10h] [--mem-mb M] [--fail-on xia2-error.txt ...] [--name NAME]
+#                             [--grace 10] -- command [args ...]
+#
+# Example:
+#   python3 supervisor.py run --timeout 36000 --fail-on xia2-error.txt -- xia2 pipeline=dials /data/images
+#
+# Durations: seconds, or a number with s, m, h or d (e.g. 600h).
+#
+# Exit Codes:
+#   Exit code of the command (128+N if it was killed by signal N), or
+#   123  Memory limit exceeded
+#   124  Wall-clock limit exceeded (like timeout)
+#   125  Failure marker appeared
+#   130/143 Supervisor interrupted (SIGINT/SIGTERM)
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import asyncio
+import ctypes
+import os
+import re
+import signal
+import sys
+import time
+
+EXIT_MEMORY = 123
+EXIT_TIMEOUT = 124
+EXIT_MARKER = 125
+# Seconds between memory checks, and between marker checks without inotify
+MEMORY_INTERVAL = 1.0
+POLL_INTERVAL = 0.5
+PR_SET_PDEATHSIG = 1
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+try:
+    libc = ctypes.CDLL(None, use_errno=True)
+except OSError:
+    libc = None
+
+
+def parse_duration(value):
+    """Seconds from 3600, 30m, 10h or 2d."""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*', str(value))
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value}")
+    return float(match.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+
+
+def die_with_parent():
+    """Child side: SIGKILL if the supervisor itself is killed (SIGKILL cannot be forwarded)."""
+    if libc is not None:
+        libc.prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+
+
+def process_table():
+    """pid -> (ppid, pgid, rss in kB) of all processes."""
+    table = {}
+    page_kb = os.sysconf('SC_PAGE_SIZE') // 1024
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces and parentheses: fields start after the last ')'
+        fields = stat[stat.rfind(')') + 2:].split()
+        table[int(name)] = (int(fields[1]), int(fields[2]), int(fields[21]) * page_kb)
+    return table
+
+
+def descendants(root, table):
+    """pids of root and all its descendants, whatever their session or process group."""
+    children = {}
+    for pid, (ppid, _, _) in table.items():
+        children.setdefault(ppid, []).append(pid)
+    tree = []
+    stack = [root]
+    while stack:
+        pid = stack.pop()
+        if pid in table:
+            tree.append(pid)
+        stack.extend(children.get(pid, []))
+    return tree
+
+
+def tree_rss_mb(root):
+    table = process_table()
+    return sum(table[pid][2] for pid in descendants(root, table)) / 1024
+
+
+class MarkerWatch(object):
+    """Wakes up when one of the marker files exists: inotify on their directories, else polling."""
+
+    def __init__(self, paths, loop):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.fd = None
+        self.polled = list(self.paths)
+        if not self.paths or libc is None or not hasattr(libc, 'inotify_init1'):
+            return
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return
+        self.fd = fd
+        self.polled = []
+        for path in self.paths:
+            directory = os.path.dirname(path)
+            if libc.inotify_add_watch(fd, directory.encode(), IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE) < 0:
+                self.polled.append(path)
+        loop.add_reader(fd, self.on_event)
+
+    def on_event(self):
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self.event.set()
+
+    def found(self):
+        for path in self.paths:
+            if os.path.exists(path):
+                return path
+        return None
+
+    async def wait(self):
+        while True:
+            path = self.found()
+            if path:
+                return path
+            self.event.clear()
+            if self.polled or self.fd is None:
+                try:
+                    await asyncio.wait_for(self.event.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self.event.wait()
+
+    def close(self):
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+
+async def watch_memory(pid, mem_mb):
+    while True:
+        await asyncio.sleep(MEMORY_INTERVAL)
+        rss_mb = tree_rss_mb(pid)
+        if rss_mb > mem_mb:
+            return rss_mb
+
+
+def signal_groups(groups, sig):
+    for group in groups:
+        try:
+            os.killpg(group, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+async def terminate_tree(process, grace):
+    """SIGTERM to every process group of the tree, SIGKILL to what is left of them after the grace period."""
+    table = process_table()
+    groups = {table[pid][1] for pid in descendants(process.pid, table)} - {os.getpgrp()}
+    signal_groups(groups, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), grace)
+    except asyncio.TimeoutError:
+        pass
+    signal_groups(groups, signal.SIGKILL)
+    await process.wait()
+
+
+async def supervise(command, timeout=None, mem_mb=None, fail_on=(), name=None, grace=10):
+    loop = asyncio.get_running_loop()
+    name = name or os.path.basename(command[0])
+    process = await asyncio.create_subprocess_exec(*command, start_new_session=True, preexec_fn=die_with_parent)
+    start = time.time()
+
+    interrupted = asyncio.Event()
+    received = []
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, lambda sig=sig: (received.append(sig), interrupted.set()))
+
+    markers = MarkerWatch(fail_on, loop)
+    watchers = {asyncio.ensure_future(process.wait()): 'exit',
+                asyncio.ensure_future(interrupted.wait()): 'signal'}
+    if fail_on:
+        watchers[asyncio.ensure_future(markers.wait())] = 'marker'
+    if mem_mb:
+        watchers[asyncio.ensure_future(watch_memory(process.pid, mem_mb))] = 'memory'
+
+    done, pending = await asyncio.wait(watchers, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    markers.close()
+    reasons = {watchers[task]: task for task in done}
+
+    if 'exit' in reasons:
+        returncode = process.returncode
+        return 128 - returncode if returncode < 0 else returncode
+
+    elapsed = int(time.time() - start)
+    if 'marker' in reasons:
+        print(f"{name}: failure marker {reasons['marker'].result()} after {elapsed} s, stopping", flush=True)
+        returncode = EXIT_MARKER
+    elif 'memory' in reasons:
+        print(f"{name}: {reasons['memory'].result():.0f} MB exceed the memory limit of {mem_mb} MB, stopping",
+              flush=True)
+        returncode = EXIT_MEMORY
+    elif 'signal' in reasons:
+        returncode = 128 + received[0]
+    else:
+        print(f"{name}: wall-clock limit of {int(timeout)} s exceeded, stopping", flush=True)
+        returncode = EXIT_TIMEOUT
+    await terminate_tree(process, grace)
+    return returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a command under failure markers and resource limits')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run and supervise a command')
+    run_parser.add_argument('--timeout', type=parse_duration, default=None, help='Wall-clock limit (e.g. 10h)')
+    run_parser.add_argument('--mem-mb', type=int, default=None, help='Limit on the resident memory of the tree')
+    run_parser.add_argument('--fail-on', action='append', default=[], metavar='FILE',
+                            help='File whose appearance means failure; may be repeated')
+    run_parser.add_argument('--name', default=None, help='Name used in messages (default: program name)')
+    run_parser.add_argument('--grace', type=float, default=10, help='Seconds between SIGTERM and SIGKILL')
+    run_parser.add_argument('argv', nargs=argparse.REMAINDER, help='-- command [args ...]')
+
+    args = parser.parse_args()
+    argv = args.argv[1:] if args.argv[:1] == ['--'] else args.argv
+    if not argv:
+        parser.error('no command given')
+    try:
+        returncode = asyncio.run(supervise(argv, args.timeout, args.mem_mb, args.fail_on, args.name, args.grace))
+    except (FileNotFoundError, PermissionError) as error:
+        print(f"{argv[0]}: {error}", file=sys.stderr)
+        returncode = 127 if isinstance(error, FileNotFoundError) else 126
+    sys.exit(returncode)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: tool_profile.py
+# Description: Per-invocation profiling of the external programs started by AutoPD (xds, xds_par, aimless,
+#              pointless, ctruncate, phaser, i2run, crank2, phenix.*, xia2, ...). Every call prefixed with
+#              ${AUTOPD_PROFILE} is run through "tool_profile.py run", which appends one JSON line with wall
+#              time, user/sys CPU, peak RSS, exit status, stage and calling script to AUTOPD_PROFILE_LOG.
+#              "tool_profile.py summary" shows where the hours went: CPU utilisation per stage, the most
+#              expensive tools and the critical path of the run.
+#
+# Usage:
+#   python3 tool_profile.py run -- <program> [arguments ...]
+#   python3 tool_profile.py summary SUMMARY/PROFILE.jsonl
+#
+# Environment:
+#   AUTOPD_PROFILE_LOG   JSON-lines event log (run only executes the program when it is not set)
+#   AUTOPD_STAGE         Stage name of the event (default: AUTOPD_JOB_NAME of scheduler.py, or the calling script)
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+# Signals passed on to the profiled program (timeout, scheduler.py and kill send them to the wrapper)
+FORWARDED_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1, signal.SIGUSR2)
+
+
+def calling_script():
+    """Base name of the script that started the wrapper (the parent shell)."""
+    try:
+        with open(f"/proc/{os.getppid()}/cmdline", 'rb') as f:
+            argv = [arg.decode(errors='ignore') for arg in f.read().split(b'\0') if arg]
+    except OSError:
+        return ''
+    for arg in argv[1:]:
+        if not arg.startswith('-'):
+            return os.path.basename(arg)
+    return os.path.basename(argv[0]) if argv else ''
+
+
+def append_event(log_path, event):
+    """One write() per line on an O_APPEND descriptor, so parallel jobs do not interleave."""
+    line = (json.dumps(event, sort_keys=True) + '\n').encode()
+    fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def run_profiled(command):
+    log_path = os.environ.get('AUTOPD_PROFILE_LOG')
+    if not log_path:
+        os.execvp(command[0], command)
+
+    start = time.time()
+    try:
+        process = subprocess.Popen(command)
+    except OSError as error:
+        print(f"{command[0]}: {error.strerror}", file=sys.stderr)
+        return 127
+
+    def forward(signum, _frame):
+        try:
+            process.send_signal(signum)
+        except ProcessLookupError:
+            pass
+
+    for signum in FORWARDED_SIGNALS:
+        signal.signal(signum, forward)
+
+    while True:
+        try:
+            _, status, usage = os.wait4(process.pid, 0)
+            break
+        except InterruptedError:
+            continue
+    end = time.time()
+    process.returncode = 0  # Reaped by wait4, keep Popen from waiting again
+
+    if os.WIFSIGNALED(status):
+        returncode = 128 + os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+
+    script = calling_script()
+    append_event(log_path, {
+        'tool': os.path.basename(command[0]),
+        'args': ' '.join(command[1:])[:500],
+        'stage': os.environ.get('AUTOPD_STAGE') or os.environ.get('AUTOPD_JOB_NAME') or script,
+        'script': script,
+        'cwd': os.getcwd(),
+        'host': socket.gethostname(),
+        'pid': process.pid,
+        'start': round(start, 3),
+        'end': round(end, 3),
+        'wall_s': round(end - start, 3),
+        'user_s': round(usage.ru_utime, 3),
+        'sys_s': round(usage.ru_stime, 3),
+        'max_rss_mb': round(usage.ru_maxrss / 1024, 1),
+        'exit_status': returncode,
+    })
+    return returncode
+
+
+def read_events(log_path):
+    events = []
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    pass
+    return events
+
+
+def format_seconds(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}h {(seconds % 3600) // 60}m {seconds % 60}s"
+
+
+def busy_time(intervals):
+    """Length of the union of (start, end) intervals."""
+    total = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+def critical_path(events):
+    """
+    Longest chain of calls where each starts after the previous one ended (weighted interval scheduling).
+    It is the serial backbone of the run: shortening anything off this chain does not shorten the run.
+    """
+    ordered = sorted(events, key=lambda e: e['end'])
+    ends = [e['end'] for e in ordered]
+    best = [0.0] * (len(ordered) + 1)
+    take = [False] * (len(ordered) + 1)
+    previous = [0] * (len(ordered) + 1)
+    for i, event in enumerate(ordered, 1):
+        # Number of calls that ended before this one started
+        lo, hi = 0, i - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ends[mid] <= event['start']:
+                lo = mid + 1
+            else:
+                hi = mid
+        previous[i] = lo
+        with_event = best[lo] + event['wall_s']
+        if with_event > best[i - 1]:
+            best[i], take[i] = with_event, True
+        else:
+            best[i] = best[i - 1]
+    chain = []
+    i = len(ordered)
+    while i > 0:
+        if take[i]:
+            chain.append(ordered[i - 1])
+            i = previous[i]
+        else:
+            i -= 1
+    return list(reversed(chain))
+
+
+def summarize(log_path, top=15):
+    events = read_events(log_path)
+    if not events:
+        print(f"No events in {log_path}")
+        return 1
+
+    run_start = min(e['start'] for e in events)
+    run_end = max(e['end'] for e in events)
+    span = run_end - run_start
+    print(f"Profiled calls: {len(events)}    Span: {format_seconds(span)}")
+    print("")
+
+    # Per stage
+    stages = defaultdict(list)
+    for event in events:
+        stages[event['stage']].append(event)
+    print(f"{'Stage':<20}{'Calls':>7}{'Busy':>14}{'CPU':>14}{'Cores used':>12}{'Peak RSS [MB]':>15}{'Failed':>8}")
+    for stage, stage_events in sorted(stages.items(), key=lambda item: min(e['start'] for e in item[1])):
+        busy = busy_time([(e['start'], e['end']) for e in stage_events])
+        cpu = sum(e['user_s'] + e['sys_s'] for e in stage_events)
+        cores = cpu / busy if busy > 0 else 0.0
+        peak = max(e['max_rss_mb'] for e in stage_events)
+        failed = sum(1 for e in stage_events if e['exit_status'] != 0)
+        print(f"{stage:<20}{len(stage_events):>7}{format_seconds(busy):>14}{format_seconds(cpu):>14}"
+              f"{cores:>12.1f}{peak:>15.0f}{failed:>8}")
+    print("")
+
+    # Per tool
+    tools = defaultdict(list)
+    for event in events:
+        tools[event['tool']].append(event)
+    print(f"{'Tool':<28}{'Calls':>7}{'Wall':>14}{'CPU':>14}{'Peak RSS [MB]':>15}")
+    ranked = sorted(tools.items(), key=lambda item: -sum(e['wall_s'] for e in item[1]))
+    for tool, tool_events in ranked[:top]:
+        wall = sum(e['wall_s'] for e in tool_events)
+        cpu = sum(e['user_s'] + e['sys_s'] for e in tool_events)
+        peak = max(e['max_rss_mb'] for e in tool_events)
+        print(f"{tool:<28}{len(tool_events):>7}{format_seconds(wall):>14}{format_seconds(cpu):>14}{peak:>15.0f}")
+    print("")
+
+    # Critical path
+    chain = critical_path(events)
+    chain_wall = sum(e['wall_s'] for e in chain)
+    share = 100 * chain_wall / span if span > 0 else 0.0
+    print(f"Critical path: {format_seconds(chain_wall)} of {format_seconds(span)} ({share:.0f}%)")
+    for event in chain:
+        offset = event['start'] - run_start
+        print(f"  +{format_seconds(offset):>12}  {format_seconds(event['wall_s']):>12}  {event['stage']:<16} {event['script']:<20} {event['tool']}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile external tool calls of AutoPD')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run a program and append its resource usage to AUTOPD_PROFILE_LOG')
+    run_parser.add_argument('program', nargs=argparse.REMAINDER, help='Program and arguments (after --)')
+
+    summary_parser = subparsers.add_parser('summary', help='Summarize a profile log')
+    summary_parser.add_argument('log', help='JSON-lines profile log')
+    summary_parser.add_argument('--top', type=int, default=15, help='Number of tools listed')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        program = args.program[1:] if args.program and args.program[0] == '--' else args.program
+        if not program:
+            parser.error('no program given')
+        sys.exit(run_profiled(program))
+    sys.exit(summarize(args.log, args.top))
+
+
+if __name__ == '__main__':
+    main()
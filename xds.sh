@@ -11,7 +11,7 @@
 #   ./xds.sh round=1 flag=0 sp="P212121" cell_constants="78.3 84.1 96.5 90 90 90"
 #
 # Required Environment Variables:
-#   SOURCE_DIR     Path to helper scripts (e.g., generate_XDS.INP, plot.sh, get_sg_number.sh)
+#   SOURCE_DIR     Path to helper scripts (e.g., generate_XDS.INP, get_sg_number.sh)
 #   DATA_PATH      Directory containing diffraction image files
 #   FILE_TYPE      Format of diffraction images (e.g., h5, cbf, bz2, img)
 #
@@ -22,6 +22,13 @@
 #   ROTATION_AXIS            Rotation axis vector (comma-separated, e.g. "1,0,0")
 #   SPACE_GROUP              Space group symbol (e.g., "P212121")
 #   UNIT_CELL_CONSTANTS      Unit cell parameters "a b c alpha beta gamma"
+#   AUTOPD_NPROC             CPU slots granted by scheduler.py (default: all CPUs)
+#   XDS_REUSE                true/false: Round 2 reuses spots and integration of round 1 (default: true)
+#   XDS_NODES                INTEGRATE split over N local jobs (number) or over hosts (comma-separated list)
+#   XDS_SUBMIT               Command template of the INTEGRATE jobs (see xds_integrate.py)
+#   STREAM                   true: frames are still being collected, INTEGRATE follows them (stream_watch.py)
+#   STREAM_FRAMES            Expected number of frames of the sweep in stream mode
+#   STREAM_IDLE              Seconds without a new frame that end the sweep in stream mode (default: 60)
 #
 # Exit Codes:
 #   0  Success
@@ -175,202 +182,339 @@ if [ -n "${UNIT_CELL_CONSTANTS}" ]; then
     sed -i "s/UNIT_CELL_CONSTANTS=.*$/UNIT_CELL_CONSTANTS=${UNIT_CELL_CONSTANTS}/g" XDS.INP
 fi
 
-#############################################
-# Run XDS pipeline step by step
-# (XYCORR → INIT → COLSPOT → IDXREF → DEFPIX → INTEGRATE → CORRECT, etc.)
-#############################################
-# Each step edits XDS.INP with the appropriate JOB keyword,
-# runs XDS or xds_par, saves logs and input snapshots, and checks for errors.
-
-#1_XYCORR
-sed -i 's/JOB=.*$/JOB= XYCORR/g' XDS.INP
-xds > XYCORR.log
-cp XDS.INP XYCORR.INP
-cp XYCORR.INP 1_XYCORR.INP
-cp XYCORR.log 1_XYCORR.log
-
-if [ ! -f "XYCORR.LP" ]; then
-    FLAG_XDS=0
-    echo "FLAG_XDS=${FLAG_XDS}" >> ../../temp.txt
-    echo "Round ${ROUND} XDS processing failed!"
-    exit 1
+# Apply CPU budget (slots handed out by scheduler.py, split over the forked jobs)
+NPROC=${AUTOPD_NPROC:-$(nproc)}
+XDS_JOBS=2
+XDS_PROCESSORS=$(( NPROC / XDS_JOBS ))
+XDS_PROCESSORS=$(( XDS_PROCESSORS > 0 ? XDS_PROCESSORS : 1 ))
+sed -i "/^JOB=/a MAXIMUM_NUMBER_OF_JOBS=${XDS_JOBS}\nMAXIMUM_NUMBER_OF_PROCESSORS=${XDS_PROCESSORS}" XDS.INP
+
+# Distributed INTEGRATE (xds_integrate.py): XDS_NODES is a number of local jobs or a comma-separated host list
+INTEGRATE_ARGS=()
+if [[ "${XDS_NODES}" =~ ^[0-9]+$ ]]; then
+    INTEGRATE_ARGS=(--jobs ${XDS_NODES} --processors ${NPROC})
+elif [ -n "${XDS_NODES}" ]; then
+    INTEGRATE_ARGS=(--hosts ${XDS_NODES})
 fi
-
-cp XYCORR.LP 1_XYCORR.LP
-cat XYCORR.log >> XDS_${ROUND}.log
-echo "" >> XDS_${ROUND}.log
-
-#2_INIT
-sed -i 's/JOB=.*$/JOB= INIT/g' XDS.INP
-#Set the number of processors to be used
-#sed -i '3iMAXIMUM_NUMBER_OF_PROCESSORS=24' XDS.INP
-xds > INIT.log
-cp XDS.INP INIT.INP
-cp INIT.INP 2_INIT.INP
-cp INIT.log 2_INIT.log
-cp INIT.LP 2_INIT.LP
-cat INIT.log >> XDS_${ROUND}.log
-echo "" >> XDS_${ROUND}.log
-
-#3_COLSPOT Set SPOT_RANGE=DATA_RANGE
-sed -i 's/JOB=.*$/JOB= COLSPOT/g' XDS.INP
-#sed -i 's/MAXIMUM_NUMBER_OF_PROCESSORS=.*$/!MAXIMUM_NUMBER_OF_PROCESSORS=24/g' XDS.INP
-#DATA_RANGE=$(grep 'DATA_RANGE=' XDS.INP | cut -d '=' -f 2)
-#sed -i "s/SPOT_RANGE=.*$/SPOT_RANGE=${DATA_RANGE}/g" XDS.INP
-xds_par > COLSPOT.log
-cp XDS.INP COLSPOT.INP
-cp COLSPOT.INP 3_COLSPOT.INP
-cp COLSPOT.log 3_COLSPOT.log
-cp COLSPOT.LP 3_COLSPOT.LP
-cat COLSPOT.log >> XDS_${ROUND}.log
-echo "" >> XDS_${ROUND}.log
-
-#4_IDXREF
-sed -i 's/JOB=.*$/JOB= IDXREF/g' XDS.INP
-#sed -i 's/REFINE(IDXREF)=.*$/REFINE(IDXREF)= POSITION CELL BEAM ORIENTATION AXIS/g' XDS.INP
-xds_par > IDXREF.log
-cp XDS.INP IDXREF.INP
-cp IDXREF.INP 4_IDXREF.INP
-cp IDXREF.log 4_IDXREF.log
-cp IDXREF.LP 4_IDXREF.LP
-
-if [ ! -f "XPARM.XDS" ]; then
-    FLAG_XDS=0
-    echo "FLAG_XDS=${FLAG_XDS}" >> ../../temp.txt
-    echo "Round ${ROUND} XDS processing failed!"
-    exit 1
+if [ ${#INTEGRATE_ARGS[@]} -gt 0 ] && [ -n "${XDS_SUBMIT}" ]; then
+    INTEGRATE_ARGS+=(--submit "${XDS_SUBMIT}")
 fi
 
-cp XPARM.XDS 4_XPARM.XDS
-cat IDXREF.log >> XDS_${ROUND}.log
-echo "" >> XDS_${ROUND}.log
-
-if grep -q "!!! ERROR !!!" "XDS_${ROUND}.log" && ! grep -q "!!! ERROR !!! INSUFFICIENT PERCENTAGE (< 50%) OF INDEXED REFLECTIONS" "XDS_${ROUND}.log"; then
-    FLAG_XDS=0
-    echo "FLAG_XDS=${FLAG_XDS}" >> ../../temp.txt
-    echo "Round ${ROUND} XDS processing failed!"
-    exit 1
+# Stream mode (round 1, one file per frame): INTEGRATE in chunks while the frames are collected
+STREAMING=false
+if [ "${STREAM}" = "true" ] && [ "${ROUND}" = "1" ] && [ "${FILE_TYPE}" != "h5" ]; then
+    STREAMING=true
+    STREAM_ARGS=(--idle ${STREAM_IDLE:-60} --processors ${NPROC})
+    if [ -n "${STREAM_FRAMES}" ]; then
+        STREAM_ARGS+=(--frames ${STREAM_FRAMES})
+    fi
 fi
 
-#5_DEFPIX Update UNTRUSTED_ELLIPSE ORGX ORGY DETECTOR_DISTANCE ROTATION_AXIS INCIDENT_BEAM_DIRECTION
-sed -i 's/JOB=.*$/JOB= DEFPIX/g' XDS.INP
-#ORGX=$(awk 'NR == 9 {print $1}' 4_XPARM.XDS)
-#ORGY=$(awk 'NR == 9 {print $2}' 4_XPARM.XDS)
-#sed -i "s/ORGX=.*$/ORGX= ${ORGX} ORGY= ${ORGY}/g" XDS.INP
-#DETECTOR_DISTANCE=$(awk 'NR == 9 {print $3}' 4_XPARM.XDS)
-#sed -i "s/DETECTOR_DISTANCE=.*$/DETECTOR_DISTANCE= ${DETECTOR_DISTANCE}/g" XDS.INP
-#ROTATION_AXIS=$(awk 'NR == 2 {print $4, $5, $6}' 4_XPARM.XDS)
-#sed -i "s/ROTATION_AXIS=.*$/ROTATION_AXIS= ${ROTATION_AXIS}/g" XDS.INP
-#INCIDENT_BEAM_DIRECTION=$(awk 'NR == 3 {print $2, $3, $4}' 4_XPARM.XDS)
-#sed -i "s/INCIDENT_BEAM_DIRECTION=.*$/INCIDENT_BEAM_DIRECTION= ${INCIDENT_BEAM_DIRECTION}/g" XDS.INP
-xds > DEFPIX.log
-cp XDS.INP DEFPIX.INP
-cp DEFPIX.INP 5_DEFPIX.INP
-cp DEFPIX.log 5_DEFPIX.log
-cp DEFPIX.LP 5_DEFPIX.LP
-cat DEFPIX.log >> XDS_${ROUND}.log
-echo "" >> XDS_${ROUND}.log
-
-#6_INTEGRATE
-#SPACE_GROUP_NUMBER=$(awk 'NR == 4 {print $1}' 4_XPARM.XDS)
-#UNIT_CELL_CONSTANTS=$(awk 'NR == 4 {print $2, $3, $4, $5, $6, $7}' 4_XPARM.XDS)
-#sed -i "s/SPACE_GROUP_NUMBER=.*$/SPACE_GROUP_NUMBER=${SPACE_GROUP_NUMBER}/g" XDS.INP
-#ssed -i "s/UNIT_CELL_CONSTANTS=.*$/UNIT_CELL_CONSTANTS=${UNIT_CELL_CONSTANTS}/g" XDS.INP
-sed -i 's/JOB=.*$/JOB= INTEGRATE/g' XDS.INP
-#sed -i 's/REFINE(INTEGRATE)=.*$/REFINE(INTEGRATE)= POSITION CELL BEAM ORIENTATION/g' XDS.INP
-
-MAX_RUN_TIME=60m
-timeout $MAX_RUN_TIME xds_par -par NUMBER_OF_FORKED_INTEGRATE_JOBS=2 > INTEGRATE.log
+# INTEGRATE into INTEGRATE.log, distributed if requested (falls back to this host); optional argument: time limit
+run_integrate() {
+    local limit=$1
+    local status
+    if [ ${#INTEGRATE_ARGS[@]} -gt 0 ]; then
+        ${limit:+timeout ${limit}} python3 ${SOURCE_DIR}/xds_integrate.py "${INTEGRATE_ARGS[@]}" > INTEGRATE.log
+        status=$?
+        if [ ${status} -eq 0 ] || [ ${status} -eq 124 ]; then
+            return ${status}
+        fi
+        echo "Distributed INTEGRATE failed, integrating on this host" >> XDS_${ROUND}.log
+    fi
+    ${limit:+timeout ${limit}} ${AUTOPD_PROFILE} xds_par -par NUMBER_OF_FORKED_INTEGRATE_JOBS=${XDS_JOBS} > INTEGRATE.log
+}
 
-if [ $? -eq 124 ]; then
-    FLAG_XDS=0
-    echo "FLAG_XDS=${FLAG_XDS}" >> ../../temp.txt
-    echo "Timeout. Round ${ROUND} XDS processing failed!"
-    exit 1
+#############################################
+# Round 2: reuse the artefacts of round 1
+#############################################
+# Only the symmetry changes between the rounds. Detector corrections, background and spots of round 1
+# are reused; its integrated reflections too when the new lattice is compatible (same crystal system
+# and cell in the same setting), in which case only CORRECT and the scaling steps are repeated.
+ROUND_1_DIR=../XDS_1
+REUSE_SPOTS=false
+REUSE_INTEGRATION=false
+
+lattice_compatible() {
+    local old_sg=$(awk 'NR == 4 {print $1}' ${ROUND_1_DIR}/11_GXPARM.XDS)
+    local old_cell=$(awk 'NR == 4 {print $2, $3, $4, $5, $6, $7}' ${ROUND_1_DIR}/11_GXPARM.XDS)
+    local new_cell=${UNIT_CELL_CONSTANTS//,/ }
+    if [ -z "${SPACE_GROUP_NUMBER}" ] || [ -z "${old_sg}" ] || [ -z "${new_cell}" ]; then
+        return 1
+    fi
+    awk -v old_sg="${old_sg}" -v new_sg="${SPACE_GROUP_NUMBER}" -v old_cell="${old_cell}" -v new_cell="${new_cell}" '
+    function crystal_system(n) {
+        return (n <= 2) ? 1 : (n <= 15) ? 2 : (n <= 74) ? 3 : (n <= 142) ? 4 : (n <= 167) ? 5 : (n <= 194) ? 6 : 7
+    }
+    BEGIN {
+        if (crystal_system(old_sg) != crystal_system(new_sg)) exit 1
+        if (split(old_cell, a, " ") != 6 || split(new_cell, b, " ") != 6) exit 1
+        for (i = 1; i <= 3; i++) if ((a[i] - b[i]) / a[i] > 0.02 || (b[i] - a[i]) / a[i] > 0.02) exit 1
+        for (i = 4; i <= 6; i++) if (a[i] - b[i] > 2 || b[i] - a[i] > 2) exit 1
+        exit 0
+    }'
+}
+
+if [ "${ROUND}" -gt 1 ] && [ "${XDS_REUSE:-true}" = "true" ]; then
+    if [ -f "${ROUND_1_DIR}/X-CORRECTIONS.cbf" ] && [ -f "${ROUND_1_DIR}/BKGINIT.cbf" ] && [ -f "${ROUND_1_DIR}/SPOT.XDS" ]; then
+        cp ${ROUND_1_DIR}/{X-CORRECTIONS,Y-CORRECTIONS,BLANK,BKGINIT,GAIN}.cbf ${ROUND_1_DIR}/SPOT.XDS .
+        cp ${ROUND_1_DIR}/{1_XYCORR,2_INIT,3_COLSPOT}.LP .
+        REUSE_SPOTS=true
+    fi
+    if [ "${REUSE_SPOTS}" = "true" ] && [ -f "${ROUND_1_DIR}/10_INTEGRATE.HKL" ] && [ -f "${ROUND_1_DIR}/11_GXPARM.XDS" ] && lattice_compatible; then
+        cp ${ROUND_1_DIR}/10_INTEGRATE.HKL INTEGRATE.HKL
+        cp ${ROUND_1_DIR}/8_XPARM.XDS XPARM.XDS
+        cp ${ROUND_1_DIR}/{BKGPIX,ABS}.cbf . 2>/dev/null
+        cp ${ROUND_1_DIR}/{8_XPARM.XDS,10_INTEGRATE.LP} .
+        REUSE_INTEGRATION=true
+    fi
 fi
 
-cp XDS.INP INTEGRATE.INP
-cp INTEGRATE.INP 6_INTEGRATE.INP
-cp INTEGRATE.log 6_INTEGRATE.log
-cp INTEGRATE.LP 6_INTEGRATE.LP
-cp INTEGRATE.HKL 6_INTEGRATE.HKL 2>/dev/null
-cat INTEGRATE.log >> XDS_${ROUND}.log
-echo "" >> XDS_${ROUND}.log
-
-#7_CORRECT
-sed -i 's/JOB=.*$/JOB= CORRECT/g' XDS.INP
-#sed -i 's/! STRICT_ABSORPTION_CORRECTION=.*$/STRICT_ABSORPTION_CORRECTION=TRUE/g' XDS.INP
-xds_par > CORRECT.log
-cp XDS.INP CORRECT.INP
-cp CORRECT.INP 7_CORRECT.INP
-cp CORRECT.log 7_CORRECT.log
-cp CORRECT.LP 7_CORRECT.LP
+#############################################
+# Run XDS pipeline step by step
+# (XYCORR → INIT → COLSPOT → IDXREF → DEFPIX → INTEGRATE → CORRECT, etc.)
+#############################################
+# Each step edits XDS.INP with the appropriate JOB keyword,
+# runs XDS or xds_par, saves logs and input snapshots, and checks for errors.
 
-if [ ! -f "GXPARM.XDS" ]; then
-    FLAG_XDS=0
-    echo "FLAG_XDS=${FLAG_XDS}" >> ../../temp.txt
-    echo "Round ${ROUND} XDS processing failed!"
-    exit 1
+if [ "${REUSE_SPOTS}" = "true" ]; then
+    echo "XYCORR, INIT and COLSPOT reused from round 1" >> XDS_${ROUND}.log
+    echo "" >> XDS_${ROUND}.log
+else
+    #1_XYCORR
+    sed -i 's/JOB=.*$/JOB= XYCORR/g' XDS.INP
+    ${AUTOPD_PROFILE} xds > XYCORR.log
+    cp XDS.INP XYCORR.INP
+    cp XYCORR.INP 1_XYCORR.INP
+    cp XYCORR.log 1_XYCORR.log
+
+    if [ ! -f "XYCORR.LP" ]; then
+        FLAG_XDS=0
+        echo "FLAG_XDS=${FLAG_XDS}" >> ../../temp.txt
+        echo "Round ${ROUND} XDS processing failed!"
+        exit 1
+    fi
+
+    cp XYCORR.LP 1_XYCORR.LP
+    cat XYCORR.log >> XDS_${ROUND}.log
+    echo "" >> XDS_${ROUND}.log
+
+    #2_INIT
+    sed -i 's/JOB=.*$/JOB= INIT/g' XDS.INP
+    #Set the number of processors to be used
+    #sed -i '3iMAXIMUM_NUMBER_OF_PROCESSORS=24' XDS.INP
+    ${AUTOPD_PROFILE} xds > INIT.log
+    cp XDS.INP INIT.INP
+    cp INIT.INP 2_INIT.INP
+    cp INIT.log 2_INIT.log
+    cp INIT.LP 2_INIT.LP
+    cat INIT.log >> XDS_${ROUND}.log
+    echo "" >> XDS_${ROUND}.log
+
+    #3_COLSPOT Set SPOT_RANGE=DATA_RANGE
+    sed -i 's/JOB=.*$/JOB= COLSPOT/g' XDS.INP
+    #sed -i 's/MAXIMUM_NUMBER_OF_PROCESSORS=.*$/!MAXIMUM_NUMBER_OF_PROCESSORS=24/g' XDS.INP
+    #DATA_RANGE=$(grep 'DATA_RANGE=' XDS.INP | cut -d '=' -f 2)
+    #sed -i "s/SPOT_RANGE=.*$/SPOT_RANGE=${DATA_RANGE}/g" XDS.INP
+    ${AUTOPD_PROFILE} xds_par > COLSPOT.log
+    cp XDS.INP COLSPOT.INP
+    cp COLSPOT.INP 3_COLSPOT.INP
+    cp COLSPOT.log 3_COLSPOT.log
+    cp COLSPOT.LP 3_COLSPOT.LP
+    cat COLSPOT.log >> XDS_${ROUND}.log
+    echo "" >> XDS_${ROUND}.log
 fi
 
-cp GXPARM.XDS 7_GXPARM.XDS
-cp XDS_ASCII.HKL 7_XDS_ASCII.HKL
-cat CORRECT.log >> XDS_${ROUND}.log
-echo "" >> XDS_${ROUND}.log
-
-#8_IDXREF Update SPACE_GROUP_NUMBER UNIT_CELL_CONSTANTS
-cp 4_IDXREF.INP XDS.INP
-if [ -n "${SPACE_GROUP}" ]; then
-    SPACE_GROUP_NUMBER=$(${SOURCE_DIR}/get_sg_number.sh "${SPACE_GROUP}")
+if [ "${REUSE_INTEGRATION}" = "true" ]; then
+    # CORRECT of round 1 with the new space group and cell
+    echo "IDXREF, DEFPIX and INTEGRATE reused from round 1 (lattice compatible with SPACE_GROUP_NUMBER=${SPACE_GROUP_NUMBER})" >> XDS_${ROUND}.log
+    echo "" >> XDS_${ROUND}.log
+    cp ${ROUND_1_DIR}/11_CORRECT.INP XDS.INP
+    sed -i "s/SPACE_GROUP_NUMBER=.*$/SPACE_GROUP_NUMBER=${SPACE_GROUP_NUMBER}/g" XDS.INP
+    sed -i "s/UNIT_CELL_CONSTANTS=.*$/UNIT_CELL_CONSTANTS=${UNIT_CELL_CONSTANTS}/g" XDS.INP
+    sed -i "s/MAXIMUM_NUMBER_OF_PROCESSORS=.*$/MAXIMUM_NUMBER_OF_PROCESSORS=${XDS_PROCESSORS}/g" XDS.INP
 else
-    SPACE_GROUP_NUMBER=$(awk 'NR == 4 {print $1}' 7_GXPARM.XDS)
+    #4_IDXREF
+    sed -i 's/JOB=.*$/JOB= IDXREF/g' XDS.INP
+    #sed -i 's/REFINE(IDXREF)=.*$/REFINE(IDXREF)= POSITION CELL BEAM ORIENTATION AXIS/g' XDS.INP
+    ${AUTOPD_PROFILE} xds_par > IDXREF.log
+    cp XDS.INP IDXREF.INP
+    cp IDXREF.INP 4_IDXREF.INP
+    cp IDXREF.log 4_IDXREF.log
+    cp IDXREF.LP 4_IDXREF.LP
+
+    if [ ! -f "XPARM.XDS" ]; then
+        FLAG_XDS=0
+        echo "FLAG_XDS=${FLAG_XDS}" >> ../../temp.txt
+        echo "Round ${ROUND} XDS processing failed!"
+        exit 1
+    fi
+
+    cp XPARM.XDS 4_XPARM.XDS
+    cat IDXREF.log >> XDS_${ROUND}.log
+    echo "" >> XDS_${ROUND}.log
+
+    if grep -q "!!! ERROR !!!" "XDS_${ROUND}.log" && ! grep -q "!!! ERROR !!! INSUFFICIENT PERCENTAGE (< 50%) OF INDEXED REFLECTIONS" "XDS_${ROUND}.log"; then
+        FLAG_XDS=0
+        echo "FLAG_XDS=${FLAG_XDS}" >> ../../temp.txt
+        echo "Round ${ROUND} XDS processing failed!"
+        exit 1
+    fi
+
+    #5_DEFPIX Update UNTRUSTED_ELLIPSE ORGX ORGY DETECTOR_DISTANCE ROTATION_AXIS INCIDENT_BEAM_DIRECTION
+    sed -i 's/JOB=.*$/JOB= DEFPIX/g' XDS.INP
+    #ORGX=$(awk 'NR == 9 {print $1}' 4_XPARM.XDS)
+    #ORGY=$(awk 'NR == 9 {print $2}' 4_XPARM.XDS)
+    #sed -i "s/ORGX=.*$/ORGX= ${ORGX} ORGY= ${ORGY}/g" XDS.INP
+    #DETECTOR_DISTANCE=$(awk 'NR == 9 {print $3}' 4_XPARM.XDS)
+    #sed -i "s/DETECTOR_DISTANCE=.*$/DETECTOR_DISTANCE= ${DETECTOR_DISTANCE}/g" XDS.INP
+    #ROTATION_AXIS=$(awk 'NR == 2 {print $4, $5, $6}' 4_XPARM.XDS)
+    #sed -i "s/ROTATION_AXIS=.*$/ROTATION_AXIS= ${ROTATION_AXIS}/g" XDS.INP
+    #INCIDENT_BEAM_DIRECTION=$(awk 'NR == 3 {print $2, $3, $4}' 4_XPARM.XDS)
+    #sed -i "s/INCIDENT_BEAM_DIRECTION=.*$/INCIDENT_BEAM_DIRECTION= ${INCIDENT_BEAM_DIRECTION}/g" XDS.INP
+    ${AUTOPD_PROFILE} xds > DEFPIX.log
+    cp XDS.INP DEFPIX.INP
+    cp DEFPIX.INP 5_DEFPIX.INP
+    cp DEFPIX.log 5_DEFPIX.log
+    cp DEFPIX.LP 5_DEFPIX.LP
+    cat DEFPIX.log >> XDS_${ROUND}.log
+    echo "" >> XDS_${ROUND}.log
+
+    #6_INTEGRATE
+    #SPACE_GROUP_NUMBER=$(awk 'NR == 4 {print $1}' 4_XPARM.XDS)
+    #UNIT_CELL_CONSTANTS=$(awk 'NR == 4 {print $2, $3, $4, $5, $6, $7}' 4_XPARM.XDS)
+    #sed -i "s/SPACE_GROUP_NUMBER=.*$/SPACE_GROUP_NUMBER=${SPACE_GROUP_NUMBER}/g" XDS.INP
+    #ssed -i "s/UNIT_CELL_CONSTANTS=.*$/UNIT_CELL_CONSTANTS=${UNIT_CELL_CONSTANTS}/g" XDS.INP
+    sed -i 's/JOB=.*$/JOB= INTEGRATE/g' XDS.INP
+    #sed -i 's/REFINE(INTEGRATE)=.*$/REFINE(INTEGRATE)= POSITION CELL BEAM ORIENTATION/g' XDS.INP
+
+    MAX_RUN_TIME=60m
+    if [ "${STREAMING}" = "true" ]; then
+        # No time limit: the frames are still being collected
+        python3 ${SOURCE_DIR}/stream_watch.py integrate "${STREAM_ARGS[@]}" > INTEGRATE.log
+        status=$?
+        if [ ${status} -ne 0 ]; then
+            # A failed chunk or watch: integrate the frames on disk once the sweep is complete
+            echo "Streaming INTEGRATE failed (exit code ${status}), integrating the complete sweep" >> XDS_${ROUND}.log
+            first=$(grep 'DATA_RANGE=' XDS.INP | head -1 | cut -d '=' -f 2 | awk '{print $1}')
+            last=$(python3 ${SOURCE_DIR}/stream_watch.py complete "${DATA_PATH}" --idle ${STREAM_IDLE:-60} ${STREAM_FRAMES:+--frames ${STREAM_FRAMES}} | sed -n 's/.*images [0-9]* - \([0-9]*\).*/\1/p')
+            if [ -n "${STREAM_FRAMES}" ] && [ -n "${last}" ] && [ ${last} -gt $((first + STREAM_FRAMES - 1)) ]; then
+                last=$((first + STREAM_FRAMES - 1))
+            fi
+            if [ -n "${last}" ]; then
+                sed -i "s/DATA_RANGE=.*$/DATA_RANGE=${first} ${last}/g" XDS.INP
+            fi
+            run_integrate ${MAX_RUN_TIME}
+            status=$?
+        fi
+    else
+        run_integrate ${MAX_RUN_TIME}
+        status=$?
+    fi
+
+    if [ ${status} -eq 124 ]; then
+        FLAG_XDS=0
+        echo "FLAG_XDS=${FLAG_XDS}" >> ../../temp.txt
+        echo "Timeout. Round ${ROUND} XDS processing failed!"
+        exit 1
+    fi
+
+    cp XDS.INP INTEGRATE.INP
+    cp INTEGRATE.INP 6_INTEGRATE.INP
+    cp INTEGRATE.log 6_INTEGRATE.log
+    cp INTEGRATE.LP 6_INTEGRATE.LP
+    cp INTEGRATE.HKL 6_INTEGRATE.HKL 2>/dev/null
+    cat INTEGRATE.log >> XDS_${ROUND}.log
+    echo "" >> XDS_${ROUND}.log
+
+    #7_CORRECT
+    sed -i 's/JOB=.*$/JOB= CORRECT/g' XDS.INP
+    #sed -i 's/! STRICT_ABSORPTION_CORRECTION=.*$/STRICT_ABSORPTION_CORRECTION=TRUE/g' XDS.INP
+    ${AUTOPD_PROFILE} xds_par > CORRECT.log
+    cp XDS.INP CORRECT.INP
+    cp CORRECT.INP 7_CORRECT.INP
+    cp CORRECT.log 7_CORRECT.log
+    cp CORRECT.LP 7_CORRECT.LP
+
+    if [ ! -f "GXPARM.XDS" ]; then
+        FLAG_XDS=0
+        echo "FLAG_XDS=${FLAG_XDS}" >> ../../temp.txt
+        echo "Round ${ROUND} XDS processing failed!"
+        exit 1
+    fi
+
+    cp GXPARM.XDS 7_GXPARM.XDS
+    cp XDS_ASCII.HKL 7_XDS_ASCII.HKL
+    cat CORRECT.log >> XDS_${ROUND}.log
+    echo "" >> XDS_${ROUND}.log
+
+    if [ "${STREAMING}" = "true" ]; then
+        # Stream mode: no second integration pass after collection, CORRECT with the lattice of step 7
+        cp 7_CORRECT.INP XDS.INP
+        if [ -n "${SPACE_GROUP}" ]; then
+            SPACE_GROUP_NUMBER=$(${SOURCE_DIR}/get_sg_number.sh "${SPACE_GROUP}")
+        else
+            SPACE_GROUP_NUMBER=$(awk 'NR == 4 {print $1}' 7_GXPARM.XDS)
+        fi
+        UNIT_CELL_CONSTANTS=$(awk 'NR == 4 {print $2, $3, $4, $5, $6, $7}' 7_GXPARM.XDS)
+        sed -i "s/SPACE_GROUP_NUMBER=.*$/SPACE_GROUP_NUMBER=${SPACE_GROUP_NUMBER}/g" XDS.INP
+        sed -i "s/UNIT_CELL_CONSTANTS=.*$/UNIT_CELL_CONSTANTS=${UNIT_CELL_CONSTANTS}/g" XDS.INP
+    else
+        #8_IDXREF Update SPACE_GROUP_NUMBER UNIT_CELL_CONSTANTS
+        cp 4_IDXREF.INP XDS.INP
+        if [ -n "${SPACE_GROUP}" ]; then
+            SPACE_GROUP_NUMBER=$(${SOURCE_DIR}/get_sg_number.sh "${SPACE_GROUP}")
+        else
+            SPACE_GROUP_NUMBER=$(awk 'NR == 4 {print $1}' 7_GXPARM.XDS)
+        fi
+        UNIT_CELL_CONSTANTS=$(awk 'NR == 4 {print $2, $3, $4, $5, $6, $7}' 7_GXPARM.XDS)
+        sed -i "s/SPACE_GROUP_NUMBER=.*$/SPACE_GROUP_NUMBER=${SPACE_GROUP_NUMBER}/g" XDS.INP
+        sed -i "s/UNIT_CELL_CONSTANTS=.*$/UNIT_CELL_CONSTANTS=${UNIT_CELL_CONSTANTS}/g" XDS.INP
+        ${AUTOPD_PROFILE} xds_par > IDXREF.log
+        cp XDS.INP IDXREF.INP
+        cp IDXREF.INP 8_IDXREF.INP
+        cp IDXREF.log 8_IDXREF.log
+        cp IDXREF.LP 8_IDXREF.LP
+        cp XPARM.XDS 8_XPARM.XDS
+        cat IDXREF.log >> XDS_${ROUND}.log
+        echo "" >> XDS_${ROUND}.log
+
+        #9_DEFPIX Update DETECTOR_DISTANCE ROTATION_AXIS INCIDENT_BEAM_DIRECTION
+        cp 7_CORRECT.INP XDS.INP
+        sed -i 's/JOB=.*$/JOB= DEFPIX/g' XDS.INP
+        ORGX=$(awk 'NR == 9 {print $1}' 8_XPARM.XDS)
+        ORGY=$(awk 'NR == 9 {print $2}' 8_XPARM.XDS)
+        sed -i "s/ORGX=.*$/ORGX= ${ORGX} ORGY= ${ORGY}/g" XDS.INP
+        DETECTOR_DISTANCE=$(awk 'NR == 9 {print $3}' 8_XPARM.XDS)
+        sed -i "s/DETECTOR_DISTANCE=.*$/DETECTOR_DISTANCE= ${DETECTOR_DISTANCE}/g" XDS.INP
+        ROTATION_AXIS=$(awk 'NR == 2 {print $4, $5, $6}' 8_XPARM.XDS)
+        sed -i "s/ROTATION_AXIS=.*$/ROTATION_AXIS= ${ROTATION_AXIS}/g" XDS.INP
+        INCIDENT_BEAM_DIRECTION=$(awk 'NR == 3 {print $2, $3, $4}' 8_XPARM.XDS)
+        sed -i "s/INCIDENT_BEAM_DIRECTION=.*$/INCIDENT_BEAM_DIRECTION= ${INCIDENT_BEAM_DIRECTION}/g" XDS.INP
+        ${AUTOPD_PROFILE} xds > DEFPIX.log
+        cp XDS.INP DEFPIX.INP
+        cp DEFPIX.INP 9_DEFPIX.INP
+        cp DEFPIX.log 9_DEFPIX.log
+        cp DEFPIX.LP 9_DEFPIX.LP
+        cat DEFPIX.log >> XDS_${ROUND}.log
+        echo "" >> XDS_${ROUND}.log
+
+        #10_INTEGRATE
+        sed -i 's/JOB=.*$/JOB= INTEGRATE/g' XDS.INP
+        run_integrate
+        cp XDS.INP INTEGRATE.INP
+        cp INTEGRATE.INP 10_INTEGRATE.INP
+        cp INTEGRATE.log 10_INTEGRATE.log
+        cp INTEGRATE.LP 10_INTEGRATE.LP
+        cp INTEGRATE.HKL 10_INTEGRATE.HKL 2>/dev/null
+        cat INTEGRATE.log >> XDS_${ROUND}.log
+        echo "" >> XDS_${ROUND}.log
+    fi
 fi
-UNIT_CELL_CONSTANTS=$(awk 'NR == 4 {print $2, $3, $4, $5, $6, $7}' 7_GXPARM.XDS)
-sed -i "s/SPACE_GROUP_NUMBER=.*$/SPACE_GROUP_NUMBER=${SPACE_GROUP_NUMBER}/g" XDS.INP
-sed -i "s/UNIT_CELL_CONSTANTS=.*$/UNIT_CELL_CONSTANTS=${UNIT_CELL_CONSTANTS}/g" XDS.INP
-xds_par > IDXREF.log
-cp XDS.INP IDXREF.INP
-cp IDXREF.INP 8_IDXREF.INP
-cp IDXREF.log 8_IDXREF.log
-cp IDXREF.LP 8_IDXREF.LP
-cp XPARM.XDS 8_XPARM.XDS
-cat IDXREF.log >> XDS_${ROUND}.log
-echo "" >> XDS_${ROUND}.log
-
-#9_DEFPIX Update DETECTOR_DISTANCE ROTATION_AXIS INCIDENT_BEAM_DIRECTION
-cp 7_CORRECT.INP XDS.INP
-sed -i 's/JOB=.*$/JOB= DEFPIX/g' XDS.INP
-ORGX=$(awk 'NR == 9 {print $1}' 8_XPARM.XDS)
-ORGY=$(awk 'NR == 9 {print $2}' 8_XPARM.XDS)
-sed -i "s/ORGX=.*$/ORGX= ${ORGX} ORGY= ${ORGY}/g" XDS.INP
-DETECTOR_DISTANCE=$(awk 'NR == 9 {print $3}' 8_XPARM.XDS)
-sed -i "s/DETECTOR_DISTANCE=.*$/DETECTOR_DISTANCE= ${DETECTOR_DISTANCE}/g" XDS.INP
-ROTATION_AXIS=$(awk 'NR == 2 {print $4, $5, $6}' 8_XPARM.XDS)
-sed -i "s/ROTATION_AXIS=.*$/ROTATION_AXIS= ${ROTATION_AXIS}/g" XDS.INP
-INCIDENT_BEAM_DIRECTION=$(awk 'NR == 3 {print $2, $3, $4}' 8_XPARM.XDS)
-sed -i "s/INCIDENT_BEAM_DIRECTION=.*$/INCIDENT_BEAM_DIRECTION= ${INCIDENT_BEAM_DIRECTION}/g" XDS.INP
-xds > DEFPIX.log
-cp XDS.INP DEFPIX.INP
-cp DEFPIX.INP 9_DEFPIX.INP
-cp DEFPIX.log 9_DEFPIX.log
-cp DEFPIX.LP 9_DEFPIX.LP
-cat DEFPIX.log >> XDS_${ROUND}.log
-echo "" >> XDS_${ROUND}.log
-
-#10_INTEGRATE
-sed -i 's/JOB=.*$/JOB= INTEGRATE/g' XDS.INP
-xds_par -par NUMBER_OF_FORKED_INTEGRATE_JOBS=2 > INTEGRATE.log #
-cp XDS.INP INTEGRATE.INP
-cp INTEGRATE.INP 10_INTEGRATE.INP
-cp INTEGRATE.log 10_INTEGRATE.log
-cp INTEGRATE.LP 10_INTEGRATE.LP
-cp INTEGRATE.HKL 10_INTEGRATE.HKL 2>/dev/null
-cat INTEGRATE.log >> XDS_${ROUND}.log
-echo "" >> XDS_${ROUND}.log
 
 #11_CORRECT
 sed -i 's/JOB=.*$/JOB= CORRECT/g' XDS.INP
-xds_par > CORRECT.log
+${AUTOPD_PROFILE} xds_par > CORRECT.log
 cp XDS.INP CORRECT.INP
 cp CORRECT.INP 11_CORRECT.INP
 cp CORRECT.log 11_CORRECT.log
@@ -384,7 +528,7 @@ echo "" >> XDS_${ROUND}.log
 # Scaling, merging, and resolution estimation
 #############################################
 #12_XSCALE with xscale_par
-xscale_par > XSCALE.log
+${AUTOPD_PROFILE} xscale_par > XSCALE.log
 cp XSCALE.log 12_XSCALE.log
 cp XSCALE.INP 12_XSCALE.INP
 cp XSCALE.LP 12_XSCALE.LP
@@ -392,7 +536,7 @@ cat XSCALE.log >> XDS_${ROUND}.log
 echo "" >> XDS_${ROUND}.log
 
 #13_pointless for HKL to mtz
-pointless xdsin XDS_XSCALE.HKL hklout pointless.mtz > pointless.log
+${AUTOPD_PROFILE} pointless xdsin XDS_XSCALE.HKL hklout pointless.mtz > pointless.log
 cp pointless.log 13_pointless.log
 cp pointless.mtz 13_pointless.mtz
 cat pointless.log >> XDS_${ROUND}.log
@@ -400,7 +544,7 @@ echo "" >> XDS_${ROUND}.log
 
 #14_aimless
 {
-aimless hklin pointless.mtz hklout XDS.mtz xmlout aimless.xml scalepack XDS.sca > aimless.log << EOF
+${AUTOPD_PROFILE} aimless hklin pointless.mtz hklout XDS.mtz xmlout aimless.xml scalepack XDS.sca > aimless.log << EOF
 RUN 1 ALL
 BINS 20
 ANOMALOUS ON
@@ -425,7 +569,7 @@ if [ ! -f "XDS_unmerged.mtz" ]; then
 fi
 
 #15_dials.estimate_resolution to refine resolution limit cc_half=0.3 misigma=2.0 completeness=0.85
-dials.estimate_resolution XDS_unmerged.mtz > /dev/null
+${AUTOPD_PROFILE} dials.estimate_resolution XDS_unmerged.mtz > /dev/null
 cp dials.estimate_resolution.log 15_dials.estimate_resolution.log
 cp dials.estimate_resolution.html 15_dials.estimate_resolution.html
 cat dials.estimate_resolution.log >> XDS_${ROUND}.log
@@ -435,7 +579,7 @@ resolution=${resolution:-0}
 
 #16_aimless for merging with resolution cutoff
 {
-aimless hklin pointless.mtz hklout XDS.mtz xmlout aimless.xml scalepack XDS.sca > aimless.log << EOF
+${AUTOPD_PROFILE} aimless hklin pointless.mtz hklout XDS.mtz xmlout aimless.xml scalepack XDS.sca > aimless.log << EOF
 RUN 1 ALL
 BINS 20
 ANOMALOUS ON
@@ -452,7 +596,9 @@ cp aimless.xml 16_aimless.xml
 cat aimless.log >> XDS_${ROUND}.log
 echo "" >> XDS_${ROUND}.log
 
-Rmeas_XDS=$(grep 'Rmeas (all I+ & I-)' 16_aimless.log | awk '{print $6}')
+# Statistics of this round (ctruncate has not run yet); XDS_SUMMARY gets the full document below
+python3 ${SOURCE_DIR}/dr_parse.py parse --aimless aimless.log --ctruncate ctruncate.log --pointless pointless.log --json XDS_STATISTICS.json > /dev/null
+Rmeas_XDS=$(python3 ${SOURCE_DIR}/dr_parse.py get XDS_STATISTICS.json overall.rmeas)
 Rmeas_XDS=${Rmeas_XDS:-0}
 
 if [ $(echo "${Rmeas_XDS} <= 0" | bc) -eq 1 ] || [ $(echo "${Rmeas_XDS} >= 100" | bc) -eq 1 ];then
@@ -466,7 +612,7 @@ fi
 
 #17_ctruncate to generate truncated intensities
 {
-ctruncate -mtzin XDS.mtz -mtzout XDS_truncated.mtz -colin '/*/*/[IMEAN,SIGIMEAN]' -colano '/*/*/[I(+),SIGI(+),I(-),SIGI(-)]' > ctruncate.log
+${AUTOPD_PROFILE} ctruncate -mtzin XDS.mtz -mtzout XDS_truncated.mtz -colin '/*/*/[IMEAN,SIGIMEAN]' -colano '/*/*/[I(+),SIGI(+),I(-),SIGI(-)]' > ctruncate.log
 } 2>/dev/null
 
 cp ctruncate.log 17_ctruncate.log
@@ -481,7 +627,7 @@ if [ ! -f "XDS_truncated.mtz" ]; then
 fi
 
 #18_freeR_flag to assign R-free set
-freerflag hklin XDS_truncated.mtz hklout XDS_free.mtz > freeR_flag.log 2>/dev/null << EOF
+${AUTOPD_PROFILE} freerflag hklin XDS_truncated.mtz hklout XDS_free.mtz > freeR_flag.log 2>/dev/null << EOF
 FREERFRAC 0.05
 UNIQUE
 EOF
@@ -511,7 +657,7 @@ distance_refined=$(grep "CRYSTAL TO DETECTOR DISTANCE (mm)" XDS_${ROUND}/CORRECT
 echo "Distance_refined               [mm] = ${distance_refined}" >> XDS_SUMMARY/XDS_SUMMARY.log
 beam_center_refined=$(grep "DETECTOR COORDINATES (PIXELS) OF DIRECT BEAM" XDS_${ROUND}/CORRECT.LP | awk '{print $7 "," $8}')
 echo "Beam_center_refined         [pixel] = ${beam_center_refined}" >> XDS_SUMMARY/XDS_SUMMARY.log
-${SOURCE_DIR}/dr_log.sh XDS_${ROUND}/aimless.log XDS_${ROUND}/ctruncate.log XDS_${ROUND}/pointless.log >> XDS_SUMMARY/XDS_SUMMARY.log
+python3 ${SOURCE_DIR}/dr_parse.py parse --aimless XDS_${ROUND}/aimless.log --ctruncate XDS_${ROUND}/ctruncate.log --pointless XDS_${ROUND}/pointless.log --json XDS_SUMMARY/XDS_STATISTICS.json >> XDS_SUMMARY/XDS_SUMMARY.log
 
 #For invoking in autopipeline_parrallel.sh
 echo "FLAG_XDS=1" >> ../temp.txt
@@ -523,29 +669,7 @@ if grep -q "strong anomalous signal" "XDS_SUMMARY/XDS_SUMMARY.log" && grep -q "E
     cp XDS_SUMMARY/XDS.mtz ../SAD_INPUT
 fi
 
-#Extract statistics data
-mkdir -p STATISTICS_FIGURES
-cd STATISTICS_FIGURES
-#cchalf_vs_resolution
-grep -A25 '$TABLE:  Correlations CC(1/2) within dataset' ../XDS_${ROUND}/aimless.log | tail -20 > cchalf_vs_resolution.dat
-#completeness_vs_resolution
-grep -A24 '$TABLE:  Completeness & multiplicity v. resolution' ../XDS_${ROUND}/aimless.log | tail -20 > completeness_vs_resolution.dat
-#i_over_sigma_vs_resolution & rmerge_rmeans_rpim_vs_resolution
-grep -m1 -A28 '$TABLE:  Analysis against resolution' ../XDS_${ROUND}/aimless.log | tail -20 > analysis_vs_resolution.dat
-#scales_vs_batch
-start=$(($(grep -n '    N  Run    Phi    Batch     Mn(k)        0k      Number   Bfactor    Bdecay' ../XDS_${ROUND}/aimless.log | head -1 | cut -d ':' -f 1)+1))
-end=$(($(grep -n '    N  Run    Phi    Batch     Mn(k)        0k      Number   Bfactor    Bdecay' ../XDS_${ROUND}/aimless.log | tail -1 | cut -d ':' -f 1)-2))
-sed -n "${start},${end}p" ../XDS_${ROUND}/aimless.log > scales_vs_batch.dat
-#rmerge_and_i_over_sigma_vs_batch
-start=$(($(grep -n '    N   Batch    Mn(I)   RMSdev  I/rms  Rmerge    Number  Nrej Cm%poss  AnoCmp MaxRes CMlplc   Chi^2  Chi^2c SmRmerge' ../XDS_${ROUND}/aimless.log | head -1 | cut -d ':' -f 1)+1))
-end=$(($(grep -n '    N   Batch    Mn(I)   RMSdev  I/rms  Rmerge    Number  Nrej Cm%poss  AnoCmp MaxRes CMlplc   Chi^2  Chi^2c SmRmerge' ../XDS_${ROUND}/aimless.log | tail -1 | cut -d ':' -f 1)-2))
-sed -n "${start},${end}p" ../XDS_${ROUND}/aimless.log > rmerge_and_i_over_sigma_vs_batch.dat
-#L_test
-grep -A24 '$TABLE: L test for twinning:' ../XDS_${ROUND}/ctruncate.log | tail -21 > L_test.dat
-L_statistic=$(grep 'L statistic =' ../XDS_${ROUND}/ctruncate.log | awk '{print $4}')
-
-# Generate plots from AIMLESS and CTRUNCATE logs
-${SOURCE_DIR}/plot.sh ${L_statistic}
+# Figures of all pipelines are plotted once by data_reduction.sh (plot_stats.py)
 
 #############################################
 # Timing information
@@ -555,7 +679,7 @@ total_time=$((end_time - start_time))
 hours=$((total_time / 3600))
 minutes=$(( (total_time % 3600) / 60 ))
 seconds=$((total_time % 60))
-echo "Total time: ${hours}h ${minutes}m ${seconds}s" >> ../XDS_${ROUND}/XDS_${ROUND}.log
+echo "Total time: ${hours}h ${minutes}m ${seconds}s" >> XDS_${ROUND}/XDS_${ROUND}.log
 
 # Return to main data reduction directory
-cd ../..
+cd ..
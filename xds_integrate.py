@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+#############################################################################################################
+# Script Name: xds_integrate.py
+# Description: Distributed XDS INTEGRATE. The DATA_RANGE of XDS.INP is split into contiguous image ranges,
+#              every range is integrated by its own xds_par run in INTEGRATE_JOBS/job_N (with the XPARM.XDS
+#              and correction/background tables of the current directory), and the partial INTEGRATE.HKL and
+#              INTEGRATE.LP files are merged in image order before CORRECT, as forkxds does with its
+#              MAXIMUM_NUMBER_OF_JOBS batches on one machine.
+#              Two executors run the jobs:
+#                local   processes on this host, sharing --processors CPUs
+#                submit  a command template per job, e.g. "ssh {host} bash {script}" or "sbatch --wait {script}";
+#                        the command must block until the job has finished, the directory must be shared
+#
+# Usage (in the XDS directory, after DEFPIX):
+#   python3 xds_integrate.py --jobs 4 [--processors 32]
+#   python3 xds_integrate.py --hosts node1,node2,node3 [--submit "ssh {host} bash {script}"]
+#
+# Placeholders of --submit:
+#   {script} job script   {dir} job directory   {host} host of the job (from --hosts)   {name} job name
+#
+# Exit Codes:
+#   0  All image ranges integrated, INTEGRATE.HKL and INTEGRATE.LP written
+#   1  A job failed (nothing is merged; the caller can fall back to a single xds_par run)
+#
+# Author: ZHANG Xin
+# Date Created: 2025-09-01
+# Last Modified: 2025-09-01
+#############################################################################################################
+
+import argparse
+import os
+import re
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import time
+
+JOBS_DIR = 'INTEGRATE_JOBS'
+# Files written by XYCORR, INIT, IDXREF and DEFPIX that INTEGRATE reads
+INPUT_FILES = ['XPARM.XDS', 'X-CORRECTIONS.cbf', 'Y-CORRECTIONS.cbf', 'BKGINIT.cbf', 'BLANK.cbf', 'GAIN.cbf',
+               'BKGPIX.cbf', 'ABS.cbf']
+# Fewest images per job; shorter ranges give poorly refined geometry and profiles
+MIN_FRAMES = 50
+POLL_INTERVAL = 2
+
+
+def read_keyword(lines, keyword):
+    for line in lines:
+        stripped = line.split('!', 1)[0]
+        if stripped.strip().startswith(keyword + '='):
+            return stripped.split('=', 1)[1].split()
+    return []
+
+
+def set_keyword(lines, keyword, value):
+    """Replace the keyword line (active or commented out), or append it."""
+    for pattern in (r'^\s*', r'^\s*!\s*'):
+        pattern = re.compile(pattern + re.escape(keyword) + '=')
+        for i, line in enumerate(lines):
+            if pattern.match(line):
+                lines[i] = f"{keyword}={value}"
+                return lines
+    lines.append(f"{keyword}={value}")
+    return lines
+
+
+def split_range(first, last, jobs, min_frames=MIN_FRAMES):
+    """Contiguous (start, end) image ranges of about equal size."""
+    frames = last - first + 1
+    jobs = max(1, min(jobs, frames // min_frames if frames >= min_frames else 1))
+    size, extra = divmod(frames, jobs)
+    ranges = []
+    start = first
+    for i in range(jobs):
+        end = start + size - 1 + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+class IntegrateJob(object):
+    """One image range integrated in its own directory."""
+
+    def __init__(self, index, image_range, host=None):
+        self.name = f"job_{index + 1}"
+        self.image_range = image_range
+        self.host = host
+        self.directory = os.path.abspath(os.path.join(JOBS_DIR, self.name))
+        self.script = os.path.join(self.directory, 'run.sh')
+        self.process = None
+
+    def prepare(self, xds_inp, processors):
+        os.makedirs(self.directory, exist_ok=True)
+        lines = set_keyword(list(xds_inp), 'JOB', ' INTEGRATE')
+        lines = set_keyword(lines, 'DATA_RANGE', f"{self.image_range[0]} {self.image_range[1]}")
+        lines = set_keyword(lines, 'MAXIMUM_NUMBER_OF_JOBS', '1')
+        if processors:
+            lines = set_keyword(lines, 'MAXIMUM_NUMBER_OF_PROCESSORS', str(processors))
+        with open(os.path.join(self.directory, 'XDS.INP'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        for name in INPUT_FILES:
+            if os.path.isfile(name):
+                shutil.copy2(name, self.directory)
+        with open(self.script, 'w', encoding='utf-8') as f:
+            f.write('#!/bin/bash\n')
+            f.write(f"cd {shlex.quote(self.directory)} || exit 1\n")
+            if not processors:
+                # Remote node: use all of its CPUs
+                f.write("sed -i \"s/^MAXIMUM_NUMBER_OF_PROCESSORS=.*$/MAXIMUM_NUMBER_OF_PROCESSORS=$(nproc)/\" XDS.INP\n")
+            f.write('rm -f INTEGRATE.HKL\n')
+            f.write('${AUTOPD_PROFILE} xds_par > INTEGRATE.log 2>&1\n')
+        os.chmod(self.script, 0o755)
+
+    def start(self, submit):
+        log = open(os.path.join(self.directory, 'submit.log'), 'w', encoding='utf-8')
+        if submit:
+            command = submit.format(script=shlex.quote(self.script), dir=shlex.quote(self.directory),
+                                    host=self.host or 'localhost', name=self.name)
+            self.process = subprocess.Popen(command, shell=True, stdout=log, stderr=subprocess.STDOUT,
+                                            start_new_session=True)
+        else:
+            self.process = subprocess.Popen(['bash', self.script], stdout=log, stderr=subprocess.STDOUT,
+                                            start_new_session=True)
+        log.close()
+
+    def succeeded(self):
+        """INTEGRATE.HKL complete; the exit code of submit commands is not reliable."""
+        path = os.path.join(self.directory, 'INTEGRATE.HKL')
+        if not os.path.isfile(path):
+            return False
+        with open(path, 'rb') as f:
+            f.seek(max(0, os.path.getsize(path) - 256))
+            return b'!END_OF_DATA' in f.read()
+
+
+def merge_hkl(jobs, data_range, output='INTEGRATE.HKL'):
+    """Header of the first job (with the full DATA_RANGE), reflections of all jobs in image order."""
+    tmp_path = output + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        for i, job in enumerate(jobs):
+            with open(os.path.join(job.directory, 'INTEGRATE.HKL'), 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.startswith('!'):
+                        if i > 0 or line.startswith('!END_OF_DATA'):
+                            continue
+                        if line.startswith('!DATA_RANGE='):
+                            line = f"!DATA_RANGE={data_range[0]:6d}{data_range[1]:6d}\n"
+                    out.write(line)
+        out.write('!END_OF_DATA\n')
+    os.replace(tmp_path, output)
+
+
+def merge_lp(jobs, output='INTEGRATE.LP'):
+    with open(output, 'w', encoding='utf-8') as out:
+        for job in jobs:
+            out.write(f"\n ***** {job.name}: images {job.image_range[0]} - {job.image_range[1]} *****\n\n")
+            path = os.path.join(job.directory, 'INTEGRATE.LP')
+            if os.path.isfile(path):
+                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                    shutil.copyfileobj(f, out)
+
+
+def run(jobs, submit):
+    for job in jobs:
+        job.start(submit)
+        where = f" on {job.host}" if job.host else ''
+        print(f"{job.name}: images {job.image_range[0]} - {job.image_range[1]}{where}", flush=True)
+
+    def stop(signum, _frame):
+        # timeout in xds.sh or scheduler.py stopping the pipeline
+        for job in jobs:
+            if job.process.poll() is None:
+                try:
+                    os.killpg(job.process.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        sys.exit(128 + signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while any(job.process.poll() is None for job in jobs):
+        time.sleep(POLL_INTERVAL)
+    failed = [job for job in jobs if not job.succeeded()]
+    for job in failed:
+        print(f"{job.name} failed, see {os.path.join(job.directory, 'INTEGRATE.log')}")
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Integrate image ranges with separate xds_par jobs and merge them')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of image ranges (default: number of hosts)')
+    parser.add_argument('--hosts', default='', help='Comma-separated hosts, assigned to the jobs in turn')
+    parser.add_argument('--submit', default=None,
+                        help='Command template per job (default with --hosts: "ssh {host} bash {script}")')
+    parser.add_argument('--processors', type=int, default=None,
+                        help='CPUs shared by the local jobs (default: all CPUs of this host)')
+    parser.add_argument('--min-frames', type=int, default=MIN_FRAMES, help='Fewest images per job')
+    args = parser.parse_args()
+
+    hosts = [host for host in args.hosts.split(',') if host]
+    submit = args.submit or ('ssh {host} bash {script}' if hosts else None)
+    jobs_wanted = args.jobs or len(hosts) or 1
+
+    with open('XDS.INP', 'r', encoding='utf-8', errors='ignore') as f:
+        xds_inp = f.read().splitlines()
+    data_range = [int(value) for value in read_keyword(xds_inp, 'DATA_RANGE')[:2]]
+    if len(data_range) != 2:
+        print("Error: DATA_RANGE not found in XDS.INP")
+        sys.exit(1)
+
+    ranges = split_range(data_range[0], data_range[1], jobs_wanted, args.min_frames)
+    jobs = [IntegrateJob(i, image_range, hosts[i % len(hosts)] if hosts else None) for i, image_range in enumerate(ranges)]
+
+    if submit:
+        # Every node uses its own CPUs
+        processors = None
+    else:
+        total = args.processors or os.cpu_count() or 1
+        processors = max(1, total // len(jobs))
+
+    shutil.rmtree(JOBS_DIR, ignore_errors=True)
+    for job in jobs:
+        job.prepare(xds_inp, processors)
+
+    if not run(jobs, submit):
+        sys.exit(1)
+    merge_hkl(jobs, data_range)
+    merge_lp(jobs)
+    print(f"INTEGRATE.HKL merged from {len(jobs)} jobs")
+
+
+if __name__ == '__main__':
+    main()